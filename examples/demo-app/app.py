@@ -3,38 +3,99 @@ OIB Demo Application with PostgreSQL and Redis
 Demonstrates distributed tracing across multiple services
 """
 
+import io
 import os
+import atexit
+import glob
+import mmap
+import fcntl
+import struct
 import time
 import json
+import sys
+import queue
+import math
 import random
+import select
+import itertools
 import logging
-from functools import wraps
+import logging.handlers
+import hashlib
+import hmac
+import zlib
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import partial, wraps
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, has_request_context, jsonify, request, stream_with_context
+import grpc
 import redis
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.extras import RealDictCursor, execute_values
 
 # OpenTelemetry imports
 from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import (
+    ALWAYS_OFF, Decision, ParentBased, Sampler, SamplingResult, TraceIdRatioBased
+)
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceResponse
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
 from opentelemetry.instrumentation.redis import RedisInstrumentor
 from opentelemetry.instrumentation.psycopg2 import Psycopg2Instrumentor
+from opentelemetry.instrumentation.utils import suppress_instrumentation
+from opentelemetry.trace import SpanContext, SpanKind, StatusCode, TraceFlags
 
 # Prometheus metrics
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+)
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.samples import Exemplar
+from prometheus_client.utils import floatToGoString
 
 # Pyroscope continuous profiling
 import pyroscope
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Optional speedups for cache keys and values
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 logger = logging.getLogger(__name__)
 
+# Logging: JSON lines (or "text"), written by a background thread from a
+# bounded queue; LOG_RATE_LIMITS caps hot-path log_event()s in records/second
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_RATE_LIMITS = {
+    event.strip(): float(rate)
+    for event, rate in (
+        item.split("=") for item in
+        os.getenv("LOG_RATE_LIMITS", "cache_hit=5,cache_miss=5,cache_stale=5,order_created=20").split(",")
+        if item.strip()
+    )
+}
+
 # Environment configuration
 SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "oib-demo-app")
 OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "oib-alloy-telemetry:4317")
@@ -42,6 +103,15 @@ OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "oib-alloy-telemetry:43
 # Pyroscope configuration
 PYROSCOPE_SERVER = os.getenv("PYROSCOPE_SERVER_ADDRESS", "http://oib-pyroscope:4040")
 PYROSCOPE_ENABLED = os.getenv("PYROSCOPE_ENABLED", "true").lower() == "true"
+PYROSCOPE_SAMPLE_RATE = int(os.getenv("PYROSCOPE_SAMPLE_RATE", "100"))
+# Also label samples with the innermost open manual span's name, not just the route
+PYROSCOPE_SPAN_NAME_TAGS = os.getenv("PYROSCOPE_SPAN_NAME_TAGS", "false").lower() == "true"
+# On-demand high-frequency profiling windows (POST /admin/profile)
+PROFILE_WINDOW_MAX_RATE = int(os.getenv("PROFILE_WINDOW_MAX_RATE", "1000"))
+PROFILE_WINDOW_MAX_SECONDS = int(os.getenv("PROFILE_WINDOW_MAX_SECONDS", "300"))
+PROFILE_WINDOW_POLL_INTERVAL = float(os.getenv("PROFILE_WINDOW_POLL_INTERVAL", "1"))
+# Bearer token for /admin endpoints (empty = no authentication)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "oib-postgres")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
@@ -49,200 +119,2637 @@ POSTGRES_USER = os.getenv("POSTGRES_USER", "oib")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "oib_secret")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "oib_demo")
 
+# Connection pool sizing
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "2"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "5"))
+POSTGRES_POOL_MAX_LIFETIME = float(os.getenv("POSTGRES_POOL_MAX_LIFETIME", "1800"))
+POSTGRES_POOL_CHECK_IDLE = float(os.getenv("POSTGRES_POOL_CHECK_IDLE", "10"))
+
+# Read replicas ("host[:port],..."; empty = everything goes to POSTGRES_HOST).
+# Read-only queries are spread over them round_robin or by least_latency; a
+# failing replica is ejected for POSTGRES_REPLICA_EJECT_SECONDS, and a client
+# reads from the primary for POSTGRES_READ_YOUR_WRITES seconds after a write
+POSTGRES_REPLICA_HOSTS = [
+    (host, int(port or POSTGRES_PORT))
+    for host, _, port in (entry.strip().partition(":") for entry in os.getenv("POSTGRES_REPLICA_HOSTS", "").split(","))
+    if host
+]
+POSTGRES_REPLICA_STRATEGY = os.getenv("POSTGRES_REPLICA_STRATEGY", "round_robin")
+POSTGRES_REPLICA_EJECT_SECONDS = float(os.getenv("POSTGRES_REPLICA_EJECT_SECONDS", "10"))
+POSTGRES_READ_YOUR_WRITES = float(os.getenv("POSTGRES_READ_YOUR_WRITES", "5"))
+
 REDIS_HOST = os.getenv("REDIS_HOST", "oib-redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_POOL_MAX = int(os.getenv("REDIS_POOL_MAX", "20"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "2"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1"))
+ITEM_CACHE_TTL = int(os.getenv("ITEM_CACHE_TTL", "60"))
 
-# Initialize Pyroscope profiling
-if PYROSCOPE_ENABLED:
-    try:
-        pyroscope.configure(
-            application_name=SERVICE_NAME,
-            server_address=PYROSCOPE_SERVER,
-            tags={
-                "service": SERVICE_NAME,
-                "version": "1.0.0",
-            }
+# In-process (L1) cache in front of Redis
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "1024"))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "5"))
+CACHE_COALESCE_TIMEOUT = float(os.getenv("CACHE_COALESCE_TIMEOUT", "5"))
+
+# Cache value encoding
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zlib")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+
+# List endpoint paging
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "100"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "1000"))
+STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", "2000"))
+
+# Conditional GET on list endpoints: ETags from body digests, and how
+# long clients and CDNs may reuse a response before revalidating (0 = always)
+HTTP_ETAGS_ENABLED = os.getenv("HTTP_ETAGS_ENABLED", "true").lower() == "true"
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "0"))
+
+# Largest quantity of a single item in one order
+ORDER_MAX_QUANTITY = int(os.getenv("ORDER_MAX_QUANTITY", "1000"))
+
+# Bulk order ingestion
+BULK_ORDER_CHUNK = int(os.getenv("BULK_ORDER_CHUNK", "1000"))
+
+# Multi-process (gunicorn) metrics: each worker writes to files in this dir
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Request latency histogram buckets (seconds)
+REQUEST_LATENCY_BUCKETS = tuple(
+    float(b) for b in os.getenv("REQUEST_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")
+)
+
+# Trace sampling: share of new traces kept, per-process budget of new traces
+# per second (0 = unlimited), and traces kept regardless when they fail or
+# run longer than TRACE_SLOW_THRESHOLD seconds (0 = disabled)
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_RATE_LIMIT = float(os.getenv("TRACE_RATE_LIMIT", "0"))
+TRACE_KEEP_ERRORS = os.getenv("TRACE_KEEP_ERRORS", "true").lower() == "true"
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "1.0"))
+
+# Spill span batches to a disk ring while the collector is unreachable
+# (empty = export directly, dropping spans when the in-memory queue is full)
+OTLP_SPOOL_DIR = os.getenv("OTLP_SPOOL_DIR", "")
+OTLP_SPOOL_MAX_BYTES = int(os.getenv("OTLP_SPOOL_MAX_BYTES", str(64 * 1024 * 1024)))
+OTLP_EXPORT_TIMEOUT = float(os.getenv("OTLP_EXPORT_TIMEOUT", "2"))
+
+# Item view counters: buffered per process, flushed to Redis every
+# VIEW_FLUSH_INTERVAL seconds (sooner once VIEW_FLUSH_MAX_PENDING views are
+# buffered) and upserted into Postgres every VIEW_DB_FLUSH_INTERVAL seconds
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "1"))
+VIEW_FLUSH_MAX_PENDING = int(os.getenv("VIEW_FLUSH_MAX_PENDING", "1000"))
+VIEW_DB_FLUSH_INTERVAL = float(os.getenv("VIEW_DB_FLUSH_INTERVAL", "10"))
+
+# Readiness: dependencies are checked by a background thread every
+# HEALTH_CHECK_INTERVAL seconds, each bounded by HEALTH_CHECK_TIMEOUT; a
+# snapshot older than HEALTH_STALE_AFTER seconds counts as not ready
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "5"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", str(3 * HEALTH_CHECK_INTERVAL)))
+
+# Admission control (per process): at most ADMISSION_LIMIT requests in
+# flight, per-route caps and priorities (higher wins, default 1) as
+# "<url rule>=<n>" lists; excess requests wait up to ADMISSION_QUEUE_TIMEOUT
+# seconds in a queue of ADMISSION_QUEUE_SIZE (priority 0 routes don't wait
+# at all), then get a 503. With
+# ADMISSION_ADAPTIVE the limit follows latency (AIMD around the target).
+#
+# Under gunicorn's gthread workers the limiter only sees requests a thread
+# has picked up, and a queued request keeps its thread. The defaults follow
+# GUNICORN_THREADS: half the threads serve, all but one of the rest queue,
+# and the last one turns excess away with a 503 right away. A limit at or
+# above the thread count never binds; the excess then waits unseen in
+# gunicorn's accept backlog. Empty values take the defaults.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_THREADS = int(os.getenv("GUNICORN_THREADS", "4"))
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT") or max(1, ADMISSION_THREADS // 2))
+ADMISSION_ROUTE_LIMITS = {
+    route.strip(): int(limit)
+    for route, limit in (
+        item.split("=") for item in os.getenv("ADMISSION_ROUTE_LIMITS", "/slow=1,/orders/bulk=1").split(",")
+        if item.strip()
+    )
+}
+ADMISSION_PRIORITIES = {
+    route.strip(): int(priority)
+    for route, priority in (
+        item.split("=") for item in os.getenv("ADMISSION_PRIORITIES", "/orders=2,/slow=0,/orders/bulk=0").split(",")
+        if item.strip()
+    )
+}
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE") or max(0, ADMISSION_THREADS - ADMISSION_LIMIT - 1))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "0.5"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_ADAPTIVE = os.getenv("ADMISSION_ADAPTIVE", "false").lower() == "true"
+ADMISSION_TARGET_LATENCY = float(os.getenv("ADMISSION_TARGET_LATENCY", "0.25"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "1"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT") or max(1, ADMISSION_THREADS - 1))
+
+# In-process catalog index (item id -> price, name, seller), kept in sync via
+# LISTEN/NOTIFY; it falls back to the database when the listener hasn't
+# confirmed its connection for CATALOG_STALE_AFTER seconds
+CATALOG_INDEX_ENABLED = os.getenv("CATALOG_INDEX_ENABLED", "true").lower() == "true"
+CATALOG_HEARTBEAT = float(os.getenv("CATALOG_HEARTBEAT", "5"))
+CATALOG_STALE_AFTER = float(os.getenv("CATALOG_STALE_AFTER", str(3 * CATALOG_HEARTBEAT)))
+
+# Under a pre-forking server, telemetry must start in each worker after fork
+TELEMETRY_POST_FORK = os.getenv("TELEMETRY_POST_FORK", "false").lower() == "true"
+
+
+# Logging pipeline
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra`` fields become top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _LOG_RECORD_ATTRS)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class EventRateLimiter:
+    """Token-bucket limit per hot-path log event, in records/second per process.
+
+    Events without a configured limit are always allowed. ``allow`` returns
+    how many records of the event were suppressed since the last one let
+    through, or None when this one should be suppressed too.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._buckets = {}      # event -> [tokens, refilled_at, suppressed]
+        self._lock = threading.Lock()
+
+    def allow(self, event):
+        rate = self.limits.get(event)
+        if not rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(event, [max(rate, 1.0), now, 0])
+            bucket[0] = min(max(rate, 1.0), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return None
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+            return suppressed
+
+
+def log_event(event, msg, level=logging.INFO, **fields):
+    """Log a structured hot-path event, subject to LOG_RATE_LIMITS.
+
+    The limit is checked before a LogRecord is built, so a suppressed event
+    costs a lock and a few arithmetic operations.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    suppressed = log_limiter.allow(event)
+    if suppressed is None:
+        LOG_RATE_LIMITED.inc()
+        return
+    if suppressed:
+        fields["suppressed"] = suppressed
+    logger.log(level, msg, extra={"event": event, **fields})
+
+
+class TraceContextFilter(logging.Filter):
+    """Stamp records with the active trace and span id, in the logging thread."""
+
+    def filter(self, record):
+        ctx = trace.get_current_span().get_span_context()
+        if ctx.is_valid:
+            record.trace_id = format(ctx.trace_id, "032x")
+            record.span_id = format(ctx.span_id, "016x")
+        return True
+
+
+class CountingStreamHandler(logging.StreamHandler):
+    def emit(self, record):
+        super().emit(record)
+        LOG_RECORDS.labels(level=record.levelname.lower()).inc()
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Hand records to a background writer thread through a bounded queue.
+
+    When the queue is full the oldest record is dropped, so a slow stdout
+    never blocks a request, and formatting happens on the writer thread.
+    The queue and writer are recreated after fork, since threads don't
+    survive it; closing the handler drains the queue.
+    """
+
+    def __init__(self, handler, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.handler = handler
+        self.maxsize = maxsize
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        LOG_DROPPED.labels(reason="queue_full").inc()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.labels(reason="queue_full").inc()
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            # The stop sentinel needs a free slot; give the writer time to drain
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                try:
+                    self._listener.stop()
+                    break
+                except queue.Full:
+                    time.sleep(0.01)
+            self._listener = None
+        super().close()
+
+
+def configure_logging():
+    """Route all logging through the non-blocking pipeline on the root logger."""
+    stream = CountingStreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    handler = AsyncLogHandler(stream, LOG_QUEUE_SIZE)
+    handler.addFilter(TraceContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+class RecordOnlySampler(Sampler):
+    """Record spans without sampling them, so they can still be kept later."""
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        return SamplingResult(Decision.RECORD_ONLY)
+
+    def get_description(self):
+        return "RecordOnlySampler"
+
+
+class AdaptiveSampler(Sampler):
+    """Root span sampler: trace id ratio, then a traces-per-second budget.
+
+    The budget is a token bucket per process that refills at ``rate_limit``
+    traces per second (0 = unlimited). It is applied per trace rather than
+    per span so sampled traces stay complete. With ``record_unsampled``,
+    traces that are not sampled are still recorded, so TailKeepProcessor can
+    export them if they turn out to fail or be slow.
+    """
+
+    def __init__(self, ratio=1.0, rate_limit=0.0, record_unsampled=False):
+        self.ratio = TraceIdRatioBased(ratio)
+        self.rate_limit = rate_limit
+        self.unsampled = Decision.RECORD_ONLY if record_unsampled else Decision.DROP
+        self._tokens = self._burst = max(rate_limit, 1.0)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take_token(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        if not self.ratio.should_sample(parent_context, trace_id, name).decision.is_sampled():
+            decision = "dropped_ratio"
+        elif self.rate_limit > 0 and not self._take_token():
+            decision = "dropped_rate_limit"
+        else:
+            TRACE_SAMPLER_DECISIONS.labels(decision="sampled").inc()
+            return SamplingResult(Decision.RECORD_AND_SAMPLE, attributes, trace_state)
+        TRACE_SAMPLER_DECISIONS.labels(decision=decision).inc()
+        return SamplingResult(self.unsampled, trace_state=trace_state)
+
+    def get_description(self):
+        return f"AdaptiveSampler{{{self.ratio.get_description()}, rate_limit={self.rate_limit}}}"
+
+
+def _as_sampled(span):
+    """Copy of an ended span with the sampled flag set, so exporters accept it."""
+    ctx = span.context
+    return ReadableSpan(
+        name=span.name,
+        context=SpanContext(ctx.trace_id, ctx.span_id, ctx.is_remote, TraceFlags(TraceFlags.SAMPLED), ctx.trace_state),
+        parent=span.parent,
+        resource=span.resource,
+        attributes=span.attributes,
+        events=span.events,
+        links=span.links,
+        kind=span.kind,
+        status=span.status,
+        start_time=span.start_time,
+        end_time=span.end_time,
+        instrumentation_scope=span.instrumentation_scope,
+    )
+
+
+class TailKeepProcessor(SpanProcessor):
+    """Export recorded-but-unsampled traces that fail or run slow.
+
+    Sampled spans pass straight through to the wrapped processor. Spans of
+    unsampled traces are buffered per trace (bounded) until the local root
+    span ends; the trace is then either exported whole or discarded.
+    """
+
+    def __init__(self, processor, keep_errors=True, slow_threshold=0.0, max_traces=1000, max_spans=256):
+        self.processor = processor
+        self.keep_errors = keep_errors
+        self.slow_threshold = slow_threshold
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self._pending = OrderedDict()   # trace_id -> [ended spans]
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None):
+        self.processor.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span):
+        if span.context.trace_flags.sampled:
+            self.processor.on_end(span)
+            return
+        trace_id = span.context.trace_id
+        with self._lock:
+            spans = self._pending.setdefault(trace_id, [])
+            if len(spans) < self.max_spans:
+                spans.append(span)
+            if span.parent is not None and not span.parent.is_remote:
+                if len(self._pending) > self.max_traces:
+                    self._pending.popitem(last=False)
+                return
+            del self._pending[trace_id]
+        reason = self._keep_reason(span, spans)
+        if reason:
+            TRACE_TAIL_KEPT.labels(reason=reason).inc()
+            for s in spans:
+                self.processor.on_end(_as_sampled(s))
+
+    def _keep_reason(self, root, spans):
+        if self.keep_errors and any(s.status.status_code is StatusCode.ERROR for s in spans):
+            return "error"
+        if self.slow_threshold > 0 and (root.end_time - root.start_time) / 1e9 >= self.slow_threshold:
+            return "slow"
+        return None
+
+    def shutdown(self):
+        self.processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.processor.force_flush(timeout_millis)
+
+
+class SpoolRing:
+    """Bounded FIFO of byte records in a memory-mapped file.
+
+    The file holds a header (magic, capacity, head offset, used bytes,
+    record count) followed by a circular data area of ``capacity`` bytes.
+    Each record is a (length, span count) prefix plus payload and may wrap
+    around the end of the data area. The header is updated in place, so
+    records spooled before a restart are still there afterwards.
+    """
+
+    MAGIC = b"OIBSPL01"
+    _HEADER = struct.Struct("<8sQQQQ")
+    _PREFIX = struct.Struct("<II")
+
+    def __init__(self, file, capacity):
+        self.file = file
+        self.capacity = capacity
+        self.removed = 0    # records taken off the head by this process
+        size = self._HEADER.size + capacity
+        if os.fstat(file.fileno()).st_size != size:
+            file.truncate(size)
+        self._mm = mmap.mmap(file.fileno(), size)
+        magic, cap, self.head, self.used, self.count = self._HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC or cap != capacity or self.used > capacity:
+            self.head = self.used = self.count = 0
+            self._sync()
+
+    def __len__(self):
+        return self.count
+
+    def _sync(self):
+        self._HEADER.pack_into(self._mm, 0, self.MAGIC, self.capacity, self.head, self.used, self.count)
+
+    def _write(self, pos, data):
+        base, first = self._HEADER.size, min(len(data), self.capacity - pos)
+        self._mm[base + pos:base + pos + first] = data[:first]
+        if first < len(data):
+            self._mm[base:base + len(data) - first] = data[first:]
+
+    def _read(self, pos, n):
+        base, first = self._HEADER.size, min(n, self.capacity - pos)
+        data = self._mm[base + pos:base + pos + first]
+        if first < n:
+            data += self._mm[base:base + n - first]
+        return data
+
+    def append(self, payload, spans):
+        """Append a record, evicting the oldest to make room.
+
+        Returns the span counts of evicted records, or None if the record
+        can never fit.
+        """
+        record = self._PREFIX.pack(len(payload), spans) + payload
+        if len(record) > self.capacity:
+            return None
+        evicted = []
+        while self.capacity - self.used < len(record):
+            evicted.append(self.peek()[2])
+            self.pop()
+        self._write((self.head + self.used) % self.capacity, record)
+        self.used += len(record)
+        self.count += 1
+        self._sync()
+        return evicted
+
+    def peek(self):
+        """Oldest record as (token, payload, spans), or None when empty."""
+        if not self.count:
+            return None
+        length, spans = self._PREFIX.unpack(self._read(self.head, self._PREFIX.size))
+        payload = self._read((self.head + self._PREFIX.size) % self.capacity, length)
+        return self.removed, payload, spans
+
+    def pop(self, token=None):
+        """Remove the oldest record (only if it is still the one ``token`` refers to)."""
+        if not self.count or (token is not None and token != self.removed):
+            return
+        length, _ = self._PREFIX.unpack(self._read(self.head, self._PREFIX.size))
+        size = self._PREFIX.size + length
+        self.head = (self.head + size) % self.capacity
+        self.used -= size
+        self.count -= 1
+        self.removed += 1
+        if not self.count:
+            self.head = 0
+        self._sync()
+
+    def close(self):
+        self._mm.flush()
+        self._mm.close()
+        self.file.close()
+
+
+def open_spool(directory, capacity, slots=64):
+    """Lock and open the first free ``spans-<n>.ring`` slot in ``directory``.
+
+    Slots outlive processes, so a recycled worker picks up (and replays)
+    whatever its predecessor left behind.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for slot in range(slots):
+        file = open(os.path.join(directory, f"spans-{slot}.ring"), "a+b")   # mmap-ed; never written through
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            continue
+        return SpoolRing(file, capacity)
+    raise RuntimeError(f"No free spool slot in {directory}")
+
+
+_RETRYABLE = {
+    grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.ABORTED, grpc.StatusCode.CANCELLED, grpc.StatusCode.UNKNOWN,
+}
+
+
+class SpoolingSpanExporter(SpanExporter):
+    """OTLP/gRPC span exporter that spills to a SpoolRing when the collector is down.
+
+    Batches are encoded once and sent directly while the spool is empty.
+    A batch that fails with a retryable status, or arrives while older
+    batches are still spooled, is appended to the spool instead, and a
+    background thread replays the spool oldest-first with exponential
+    backoff. When the spool is full the oldest batches are dropped.
+    """
+
+    def __init__(self, endpoint, spool, timeout=2.0, max_backoff=30.0):
+        self.spool = spool
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self._channel = grpc.insecure_channel(endpoint)
+        self._export = self._channel.unary_unary(
+            "/opentelemetry.proto.collector.trace.v1.TraceService/Export",
+            request_serializer=None,
+            response_deserializer=ExportTraceServiceResponse.FromString,
         )
-        logger.info(f"Pyroscope profiling enabled, sending to {PYROSCOPE_SERVER}")
-    except Exception as e:
-        logger.warning(f"Failed to initialize Pyroscope: {e}")
-
-# Setup OpenTelemetry tracing
-resource = Resource.create({"service.name": SERVICE_NAME, "service.version": "1.0.0"})
-provider = TracerProvider(resource=resource)
-otlp_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT, insecure=True)
-provider.add_span_processor(BatchSpanProcessor(otlp_exporter))
-trace.set_tracer_provider(provider)
-tracer = trace.get_tracer(__name__)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._report()
+        threading.Thread(target=self._replay, name="otlp-spool-replay", daemon=True).start()
+
+    def _report(self):
+        OTLP_SPOOL_BATCHES.set(len(self.spool))
+        OTLP_SPOOL_BYTES.set(self.spool.used)
+
+    def _send(self, payload, path):
+        start = time.perf_counter()
+        try:
+            self._export(payload, timeout=self.timeout)
+            result = "success"
+        except grpc.RpcError as e:
+            result = "retryable" if e.code() in _RETRYABLE else "rejected"
+        OTLP_EXPORT_LATENCY.labels(path=path, result=result).observe(time.perf_counter() - start)
+        return result
+
+    def _spill(self, payload, spans):
+        with self._lock:
+            evicted = self.spool.append(payload, spans)
+            self._report()
+        if evicted is None:
+            OTLP_SPANS_DROPPED.labels(reason="too_large").inc(spans)
+            return
+        OTLP_SPOOL_SPILLED_BYTES.inc(len(payload))
+        if evicted:
+            OTLP_SPANS_DROPPED.labels(reason="spool_full").inc(sum(evicted))
+        self._wakeup.set()
+
+    def export(self, spans):
+        payload = encode_spans(spans).SerializeToString()
+        if not len(self.spool):
+            result = self._send(payload, "direct")
+            if result == "success":
+                return SpanExportResult.SUCCESS
+            if result == "rejected":
+                OTLP_SPANS_DROPPED.labels(reason="rejected").inc(len(spans))
+                return SpanExportResult.FAILURE
+        self._spill(payload, len(spans))
+        return SpanExportResult.SUCCESS
+
+    def _replay(self):
+        backoff = 1.0
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            with self._lock:
+                record = self.spool.peek()
+            if record is None:
+                self._wakeup.wait(5)
+                continue
+            token, payload, spans = record
+            result = self._send(payload, "replay")
+            if result == "retryable":
+                self._stopped.wait(backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = 1.0
+            if result == "rejected":
+                OTLP_SPANS_DROPPED.labels(reason="rejected").inc(spans)
+            with self._lock:
+                self.spool.pop(token)
+                self._report()
+
+    def force_flush(self, timeout_millis=30000):
+        return True
+
+    def shutdown(self):
+        self._stopped.set()
+        self._wakeup.set()
+        self._channel.close()
+        with self._lock:
+            self.spool.close()
+
+
+class Profiler:
+    """This process's Pyroscope agent, with per-thread tags that nest.
+
+    ``push(key, value)`` labels the calling thread's samples until the
+    matching ``pop(key)``, which restores the value the key had before, so
+    a tag held for a whole request survives inner scopes that set the same
+    key. Tags are per thread, so they are turned off (``thread_tags``) where
+    requests share a thread, as coroutines do. ``start()`` (re)starts the
+    agent at a given sample rate; samples of requests in flight during a
+    restart lose their thread tags.
+    """
+
+    def __init__(self, server_address, sample_rate, tags):
+        self.server_address = server_address
+        self.base_rate = sample_rate
+        self.tags = tags
+        self.rate = None
+        self.thread_tags = True
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def active(self):
+        return self.rate is not None
+
+    def start(self, rate=None, tags=None):
+        """(Re)start the agent at ``rate`` Hz, adding ``tags`` to the static ones."""
+        rate = rate or self.base_rate
+        with self._lock:
+            if self.rate is not None:
+                pyroscope.shutdown()
+                self.rate = None
+            pyroscope.configure(
+                application_name=SERVICE_NAME,
+                server_address=self.server_address,
+                sample_rate=rate,
+                tags={**self.tags, **(tags or {})},
+            )
+            self.rate = rate
+        PROFILE_SAMPLE_RATE.set(rate)
+
+    def push(self, key, value):
+        """Tag this thread's samples with ``key=value``; returns whether it did."""
+        if self.rate is None or not self.thread_tags:
+            return False
+        stack = self._local.__dict__.setdefault(key, [])
+        if stack:
+            pyroscope.remove_thread_tag(key, stack[-1])
+        stack.append(value)
+        pyroscope.add_thread_tag(key, value)
+        return True
+
+    def pop(self, key):
+        stack = self._local.__dict__.get(key)
+        if not stack:
+            return
+        pyroscope.remove_thread_tag(key, stack.pop())
+        if stack:
+            pyroscope.add_thread_tag(key, stack[-1])
+
+
+class ProfileTagProcessor(SpanProcessor):
+    """Label profiling samples with the span they were taken under.
+
+    While a local root span is open, its thread's samples carry its id as
+    ``span_id``, Pyroscope's span profile label, and the span records the
+    same id as ``pyroscope.profile.id``, from which Grafana opens the
+    span's flame graph in Tempo. With ``span_names``, samples also carry
+    the name of the innermost open internal (manual) span as ``span_name``.
+    """
+
+    def __init__(self, profiler, span_names=False):
+        self.profiler = profiler
+        self.span_names = span_names
+        self._local = threading.local()
+
+    def on_start(self, span, parent_context=None):
+        keys = []
+        if span.parent is None or span.parent.is_remote:
+            span_id = format(span.context.span_id, "016x")
+            if self.profiler.push("span_id", span_id):
+                span.set_attribute("pyroscope.profile.id", span_id)
+                keys.append("span_id")
+        if self.span_names and span.kind == SpanKind.INTERNAL and self.profiler.push("span_name", span.name):
+            keys.append("span_name")
+        if keys:
+            self._local.__dict__.setdefault("pushed", {})[span.context.span_id] = keys
+
+    def on_end(self, span):
+        # Spans end on the thread that started them; one ended elsewhere
+        # leaves its tags to be replaced by that thread's next span
+        keys = self._local.__dict__.get("pushed", {}).pop(span.context.span_id, ())
+        for key in reversed(keys):
+            self.profiler.pop(key)
+
+
+profiler = Profiler(PYROSCOPE_SERVER, PYROSCOPE_SAMPLE_RATE, {"service": SERVICE_NAME, "version": "1.0.0"})
+
+
+def init_telemetry(span_exporter=None):
+    """Start the profiler and the span exporter for this process.
+
+    Both run background threads and hold network connections, neither of
+    which survives fork(), so pre-forking servers call this in each worker.
+    ``span_exporter`` replaces the OTLP exporter (used by the benchmarks).
+    """
+    # Initialize Pyroscope profiling
+    if PYROSCOPE_ENABLED:
+        try:
+            profiler.start()
+            logger.info(f"Pyroscope profiling enabled, sending to {PYROSCOPE_SERVER}")
+        except Exception as e:
+            logger.warning(f"Failed to initialize Pyroscope: {e}")
+
+    # Setup OpenTelemetry tracing
+    resource = Resource.create({
+        "service.name": SERVICE_NAME,
+        "service.version": "1.0.0",
+        "service.instance.id": f"{os.uname().nodename}-{os.getpid()}",
+    })
+    # Unsampled traces are only worth recording when a keep rule can apply
+    may_drop = TRACE_SAMPLE_RATIO < 1 or TRACE_RATE_LIMIT > 0
+    record_unsampled = may_drop and (TRACE_KEEP_ERRORS or TRACE_SLOW_THRESHOLD > 0)
+    unsampled_parent = RecordOnlySampler() if record_unsampled else ALWAYS_OFF
+    sampler = ParentBased(
+        root=AdaptiveSampler(TRACE_SAMPLE_RATIO, TRACE_RATE_LIMIT, record_unsampled),
+        remote_parent_not_sampled=unsampled_parent,
+        local_parent_not_sampled=unsampled_parent,
+    )
+    provider = TracerProvider(resource=resource, sampler=sampler)
+    if profiler.active:
+        provider.add_span_processor(ProfileTagProcessor(profiler, PYROSCOPE_SPAN_NAME_TAGS))
+    if span_exporter is None and OTLP_SPOOL_DIR:
+        span_exporter = SpoolingSpanExporter(
+            OTLP_ENDPOINT, open_spool(OTLP_SPOOL_DIR, OTLP_SPOOL_MAX_BYTES), timeout=OTLP_EXPORT_TIMEOUT
+        )
+        logger.info(f"Spooling spans to {span_exporter.spool.file.name} while {OTLP_ENDPOINT} is unreachable")
+    processor = BatchSpanProcessor(span_exporter or OTLPSpanExporter(endpoint=OTLP_ENDPOINT, insecure=True))
+    if record_unsampled:
+        processor = TailKeepProcessor(processor, TRACE_KEEP_ERRORS, TRACE_SLOW_THRESHOLD)
+    provider.add_span_processor(processor)
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing with {sampler.get_description()}")
 
-# Instrument libraries
-Psycopg2Instrumentor().instrument()
-RedisInstrumentor().instrument()
 
 # Prometheus metrics
 REQUEST_COUNT = Counter('app_requests_total', 'Total requests', ['method', 'endpoint', 'status'])
-REQUEST_LATENCY = Histogram('app_request_latency_seconds', 'Request latency', ['method', 'endpoint'])
+REQUEST_LATENCY = Histogram(
+    'app_request_latency_seconds', 'Request latency', ['method', 'endpoint'], buckets=REQUEST_LATENCY_BUCKETS
+)
+TRACE_SAMPLER_DECISIONS = Counter(
+    'app_trace_sampler_decisions_total', 'Head sampling decisions for new traces', ['decision']
+)
+TRACE_TAIL_KEPT = Counter('app_trace_tail_kept_total', 'Unsampled traces exported because they failed or were slow', ['reason'])
 DB_QUERY_COUNT = Counter('app_db_queries_total', 'Database queries', ['operation'])
-CACHE_OPS = Counter('app_cache_operations_total', 'Cache operations', ['operation', 'result'])
+DB_QUERY_LATENCY = Histogram(
+    'app_db_query_seconds', 'Query latency per database target', ['target'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+DB_READ_ROUTES = Counter('app_db_read_routes_total', 'Read-only connection routing', ['target', 'reason'])
+DB_REPLICA_EJECTIONS = Counter('app_db_replica_ejections_total', 'Replicas ejected after a failure', ['target'])
+CACHE_OPS = Counter('app_cache_operations_total', 'Cache operations', ['tier', 'operation', 'result'])
+REDIS_ROUNDTRIPS = Counter('app_redis_roundtrips_total', 'Redis network round trips', ['endpoint'])
+REDIS_ROUNDTRIPS_PER_REQUEST = Histogram(
+    'app_redis_roundtrips_per_request', 'Redis network round trips per HTTP request', ['endpoint'],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16)
+)
+BULK_ROWS = Counter('app_bulk_rows_total', 'Rows loaded by bulk ingestion', ['table'])
+BULK_REJECTED = Counter('app_bulk_rejected_orders_total', 'Orders rejected by bulk ingestion', ['reason'])
+BULK_CHUNK_LATENCY = Histogram(
+    'app_bulk_chunk_seconds', 'Bulk ingestion chunk latency', ['result'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+BULK_ROWS_PER_SECOND = Gauge(
+    'app_bulk_rows_per_second', 'Row throughput of the last bulk load', multiprocess_mode='mostrecent'
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'app_db_pool_connections', 'Pooled database connections', ['pool', 'state'], multiprocess_mode='livesum'
+)
+DB_POOL_WAIT = Histogram(
+    'app_db_pool_acquire_wait_seconds', 'Time spent waiting for a pooled connection', ['pool'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+DB_POOL_TIMEOUTS = Counter('app_db_pool_acquire_timeouts_total', 'Pooled connection acquire timeouts', ['pool'])
+OTLP_SPOOL_BATCHES = Gauge('app_otlp_spool_batches', 'Span batches waiting in the disk spool', multiprocess_mode='livesum')
+OTLP_SPOOL_BYTES = Gauge('app_otlp_spool_bytes', 'Bytes used in the disk spool', multiprocess_mode='livesum')
+OTLP_SPOOL_SPILLED_BYTES = Counter('app_otlp_spool_spilled_bytes_total', 'Encoded span bytes written to the disk spool')
+OTLP_SPANS_DROPPED = Counter('app_otlp_spans_dropped_total', 'Spans dropped by the spooling exporter', ['reason'])
+OTLP_EXPORT_LATENCY = Histogram(
+    'app_otlp_export_seconds', 'OTLP span batch export latency', ['path', 'result'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+VIEW_FLUSH_BATCH = Histogram(
+    'app_view_flush_batch_items', 'Items per write-behind view counter flush', ['sink'],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+VIEW_FLUSH_LAG = Histogram(
+    'app_view_flush_lag_seconds', 'Age of the oldest buffered view when its batch was flushed', ['sink'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120)
+)
+VIEW_FLUSH_ERRORS = Counter('app_view_flush_errors_total', 'Failed write-behind view counter flushes', ['sink'])
+HEALTH_CHECK_LATENCY = Histogram(
+    'app_health_check_seconds', 'Background dependency check latency', ['dependency', 'result'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+HEALTH_CHECK_UP = Gauge(
+    'app_health_check_up', 'Whether the last dependency check passed', ['dependency'], multiprocess_mode='livemin'
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'app_admission_in_flight', 'Admitted requests in flight', ['route'], multiprocess_mode='livesum'
+)
+ADMISSION_QUEUED = Gauge(
+    'app_admission_queued', 'Requests waiting for admission', ['route'], multiprocess_mode='livesum'
+)
+ADMISSION_SHED = Counter('app_admission_shed_total', 'Requests rejected by admission control', ['route', 'reason'])
+ADMISSION_QUEUE_WAIT = Histogram(
+    'app_admission_queue_wait_seconds', 'Time admitted requests spent queued', ['route'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+ADMISSION_CONCURRENCY_LIMIT = Gauge(
+    'app_admission_concurrency_limit', 'Current in-flight request limit', multiprocess_mode='livesum'
+)
+CATALOG_LOOKUPS = Counter('app_catalog_lookups_total', 'Catalog index lookups', ['result'])
+CATALOG_RELOADS = Counter('app_catalog_reloads_total', 'Full catalog index loads', ['reason'])
+CATALOG_RELOAD_LATENCY = Histogram(
+    'app_catalog_reload_seconds', 'Full catalog index load latency',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+CATALOG_UPDATES = Counter('app_catalog_updates_total', 'Catalog rows refetched after a change notification', ['table'])
+CATALOG_ITEMS = Gauge('app_catalog_items', 'Items in the catalog index', multiprocess_mode='livemax')
+CATALOG_SYNCED_AT = Gauge(
+    'app_catalog_synced_timestamp_seconds', 'When the catalog index was last confirmed in sync',
+    multiprocess_mode='livemin'
+)
+PROFILE_SAMPLE_RATE = Gauge('app_profile_sample_rate_hz', 'Profiler sample rate', multiprocess_mode='livemax')
+PROFILE_WINDOWS = Counter('app_profile_windows_total', 'High-frequency profiling windows applied')
+CONDITIONAL_RESPONSES = Counter(
+    'app_conditional_responses_total', 'List responses by conditional GET outcome', ['endpoint', 'result']
+)
+CONDITIONAL_BYTES_SAVED = Counter(
+    'app_conditional_bytes_saved_total', 'Response body bytes not sent because of a 304 Not Modified', ['endpoint']
+)
+LOG_RECORDS = Counter('app_log_records_total', 'Log records written', ['level'])
+LOG_DROPPED = Counter('app_log_records_dropped_total', 'Log records dropped before being written', ['reason'])
+LOG_RATE_LIMITED = LOG_DROPPED.labels(reason="rate_limited")   # bound once: checked on every hot-path event
+
+log_limiter = EventRateLimiter(LOG_RATE_LIMITS)
+configure_logging()
+
+if not TELEMETRY_POST_FORK:
+    init_telemetry()
+
+# Resolves to the real tracer once init_telemetry() has set the provider
+tracer = trace.get_tracer(__name__)
+
+# Instrument libraries
+Psycopg2Instrumentor().instrument()
+RedisInstrumentor().instrument()
 
 # Initialize Flask
 app = Flask(__name__)
-FlaskInstrumentor().instrument_app(app)
+# Probes are polled constantly and say nothing about request handling
+FlaskInstrumentor().instrument_app(app, excluded_urls="/health,/livez,/readyz")
 
 # Database connection pool
-def get_db_connection():
-    """Get a database connection with retry logic."""
-    for attempt in range(3):
+# (host, port) -> metrics label for every database the app talks to
+DB_TARGETS = {(POSTGRES_HOST, int(POSTGRES_PORT)): "primary"}
+DB_TARGETS.update(
+    (target, f"replica-{index}") for index, target in enumerate(POSTGRES_REPLICA_HOSTS, start=1)
+)
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor that records query latency per database target."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - start
+            info = self.connection.info
+            target = DB_TARGETS.get((info.host, info.port), "primary")
+            DB_QUERY_LATENCY.labels(target=target).observe(elapsed)
+            if replicas is not None:
+                replicas.observe(target, elapsed)
+
+
+def get_db_connection(host=POSTGRES_HOST, port=POSTGRES_PORT, attempts=3, readonly=False):
+    """Open a new database connection with retry logic."""
+    for attempt in range(attempts):
         try:
             conn = psycopg2.connect(
-                host=POSTGRES_HOST,
-                port=POSTGRES_PORT,
+                host=host,
+                port=port,
                 user=POSTGRES_USER,
                 password=POSTGRES_PASSWORD,
                 dbname=POSTGRES_DB,
-                cursor_factory=RealDictCursor
+                cursor_factory=TimedCursor
             )
+            if readonly:
+                conn.set_session(readonly=True)
             return conn
         except psycopg2.OperationalError as e:
-            logger.warning(f"Database connection attempt {attempt + 1} failed: {e}")
-            time.sleep(1)
-    raise Exception("Could not connect to database after 3 attempts")
+            logger.warning(f"Database connection attempt {attempt + 1} to {host}:{port} failed: {e}")
+            if attempt + 1 < attempts:
+                time.sleep(1)
+    raise Exception(f"Could not connect to database at {host}:{port} after {attempts} attempts")
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe PostgreSQL connection pool.
+
+    Idle connections are reused LIFO so the hottest connections stay warm.
+    Connections idle for longer than ``check_idle`` seconds are pinged with
+    ``SELECT 1`` before being handed out, and connections older than
+    ``max_lifetime`` seconds are closed and replaced on return.
+    """
+
+    def __init__(self, connect, name="primary", minconn=2, maxconn=10,
+                 timeout=5.0, max_lifetime=1800.0, check_idle=10.0):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"invalid pool size min={minconn} max={maxconn}")
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = deque()    # (conn, created_at, returned_at)
+        self._born = {}         # id(conn) -> created_at for checked-out connections
+        self._size = 0
+        self._report()
+
+    def _report(self):
+        DB_POOL_CONNECTIONS.labels(pool=self.name, state="in_use").set(len(self._born))
+        DB_POOL_CONNECTIONS.labels(pool=self.name, state="idle").set(len(self._idle))
+
+    def _expired(self, created_at, now):
+        return self.max_lifetime > 0 and now - created_at >= self.max_lifetime
+
+    def _alive(self, conn):
+        """Cheap liveness check for a connection that sat idle in the pool."""
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def warm(self):
+        """Open connections up to ``minconn`` ahead of the first request."""
+        opened = []
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    break
+                self._size += 1
+            try:
+                opened.append(self._connect())
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+        with self._cond:
+            now = time.monotonic()
+            self._idle.extend((conn, now, now) for conn in opened)
+            self._report()
+            self._cond.notify(len(opened))
+
+    def acquire(self):
+        """Borrow a connection, waiting up to ``timeout`` seconds for one."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, created_at, returned_at = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        DB_POOL_TIMEOUTS.labels(pool=self.name).inc()
+                        raise PoolTimeout(
+                            f"no connection available in pool '{self.name}' after {self.timeout}s"
+                        )
+                    self._cond.wait(remaining)
+
+            now = time.monotonic()
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                created_at = now
+            elif conn.closed or self._expired(created_at, now) or (
+                now - returned_at >= self.check_idle and not self._alive(conn)
+            ):
+                # Stale connection: drop it and retry, which may open a fresh one
+                self._discard(conn)
+                with self._cond:
+                    self._size -= 1
+                    self._report()
+                continue
+
+            with self._cond:
+                self._born[id(conn)] = created_at
+                self._report()
+            DB_POOL_WAIT.labels(pool=self.name).observe(time.monotonic() - start)
+            return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, closing it if it is no longer usable."""
+        now = time.monotonic()
+        with self._cond:
+            created_at = self._born.pop(id(conn), now)
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or conn.closed or self._expired(created_at, now):
+            self._discard(conn)
+            with self._cond:
+                self._size -= 1
+                self._report()
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, now))
+            self._report()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a ``with`` block."""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self):
+        """Close all idle connections (checked-out ones close on release)."""
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._report()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+
+db_pool = ConnectionPool(
+    get_db_connection,
+    minconn=POSTGRES_POOL_MIN,
+    maxconn=POSTGRES_POOL_MAX,
+    timeout=POSTGRES_POOL_TIMEOUT,
+    max_lifetime=POSTGRES_POOL_MAX_LIFETIME,
+    check_idle=POSTGRES_POOL_CHECK_IDLE,
+)
+
+
+def db_connection():
+    """Borrow a pooled database connection (use as a context manager)."""
+    return db_pool.connection()
+
+
+class ReplicaSet:
+    """Read replicas, each behind its own connection pool.
+
+    pick() chooses among the replicas that aren't ejected, either
+    round-robin or by lowest smoothed query latency (exploring a random
+    replica now and then so a recovered one gets measured again). A replica
+    whose connection fails is ejected for ``eject_seconds`` and then tried
+    again by the next pick.
+    """
+
+    def __init__(self, pools, strategy="round_robin", eject_seconds=10.0, explore=0.05):
+        if strategy not in ("round_robin", "least_latency"):
+            raise ValueError(f"unknown replica strategy {strategy!r}")
+        self.pools = pools
+        self.strategy = strategy
+        self.eject_seconds = eject_seconds
+        self.explore = explore
+        self._ejected_until = {pool.name: 0.0 for pool in pools}
+        self._latency = {pool.name: 0.0 for pool in pools}    # EWMA of query seconds
+        self._turn = itertools.count()
+
+    def pick(self):
+        now = time.monotonic()
+        healthy = [pool for pool in self.pools if self._ejected_until[pool.name] <= now]
+        if not healthy:
+            return None
+        if self.strategy == "least_latency":
+            if random.random() < self.explore:
+                return random.choice(healthy)
+            return min(healthy, key=lambda pool: self._latency[pool.name])
+        return healthy[next(self._turn) % len(healthy)]
+
+    def observe(self, target, elapsed):
+        if target in self._latency:
+            self._latency[target] += 0.2 * (elapsed - self._latency[target])
+
+    def eject(self, pool, error):
+        self._ejected_until[pool.name] = time.monotonic() + self.eject_seconds
+        DB_REPLICA_EJECTIONS.labels(target=pool.name).inc()
+        logger.warning(f"Ejected {pool.name} for {self.eject_seconds}s: {error}")
+
+
+replicas = ReplicaSet(
+    [
+        ConnectionPool(
+            partial(get_db_connection, host, port, attempts=1, readonly=True),
+            name=f"replica-{index}",
+            minconn=POSTGRES_POOL_MIN,
+            maxconn=POSTGRES_POOL_MAX,
+            timeout=POSTGRES_POOL_TIMEOUT,
+            max_lifetime=POSTGRES_POOL_MAX_LIFETIME,
+            check_idle=POSTGRES_POOL_CHECK_IDLE,
+        )
+        for index, (host, port) in enumerate(POSTGRES_REPLICA_HOSTS, start=1)
+    ],
+    strategy=POSTGRES_REPLICA_STRATEGY,
+    eject_seconds=POSTGRES_REPLICA_EJECT_SECONDS,
+) if POSTGRES_REPLICA_HOSTS else None
+
+# Set on responses to requests that wrote; holds the time until which this
+# client's reads go to the primary
+READ_YOUR_WRITES_COOKIE = "oib_primary_until"
+
+
+def mark_write():
+    """Record that this request wrote, so the client reads its own writes."""
+    g.db_wrote = True
+
+
+@app.after_request
+def set_read_your_writes_cookie(response):
+    if g.get("db_wrote") and replicas is not None and POSTGRES_READ_YOUR_WRITES > 0:
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE, f"{time.time() + POSTGRES_READ_YOUR_WRITES:.3f}",
+            max_age=math.ceil(POSTGRES_READ_YOUR_WRITES), httponly=True, samesite="Lax",
+        )
+    return response
+
+
+def reads_from_primary():
+    if g.get("db_wrote"):
+        return True
+    until = request.cookies.get(READ_YOUR_WRITES_COOKIE, type=float)
+    return until is not None and until > time.time()
+
+
+@contextmanager
+def db_read_connection():
+    """Borrow a connection for read-only queries (use as a context manager).
+
+    Reads go to a replica, unless there is none healthy or this client wrote
+    within the last POSTGRES_READ_YOUR_WRITES seconds. A replica that can't
+    hand out a connection is ejected and the read goes to the primary.
+    """
+    pool = None
+    if replicas is not None:
+        if has_request_context() and reads_from_primary():
+            DB_READ_ROUTES.labels(target="primary", reason="read_your_writes").inc()
+        else:
+            pool = replicas.pick()
+            if pool is None:
+                DB_READ_ROUTES.labels(target="primary", reason="replicas_ejected").inc()
+    if pool is not None:
+        try:
+            conn = pool.acquire()
+        except Exception as e:
+            replicas.eject(pool, e)
+            DB_READ_ROUTES.labels(target="primary", reason="replica_failed").inc()
+            pool = None
+    if pool is None:
+        with db_pool.connection() as conn:
+            yield conn
+        return
+
+    DB_READ_ROUTES.labels(target=pool.name, reason="replica").inc()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        discard = True
+        replicas.eject(pool, e)
+        raise
+    finally:
+        pool.release(conn, discard=discard)
+
+# Redis connection
+class CountingConnection(redis.Connection):
+    """Redis connection that counts network round trips per HTTP request.
+
+    A plain command and a whole pipeline are both a single
+    ``send_packed_command`` call, so this counts what actually hits the wire.
+    """
+
+    def send_packed_command(self, command, check_health=True):
+        if has_request_context():
+            g.redis_roundtrips = g.get("redis_roundtrips", 0) + 1
+        return super().send_packed_command(command, check_health=check_health)
+
+
+redis_pool = redis.BlockingConnectionPool(
+    connection_class=CountingConnection,
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    max_connections=REDIS_POOL_MAX,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+    health_check_interval=30,
+    decode_responses=False,
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+
+def get_redis_client():
+    """Get the process-wide Redis client (backed by a shared connection pool)."""
+    return redis_client
+
+
+# Request metrics middleware
+def trace_exemplar():
+    """Exemplar labels linking a metric sample to the active, sampled trace."""
+    ctx = trace.get_current_span().get_span_context()
+    if not ctx.is_valid or not ctx.trace_flags.sampled:
+        return None
+    return {"trace_id": format(ctx.trace_id, "032x")}
+
+
+class ExemplarStore:
+    """Latest exemplar per histogram bucket, shared with /metrics via files.
+
+    prometheus_client keeps no exemplars in multi-process mode, so each
+    worker remembers the newest exemplar per (metric, labels, bucket) and a
+    background thread writes them to ``exemplars_<pid>.json`` in the metrics
+    directory, where ExemplarCollector merges them back into the scrape.
+    """
+
+    def __init__(self, directory, interval=5.0):
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._dirty = False
+        self._pid = None
+
+    def path(self, pid=None):
+        return os.path.join(self.directory, f"exemplars_{pid or os.getpid()}.json")
+
+    def record(self, histogram, labels, value, exemplar):
+        le = next(bound for bound in histogram._upper_bounds if value <= bound)
+        key = (histogram._name, tuple(sorted(labels.items())), floatToGoString(le))
+        with self._lock:
+            self._latest[key] = (exemplar, value, time.time())
+            self._dirty = True
+        if self._pid != os.getpid():
+            self._start_writer()
+
+    def _start_writer(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="exemplar-writer", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"Failed to write exemplars: {e}")
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[name, dict(labels), le, exemplar, value, ts]
+                       for (name, labels, le), (exemplar, value, ts) in self._latest.items()]
+            self._dirty = False
+        path = self.path()
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(entries, f)
+        os.replace(f"{path}.tmp", path)
+
+
+class ExemplarCollector:
+    """Wrap a collector and attach exemplars written by ExemplarStore."""
+
+    def __init__(self, collector, directory):
+        self.collector = collector
+        self.directory = directory
+
+    def _load(self):
+        exemplars = {}
+        for path in glob.glob(os.path.join(self.directory, "exemplars_*.json")):
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, le, exemplar, value, ts in entries:
+                key = (name, tuple(sorted(labels.items())), le)
+                if key not in exemplars or ts > exemplars[key].timestamp:
+                    exemplars[key] = Exemplar(exemplar, value, ts)
+        return exemplars
+
+    def collect(self):
+        exemplars = self._load()
+        for family in self.collector.collect():
+            if exemplars and family.type == "histogram":
+                for i, sample in enumerate(family.samples):
+                    if not sample.name.endswith("_bucket"):
+                        continue
+                    labels = tuple(sorted((k, v) for k, v in sample.labels.items() if k != "le"))
+                    exemplar = exemplars.get((family.name, labels, sample.labels["le"]))
+                    if exemplar:
+                        family.samples[i] = sample._replace(exemplar=exemplar)
+            yield family
+
+
+exemplar_store = ExemplarStore(PROMETHEUS_MULTIPROC_DIR) if PROMETHEUS_MULTIPROC_DIR else None
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Per-route request count/latency (with trace exemplars) and Redis round trips.
+
+    Labelled by URL rule rather than raw path to keep cardinality bounded.
+    """
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_COUNT.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+    if "request_start" in g:
+        elapsed = time.perf_counter() - g.request_start
+        labels = {"method": request.method, "endpoint": endpoint}
+        exemplar = trace_exemplar()
+        REQUEST_LATENCY.labels(**labels).observe(elapsed, exemplar=exemplar)
+        if exemplar and exemplar_store:
+            exemplar_store.record(REQUEST_LATENCY, labels, elapsed, exemplar)
+
+    roundtrips = g.get("redis_roundtrips", 0)
+    REDIS_ROUNDTRIPS_PER_REQUEST.labels(endpoint=endpoint).observe(roundtrips)
+    if roundtrips:
+        REDIS_ROUNDTRIPS.labels(endpoint=endpoint).inc(roundtrips)
+    return response
+
+
+# Profiling labels: samples taken while a request runs carry its route
+@app.before_request
+def tag_profile_endpoint():
+    if request.url_rule is not None and profiler.push("endpoint", request.url_rule.rule):
+        g.profile_endpoint = True
+
+
+@app.teardown_request
+def untag_profile_endpoint(exc):
+    if g.pop("profile_endpoint", False):
+        profiler.pop("endpoint")
+
+
+# Admission control
+class _Waiter:
+    __slots__ = ("route", "priority", "seq", "event", "admitted", "evicted")
+
+    def __init__(self, route, priority, seq):
+        self.route = route
+        self.priority = priority
+        self.seq = seq
+        self.event = threading.Event()
+        self.admitted = False
+        self.evicted = False
+
+
+class AdmissionController:
+    """Concurrency limiter with per-route caps and a bounded priority queue.
+
+    A request is admitted while fewer than ``limit`` requests (and fewer
+    than its route's cap) are in flight. Otherwise it waits up to
+    ``queue_timeout`` seconds; freed slots are handed directly to the
+    highest-priority waiter that fits, oldest first. When the queue is full
+    a newcomer evicts the newest lower-priority waiter, or is rejected.
+    Best-effort routes (priority 0 or below) never queue: a waiting request
+    still holds a server thread, which is exactly what they must not do.
+
+    With ``adaptive``, the limit grows by 1/limit for every request of an
+    uncapped route served within ``target_latency`` and shrinks by 10% (at
+    most once per target interval) when one is slower.
+    """
+
+    def __init__(self, limit, route_limits=None, priorities=None, queue_size=16, queue_timeout=0.5,
+                 adaptive=False, target_latency=0.25, min_limit=1, max_limit=64):
+        self.limit = float(limit)
+        self.route_limits = route_limits or {}
+        self.priorities = priorities or {}
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._route_in_flight = {}
+        self._queue = []
+        self._seq = 0
+        self._last_decrease = 0.0
+        ADMISSION_CONCURRENCY_LIMIT.set(int(self.limit))
+
+    def _fits(self, route):
+        cap = self.route_limits.get(route)
+        return self._in_flight < int(self.limit) and (cap is None or self._route_in_flight.get(route, 0) < cap)
+
+    def _admit(self, route):
+        self._in_flight += 1
+        self._route_in_flight[route] = self._route_in_flight.get(route, 0) + 1
+        ADMISSION_IN_FLIGHT.labels(route=route).inc()
+
+    def acquire(self, route):
+        """Wait for a slot; returns ``(admitted, reason, seconds waited)``."""
+        with self._lock:
+            # Waiters only stay queued while they don't fit, so a newcomer that
+            # fits isn't jumping ahead of anyone
+            if self._fits(route):
+                self._admit(route)
+                return True, None, 0.0
+            priority = self.priorities.get(route, 1)
+            if priority <= 0:
+                ADMISSION_SHED.labels(route=route, reason="best_effort").inc()
+                return False, "best_effort", 0.0
+            if len(self._queue) >= self.queue_size:
+                victims = [w for w in self._queue if w.priority < priority]
+                if not victims:
+                    ADMISSION_SHED.labels(route=route, reason="queue_full").inc()
+                    return False, "queue_full", 0.0
+                victim = min(victims, key=lambda w: (w.priority, -w.seq))
+                self._queue.remove(victim)
+                victim.evicted = True
+                victim.event.set()
+            self._seq += 1
+            waiter = _Waiter(route, priority, self._seq)
+            self._queue.append(waiter)
+        ADMISSION_QUEUED.labels(route=route).inc()
+
+        start = time.monotonic()
+        waiter.event.wait(self.queue_timeout)
+        waited = time.monotonic() - start
+        ADMISSION_QUEUED.labels(route=route).dec()
+        with self._lock:
+            if waiter.admitted:
+                ADMISSION_QUEUE_WAIT.labels(route=route).observe(waited)
+                return True, None, waited
+            if not waiter.evicted:
+                self._queue.remove(waiter)
+        reason = "evicted" if waiter.evicted else "timeout"
+        ADMISSION_SHED.labels(route=route, reason=reason).inc()
+        return False, reason, waited
+
+    def release(self, route, service_time):
+        """Free a slot, adjust an adaptive limit and hand slots to waiters."""
+        with self._lock:
+            self._in_flight -= 1
+            self._route_in_flight[route] -= 1
+            ADMISSION_IN_FLIGHT.labels(route=route).dec()
+            if self.adaptive and route not in self.route_limits:
+                self._adjust(service_time)
+            while self._queue:
+                fitting = [w for w in self._queue if self._fits(w.route)]
+                if not fitting:
+                    break
+                waiter = max(fitting, key=lambda w: (w.priority, -w.seq))
+                self._queue.remove(waiter)
+                self._admit(waiter.route)
+                waiter.admitted = True
+                waiter.event.set()
+
+    def _adjust(self, service_time):
+        old = int(self.limit)
+        if service_time <= self.target_latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            now = time.monotonic()
+            if now - self._last_decrease < self.target_latency:
+                return
+            self._last_decrease = now
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        if int(self.limit) != old:
+            ADMISSION_CONCURRENCY_LIMIT.set(int(self.limit))
+
+
+admission = AdmissionController(
+    ADMISSION_LIMIT,
+    route_limits=ADMISSION_ROUTE_LIMITS,
+    priorities=ADMISSION_PRIORITIES,
+    queue_size=ADMISSION_QUEUE_SIZE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    adaptive=ADMISSION_ADAPTIVE,
+    target_latency=ADMISSION_TARGET_LATENCY,
+    min_limit=ADMISSION_MIN_LIMIT,
+    max_limit=ADMISSION_MAX_LIMIT,
+)
+
+# Probes, scrapes and profiling must keep answering when the app is saturated
+ADMISSION_EXEMPT = {"/health", "/livez", "/readyz", "/metrics", "/admin/profile"}
+
+
+@app.before_request
+def admit_request():
+    if not ADMISSION_ENABLED or request.url_rule is None or request.url_rule.rule in ADMISSION_EXEMPT:
+        return None
+    route = request.url_rule.rule
+    admitted, reason, waited = admission.acquire(route)
+    span = trace.get_current_span()
+    span.set_attribute("admission.queue_wait_ms", waited * 1000)
+    if not admitted:
+        span.set_attribute("admission.shed", reason)
+        response = jsonify({"error": "Service overloaded, retry later", "reason": reason})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(ADMISSION_RETRY_AFTER)
+        return response
+    g.admitted_route = route
+    g.admitted_at = time.monotonic()
+    return None
+
+
+@app.teardown_request
+def release_admission(exc):
+    route = g.pop("admitted_route", None)
+    if route is not None:
+        admission.release(route, time.monotonic() - g.admitted_at)
+
+
+# Cache keys and value codec
+def cache_key_digest(*args, **kwargs):
+    """Stable digest of call arguments, identical across processes and restarts.
+
+    Arguments are canonicalised as compact, key-sorted JSON; values that are
+    not JSON-serialisable fall back to ``repr`` and should have a stable one.
+    """
+    payload = json.dumps([args, kwargs], sort_keys=True, separators=(",", ":"), default=repr)
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(payload.encode())
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class CacheCodec:
+    """Serialise cache values to bytes with optional compression.
+
+    Every encoded value starts with a two-byte header (format, compression),
+    so readers decode any value regardless of their own settings and the
+    codec can be changed without flushing Redis.
+    """
+
+    _FORMATS = {
+        b"j": (lambda obj: json.dumps(obj, separators=(",", ":")).encode(), json.loads),
+    }
+    if msgpack is not None:
+        _FORMATS[b"m"] = (
+            lambda obj: msgpack.packb(obj, use_bin_type=True),
+            lambda data: msgpack.unpackb(data, raw=False),
+        )
+
+    _COMPRESSORS = {b"-": (bytes, bytes), b"z": (zlib.compress, zlib.decompress)}
+    if zstandard is not None:
+        _COMPRESSORS[b"s"] = (zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+
+    _NAMES = {"json": b"j", "msgpack": b"m", "none": b"-", "zlib": b"z", "zstd": b"s"}
+
+    def __init__(self, fmt="json", compression="none", min_bytes=1024):
+        self.format = self._NAMES.get(fmt)
+        if self.format not in self._FORMATS:
+            logger.warning(f"Cache codec '{fmt}' unavailable, falling back to json")
+            self.format = b"j"
+        self.compression = self._NAMES.get(compression)
+        if self.compression not in self._COMPRESSORS:
+            logger.warning(f"Cache compression '{compression}' unavailable, falling back to none")
+            self.compression = b"-"
+        self.min_bytes = min_bytes
+        self._dump = self._FORMATS[self.format][0]
+        self._compress = self._COMPRESSORS[self.compression][0]
+
+    def dumps(self, obj):
+        data = self._dump(obj)
+        if self.compression != b"-" and len(data) >= self.min_bytes:
+            return self.format + self.compression + self._compress(data)
+        return self.format + b"-" + data
+
+    def loads(self, data):
+        load = self._FORMATS[data[:1]][1]
+        decompress = self._COMPRESSORS[data[1:2]][1]
+        return load(decompress(data[2:]))
+
+
+cache_codec = CacheCodec(CACHE_CODEC, CACHE_COMPRESSION, CACHE_COMPRESS_MIN_BYTES)
+
+
+# Cache decorator
+_MISSING = object()
+
+
+class LocalCache:
+    """Bounded, thread-safe in-process LRU cache with per-entry TTL.
+
+    Values are stored by reference, so callers must treat them as read-only.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _run(self, key, flight, fn):
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def do(self, key, fn, timeout=None):
+        """Run ``fn`` once per key; returns ``(result, shared)``.
+
+        Callers that arrive while a call is in flight wait for its result. If
+        the leader takes longer than ``timeout`` they give up and run ``fn``
+        themselves rather than queueing behind a hung call.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            self._run(key, flight, fn)
+        elif not flight.done.wait(timeout):
+            return fn(), False
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, not leader
+
+    def do_async(self, key, fn, executor):
+        """Start ``fn`` in the background unless a call for key is in flight."""
+        flight, leader = self._join(key)
+        if leader:
+            ctx = contextvars.copy_context()
+            executor.submit(ctx.run, self._run, key, flight, fn)
+        return leader
+
+
+local_cache = LocalCache(maxsize=LOCAL_CACHE_SIZE)
+_single_flight = SingleFlight()
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+# Each prefix has a generation counter that is part of every Redis key under
+# it. Reading the generation and the entry happens in one round trip; bumping
+# the generation orphans all older entries at once, and they age out via TTL.
+# Any further KEYS are read in the same round trip.
+_cache_get_script = redis_client.register_script("""
+local generation = redis.call('GET', KEYS[1]) or '0'
+local values = {generation, redis.call('GET', ARGV[1] .. ':g' .. generation .. ':' .. ARGV[2])}
+for i = 2, #KEYS do
+    values[#values + 1] = redis.call('GET', KEYS[i])
+end
+return values
+""")
+
+
+def _generation_key(prefix):
+    return f"cache_gen:{prefix}"
+
+
+def invalidate_cache(prefix):
+    """Invalidate every entry cached under ``prefix`` with a single INCR.
+
+    Other processes may keep serving their in-process copy for up to
+    ``local_ttl`` seconds.
+    """
+    local_cache.invalidate_prefix(f"{prefix}:")
+    return get_redis_client().incr(_generation_key(prefix))
+
+
+def cached(ttl=60, prefix="cache", local_ttl=None, stale_ttl=0, early_refresh=0.0):
+    """Two-tier cache decorator: in-process LRU in front of Redis.
+
+    Entries are invalidated per prefix with ``invalidate_cache(prefix)``.
+    Concurrent misses for the same key are coalesced so only one caller runs
+    the wrapped function. With ``stale_ttl`` set, expired Redis entries are
+    served for that many extra seconds while one background refresh runs.
+    With ``early_refresh`` (a fraction of ``ttl``), entries are refreshed in
+    the background slightly before they expire, at a randomly jittered point
+    so that workers do not all refresh at once.
+    """
+    if local_ttl is None:
+        local_ttl = min(ttl, LOCAL_CACHE_TTL)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            suffix = f"{f.__name__}:{cache_key_digest(*args, **kwargs)}"
+            cache_key = f"{prefix}:{suffix}"
+            redis_key = None
+            
+            value = local_cache.get(cache_key)
+            if value is not _MISSING:
+                CACHE_OPS.labels(tier="local", operation="get", result="hit").inc()
+                return value
+            CACHE_OPS.labels(tier="local", operation="get", result="miss").inc()
+            
+            def load():
+                # Execute function
+                result = f(*args, **kwargs)
+                
+                # Store in cache, under the generation seen at lookup time so a
+                # concurrent invalidation is never overwritten with old data.
+                # Fills may read a replica; rows it has not replayed yet stay
+                # cached for at most ttl + stale_ttl.
+                if redis_key is not None:
+                    with tracer.start_as_current_span("cache_store") as span:
+                        span.set_attribute("cache.key", redis_key)
+                        span.set_attribute("cache.ttl", ttl)
+                        envelope = {"v": result, "exp": time.time() + ttl}
+                        try:
+                            r = get_redis_client()
+                            r.setex(redis_key, ttl + stale_ttl, cache_codec.dumps(envelope))
+                            CACHE_OPS.labels(tier="redis", operation="set", result="success").inc()
+                        except redis.RedisError as e:
+                            logger.warning(f"Redis store error: {e}")
+                            CACHE_OPS.labels(tier="redis", operation="set", result="error").inc()
+                local_cache.set(cache_key, result, local_ttl)
+                return result
+            
+            def refresh():
+                if _single_flight.do_async(redis_key, load, _refresh_executor):
+                    CACHE_OPS.labels(tier="origin", operation="load", result="refresh").inc()
+            
+            with tracer.start_as_current_span("cache_lookup") as span:
+                span.set_attribute("cache.key", cache_key)
+                
+                try:
+                    generation, cached_value = _cache_get_script(
+                        keys=[_generation_key(prefix)], args=[prefix, suffix]
+                    )
+                    generation = int(generation)
+                    redis_key = f"{prefix}:g{generation}:{suffix}"
+                    span.set_attribute("cache.generation", generation)
+                    
+                    if cached_value:
+                        envelope = cache_codec.loads(cached_value)
+                        value = envelope["v"]
+                        remaining = envelope["exp"] - time.time()
+                        span.set_attribute("cache.hit", True)
+                        
+                        if remaining > 0:
+                            CACHE_OPS.labels(tier="redis", operation="get", result="hit").inc()
+                            log_event("cache_hit", "Cache hit", cache_key=cache_key)
+                            local_cache.set(cache_key, value, min(local_ttl, remaining))
+                            if early_refresh and remaining < ttl * early_refresh * random.random():
+                                span.set_attribute("cache.early_refresh", True)
+                                refresh()
+                            return value
+                        
+                        # Past its soft expiry but still within the stale window
+                        span.set_attribute("cache.stale", True)
+                        CACHE_OPS.labels(tier="redis", operation="get", result="stale").inc()
+                        log_event("cache_stale", "Serving stale value", cache_key=cache_key)
+                        refresh()
+                        return value
+                    
+                    span.set_attribute("cache.hit", False)
+                    CACHE_OPS.labels(tier="redis", operation="get", result="miss").inc()
+                    log_event("cache_miss", "Cache miss", cache_key=cache_key)
+                    
+                except redis.RedisError as e:
+                    logger.warning(f"Redis error: {e}")
+                    span.set_attribute("cache.error", str(e))
+                    CACHE_OPS.labels(tier="redis", operation="get", result="error").inc()
+            
+            result, coalesced = _single_flight.do(
+                redis_key or cache_key, load, timeout=CACHE_COALESCE_TIMEOUT
+            )
+            CACHE_OPS.labels(
+                tier="origin", operation="load", result="coalesced" if coalesced else "computed"
+            ).inc()
+            return result
+        return wrapper
+    return decorator
+
+
+# Write-behind view counters
+class WriteBehindCounter:
+    """Per-key counters aggregated in process and written behind in batches.
+
+    incr() only touches a local dict. A background thread sends the buffered
+    deltas to Redis as one pipeline of INCRBYs every ``interval`` seconds, or
+    as soon as ``max_pending`` increments are buffered, and upserts them into
+    Postgres with ``upsert_sql`` every ``db_interval`` seconds. The count
+    served for a key is the Redis total seen at its last flush plus what this
+    process has buffered since. Failed flushes keep their deltas for the next
+    round, and close() drains both sinks.
+    """
+
+    def __init__(self, redis_prefix, upsert_sql, interval=1.0, db_interval=10.0,
+                 max_pending=1000, max_keys=10000):
+        self.redis_prefix = redis_prefix
+        self.upsert_sql = upsert_sql
+        self.interval = interval
+        self.db_interval = db_interval
+        self.max_pending = max_pending
+        self.max_keys = max_keys
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = {"redis": {}, "postgres": {}}
+        self._since = {"redis": None, "postgres": None}   # monotonic time of the oldest buffered increment
+        self._inflight = {}         # deltas being sent to Redis right now
+        self._totals = OrderedDict()  # key -> Redis total at the last flush (LRU-bounded)
+        self._buffered = 0
+        self._closed = False
+        self._thread = None
+        self._pid = None
+
+    def known(self, key):
+        """Whether a Redis total for ``key`` has been seen by this process."""
+        with self._cond:
+            return key in self._totals
+
+    def incr(self, key, total=None):
+        """Count one event for ``key`` and return its current count.
+
+        ``total`` seeds the count the first time a key is seen, e.g. from a
+        GET of the Redis counter batched into the caller's own round trip.
+        """
+        if self._pid != os.getpid():
+            self._start()
+        with self._cond:
+            now = time.monotonic()
+            for sink, pending in self._pending.items():
+                if not pending:
+                    self._since[sink] = now
+                pending[key] = pending.get(key, 0) + 1
+            if total is not None and key not in self._totals:
+                self._remember(key, total)
+            self._buffered += 1
+            if self._buffered >= self.max_pending:
+                self._cond.notify()
+            return self._totals.get(key, 0) + self._inflight.get(key, 0) + self._pending["redis"][key]
+
+    def _remember(self, key, total):
+        self._totals[key] = total
+        self._totals.move_to_end(key)
+        if len(self._totals) > self.max_keys:
+            self._totals.popitem(last=False)
+
+    def _start(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="view-counter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_db_flush = time.monotonic() + self.db_interval
+        while True:
+            with self._cond:
+                if not self._closed and self._buffered < self.max_pending:
+                    self._cond.wait(self.interval)
+                if self._closed:
+                    return
+            try:
+                self.flush_redis()
+                if time.monotonic() >= next_db_flush:
+                    next_db_flush = time.monotonic() + self.db_interval
+                    self.flush_postgres()
+            except Exception as e:
+                logger.error(f"View counter flush failed: {e}")
+
+    def _take(self, sink):
+        with self._cond:
+            pending, self._pending[sink] = self._pending[sink], {}
+            since, self._since[sink] = self._since[sink], None
+            if sink == "redis":
+                self._inflight = pending
+                self._buffered = 0
+        return pending, since
+
+    def _restore(self, sink, pending, since):
+        """Put the deltas of a failed flush back in front of newer ones."""
+        with self._cond:
+            current = self._pending[sink]
+            for key, delta in pending.items():
+                current[key] = current.get(key, 0) + delta
+            self._since[sink] = since
+            if sink == "redis":
+                self._inflight = {}
+        VIEW_FLUSH_ERRORS.labels(sink=sink).inc()
+
+    def _flushed(self, sink, pending, since):
+        VIEW_FLUSH_BATCH.labels(sink=sink).observe(len(pending))
+        VIEW_FLUSH_LAG.labels(sink=sink).observe(time.monotonic() - since)
+
+    def flush_redis(self):
+        """Send buffered deltas to Redis in one pipelined round trip."""
+        with self._flush_lock:
+            pending, since = self._take("redis")
+            if not pending:
+                return
+            with tracer.start_as_current_span("flush_view_counters") as span:
+                span.set_attribute("view_counter.sink", "redis")
+                span.set_attribute("view_counter.keys", len(pending))
+                try:
+                    pipe = get_redis_client().pipeline(transaction=False)
+                    for key, delta in pending.items():
+                        pipe.incrby(f"{self.redis_prefix}{key}", delta)
+                    totals = pipe.execute()
+                except redis.RedisError as e:
+                    logger.warning(f"Failed to flush {len(pending)} view counters to Redis: {e}")
+                    self._restore("redis", pending, since)
+                    return
+            with self._cond:
+                for key, total in zip(pending, totals):
+                    self._remember(key, total)
+                self._inflight = {}
+            self._flushed("redis", pending, since)
+
+    def flush_postgres(self):
+        """Upsert buffered deltas into Postgres in one statement."""
+        with self._flush_lock:
+            pending, since = self._take("postgres")
+            if not pending:
+                return
+            with tracer.start_as_current_span("flush_view_counters") as span:
+                span.set_attribute("view_counter.sink", "postgres")
+                span.set_attribute("view_counter.keys", len(pending))
+                try:
+                    with db_connection() as conn:
+                        # Sorted, so concurrent flushes from other workers lock rows in the same order
+                        rejected = self._upsert(conn, sorted(pending.items()))
+                except psycopg2.ProgrammingError as e:
+                    # Missing table or broken statement: retrying would fail the same way
+                    logger.error(f"Dropped {len(pending)} view counter deltas: {e}")
+                    VIEW_FLUSH_ERRORS.labels(sink="postgres").inc()
+                    return
+                except (psycopg2.Error, PoolTimeout) as e:
+                    logger.warning(f"Failed to flush {len(pending)} view counters to Postgres: {e}")
+                    self._restore("postgres", pending, since)
+                    return
+                if rejected:
+                    span.set_attribute("view_counter.rejected", len(rejected))
+                    logger.error(f"Dropped {len(rejected)} view counter deltas rejected by Postgres: {rejected}")
+                    VIEW_FLUSH_ERRORS.labels(sink="postgres").inc()
+            self._flushed("postgres", pending, since)
+
+    def _upsert(self, conn, rows):
+        """Upsert ``rows``, bisecting around rows Postgres rejects; returns the rejected rows.
+
+        Retrying a rejected row would fail the same way, so only that row is
+        dropped and the rest of the batch is still written.
+        """
+        DB_QUERY_COUNT.labels(operation="upsert").inc()
+        cur = conn.cursor()
+        try:
+            execute_values(cur, self.upsert_sql, rows)
+            conn.commit()
+            return []
+        except (psycopg2.IntegrityError, psycopg2.DataError):
+            conn.rollback()
+            if len(rows) == 1:
+                return rows
+            middle = len(rows) // 2
+            return self._upsert(conn, rows[:middle]) + self._upsert(conn, rows[middle:])
+        finally:
+            cur.close()
+
+    def close(self, timeout=5.0):
+        """Stop the flusher and drain everything still buffered."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush_redis()
+        self.flush_postgres()
+
+
+# Views of items deleted since they were counted are skipped
+ITEM_VIEWS_UPSERT_SQL = """
+    INSERT INTO item_views (item_id, views)
+    SELECT v.item_id, v.views
+    FROM (VALUES %s) AS v(item_id, views)
+    JOIN items i ON i.id = v.item_id
+    ORDER BY v.item_id
+    ON CONFLICT (item_id) DO UPDATE
+    SET views = item_views.views + EXCLUDED.views, updated_at = CURRENT_TIMESTAMP
+"""
+
+view_counter = WriteBehindCounter(
+    "item_views:",
+    ITEM_VIEWS_UPSERT_SQL,
+    interval=VIEW_FLUSH_INTERVAL,
+    db_interval=VIEW_DB_FLUSH_INTERVAL,
+    max_pending=VIEW_FLUSH_MAX_PENDING,
+)
+atexit.register(view_counter.close)
+
+
+# Catalog index
+CATALOG_SQL = """
+    SELECT i.id, i.name, i.description, i.price, i.user_id, u.username as seller
+    FROM items i
+    JOIN users u ON i.user_id = u.id
+"""
+
+
+class CatalogIndex:
+    """Read-optimised copy of the item catalog, kept in sync by LISTEN/NOTIFY.
+
+    A listener thread LISTENs on ``channel`` before loading the whole
+    catalog, so no change can slip in between, then refetches only the rows
+    named by each notification (a seller change refetches their items).
+    Lookups only trust the index while it is known to be in sync: the
+    listener confirms its connection every ``heartbeat`` seconds, and when
+    that was more than ``stale_after`` seconds ago, or the listener is
+    reconnecting, lookups return None and callers read the database.
+    Every reconnect reloads the catalog, since notifications sent while
+    disconnected are lost.
+
+    Applied changes and reconnect reloads also bump the "items" (and, for
+    seller changes, "users") cache generations, so cached list pages
+    follow changes made outside the app. Every process
+    listens, so one change bumps a generation once per process.
+    """
+
+    def __init__(self, connect, channel="catalog_changes", heartbeat=5.0, stale_after=15.0,
+                 max_backoff=30.0, reload_threshold=1000):
+        self.channel = channel
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.max_backoff = max_backoff
+        self.reload_threshold = reload_threshold
+        self._connect = connect
+        self._items = {}            # item id -> (item_json, Decimal price, seller user id)
+        self._synced_at = None      # monotonic time of the last confirmed sync
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Start the listener in this process (lookups fall back until it has loaded)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._items = {}
+            self._synced_at = None
+        threading.Thread(target=self._run, name="catalog-listener", daemon=True).start()
+
+    def _usable(self):
+        if self._pid != os.getpid():
+            self.start()
+            return False
+        synced_at = self._synced_at
+        return synced_at is not None and time.monotonic() - synced_at <= self.stale_after
+
+    def get(self, item_id):
+        """The item as /items/<id> serves it, or None to read the database instead."""
+        if not self._usable():
+            CATALOG_LOOKUPS.labels(result="fallback").inc()
+            return None
+        entry = self._items.get(item_id)
+        CATALOG_LOOKUPS.labels(result="hit" if entry else "miss").inc()
+        return entry[0] if entry else None
+
+    def prices(self, item_ids):
+        """Prices of ``item_ids``, or None unless the index has all of them."""
+        if not self._usable():
+            CATALOG_LOOKUPS.labels(result="fallback").inc()
+            return None
+        items = self._items
+        try:
+            prices = [items[item_id][1] for item_id in item_ids]
+        except KeyError:
+            CATALOG_LOOKUPS.labels(result="miss").inc()
+            return None
+        CATALOG_LOOKUPS.labels(result="hit").inc()
+        return prices
+
+    @staticmethod
+    def _entry(row):
+        return item_json(row), row["price"] or 0, row["user_id"]
+
+    def _mark_synced(self):
+        self._synced_at = time.monotonic()
+        CATALOG_SYNCED_AT.set(time.time())
+
+    def _reload(self, cur, reason):
+        start = time.perf_counter()
+        cur.execute(CATALOG_SQL)
+        self._items = {row["id"]: self._entry(row) for row in cur.fetchall()}
+        CATALOG_RELOADS.labels(reason=reason).inc()
+        CATALOG_RELOAD_LATENCY.observe(time.perf_counter() - start)
+        CATALOG_ITEMS.set(len(self._items))
+        self._mark_synced()
+        logger.info(f"Loaded {len(self._items)} catalog items ({reason})")
+
+    def _refresh(self, cur, item_ids, user_ids):
+        """Refetch changed items and every item of changed sellers."""
+        cur.execute(CATALOG_SQL + " WHERE i.id = ANY(%s) OR i.user_id = ANY(%s)", (list(item_ids), list(user_ids)))
+        rows = {row["id"]: row for row in cur.fetchall()}
+        items = self._items
+        # Items that no longer join (deleted, or their seller was) drop out
+        gone = set(item_ids) | {i for i, (_, _, seller) in items.items() if seller in user_ids}
+        for item_id in gone - rows.keys():
+            items.pop(item_id, None)
+        for item_id, row in rows.items():
+            items[item_id] = self._entry(row)
+        CATALOG_UPDATES.labels(table="items").inc(len(item_ids))
+        CATALOG_UPDATES.labels(table="users").inc(len(user_ids))
+        CATALOG_ITEMS.set(len(items))
+
+    def _listen(self, conn, cur):
+        while True:
+            if select.select([conn], [], [], self.heartbeat) == ([], [], []):
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            else:
+                conn.poll()
+            changed = {"items": set(), "users": set()}
+            reload = False
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    change = json.loads(notify.payload)
+                    changed[change["table"]].add(int(change["id"]))
+                except (ValueError, KeyError, TypeError):
+                    reload = True
+            if reload or len(changed["items"]) + len(changed["users"]) > self.reload_threshold:
+                self._reload(cur, "bulk_change")
+                self._invalidate(("items", "users"))
+            elif changed["items"] or changed["users"]:
+                self._refresh(cur, changed["items"], changed["users"])
+                self._invalidate(("items", "users") if changed["users"] else ("items",))
+            self._mark_synced()
+
+    @staticmethod
+    def _invalidate(prefixes):
+        for prefix in prefixes:
+            try:
+                invalidate_cache(prefix)
+                CACHE_OPS.labels(tier="redis", operation="invalidate", result="success").inc()
+            except redis.RedisError as e:
+                logger.warning(f"Failed to invalidate the {prefix} cache after a catalog change: {e}")
+                CACHE_OPS.labels(tier="redis", operation="invalidate", result="error").inc()
+
+    def _run(self):
+        reason, backoff = "startup", 1.0
+        # The heartbeat would otherwise start a new trace every few seconds
+        with suppress_instrumentation():
+            while True:
+                conn = None
+                try:
+                    conn = self._connect()
+                    conn.autocommit = True
+                    cur = conn.cursor()
+                    cur.execute(f"LISTEN {self.channel}")
+                    self._reload(cur, reason)
+                    if reason == "reconnect":
+                        self._invalidate(("items", "users"))
+                    backoff = 1.0
+                    self._listen(conn, cur)
+                except Exception as e:
+                    self._synced_at = None
+                    logger.warning(f"Catalog listener disconnected, items are read from the database: {e}")
+                finally:
+                    if conn is not None:
+                        try:
+                            conn.close()
+                        except psycopg2.Error:
+                            pass
+                reason = "reconnect"
+                time.sleep(backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, self.max_backoff)
+
+
+catalog = CatalogIndex(get_db_connection, heartbeat=CATALOG_HEARTBEAT, stale_after=CATALOG_STALE_AFTER)
+
+
+# Pagination and streaming helpers
+def page_params(default_limit=None):
+    """Read keyset paging arguments: ``?after=<id>&limit=<n>``."""
+    after = request.args.get("after", type=int)
+    limit = request.args.get("limit", default=default_limit or PAGE_DEFAULT_LIMIT, type=int)
+    return after, max(1, min(limit, PAGE_MAX_LIMIT))
+
+
+def wants_stream():
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def page_response(key, rows, limit):
+    """Page body with the cursor for the next page (None on the last page)."""
+    next_after = rows[-1]["id"] if rows and len(rows) >= limit else None
+    return {key: rows, "count": len(rows), "next_after": next_after}
+
+
+def stream_rows(key, query, params, to_json):
+    """Stream query results as ``{"<key>": [...], "count": n}``.
+
+    Rows come from a server-side (named) cursor in batches of
+    STREAM_FETCH_SIZE and are written out as they arrive, so memory use does
+    not depend on the size of the result.
+    """
+    def generate():
+        with tracer.start_as_current_span(f"stream_{key}") as span:
+            DB_QUERY_COUNT.labels(operation="select").inc()
+            count = 0
+            with db_read_connection() as conn:
+                cur = conn.cursor(name=f"stream_{key}")
+                cur.itersize = STREAM_FETCH_SIZE
+                cur.execute(query, params)
+                yield f'{{"{key}": ['
+                while True:
+                    rows = cur.fetchmany(STREAM_FETCH_SIZE)
+                    if not rows:
+                        break
+                    chunk = ",".join(json.dumps(to_json(row)) for row in rows)
+                    yield ("," if count else "") + chunk
+                    count += len(rows)
+                cur.close()
+            yield f'], "count": {count}}}'
+            span.set_attribute(f"{key}.count", count)
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+# Conditional GET: the ETag of a list response is a digest of the body
+# actually served, so it is right whichever replica or cache tier produced
+# the body, and it outlives Redis restarts and evictions. A matching
+# If-None-Match is answered with 304 and the body is not sent.
+HTTP_CACHE_CONTROL = f"public, max-age={HTTP_CACHE_MAX_AGE}" if HTTP_CACHE_MAX_AGE > 0 else "public, no-cache"
+
+
+def body_etag(body):
+    """Strong ETag for a response body."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(body)
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def check_etag(endpoint, body, if_none_match):
+    """Return ``(etag, not_modified)`` for a full list ``body`` and count the outcome."""
+    etag = body_etag(body)
+    if if_none_match.contains(etag):
+        CONDITIONAL_RESPONSES.labels(endpoint=endpoint, result="not_modified").inc()
+        CONDITIONAL_BYTES_SAVED.labels(endpoint=endpoint).inc(len(body))
+        return etag, True
+    CONDITIONAL_RESPONSES.labels(endpoint=endpoint, result="full").inc()
+    return etag, False
+
+
+def conditional(f):
+    """Serve a list handler with conditional GET on its body's ETag.
+
+    Streamed responses have no body to digest up front and are sent as is.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not HTTP_ETAGS_ENABLED:
+            return f(*args, **kwargs)
+        endpoint = request.url_rule.rule
+        if wants_stream():
+            CONDITIONAL_RESPONSES.labels(endpoint=endpoint, result="streamed").inc()
+            return f(*args, **kwargs)
+        response = app.make_response(f(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        etag, not_modified = check_etag(endpoint, response.get_data(), request.if_none_match)
+        if not_modified:
+            response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = HTTP_CACHE_CONTROL
+        return response
+    return wrapper
+
 
-# Redis connection
-def get_redis_client():
-    """Get a Redis client."""
-    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+def user_json(user):
+    return {
+        "id": user["id"],
+        "username": user["username"],
+        "email": user["email"],
+        "created_at": str(user["created_at"])
+    }
 
-# Cache decorator
-def cached(ttl=60, prefix="cache"):
-    """Cache decorator using Redis."""
-    def decorator(f):
-        @wraps(f)
-        def wrapper(*args, **kwargs):
-            cache_key = f"{prefix}:{f.__name__}:{hash(str(args) + str(kwargs))}"
-            
-            with tracer.start_as_current_span("cache_lookup") as span:
-                span.set_attribute("cache.key", cache_key)
-                
-                try:
-                    r = get_redis_client()
-                    cached_value = r.get(cache_key)
-                    
-                    if cached_value:
-                        span.set_attribute("cache.hit", True)
-                        CACHE_OPS.labels(operation="get", result="hit").inc()
-                        logger.info(f"Cache hit for {cache_key}")
-                        return json.loads(cached_value)
-                    
-                    span.set_attribute("cache.hit", False)
-                    CACHE_OPS.labels(operation="get", result="miss").inc()
-                    logger.info(f"Cache miss for {cache_key}")
-                    
-                except redis.RedisError as e:
-                    logger.warning(f"Redis error: {e}")
-                    span.set_attribute("cache.error", str(e))
-            
-            # Execute function
-            result = f(*args, **kwargs)
-            
-            # Store in cache
-            with tracer.start_as_current_span("cache_store") as span:
-                span.set_attribute("cache.key", cache_key)
-                span.set_attribute("cache.ttl", ttl)
-                try:
-                    r = get_redis_client()
-                    r.setex(cache_key, ttl, json.dumps(result))
-                    CACHE_OPS.labels(operation="set", result="success").inc()
-                except redis.RedisError as e:
-                    logger.warning(f"Redis store error: {e}")
-                    CACHE_OPS.labels(operation="set", result="error").inc()
-            
-            return result
-        return wrapper
-    return decorator
+
+def item_json(item):
+    return {
+        "id": item["id"],
+        "name": item["name"],
+        "description": item["description"],
+        "price": float(item["price"]) if item["price"] else 0,
+        "seller": item["seller"]
+    }
+
+
+def order_json(order):
+    return {
+        "id": order["id"],
+        "total": float(order["total"]) if order["total"] else 0,
+        "status": order["status"],
+        "username": order["username"],
+        "created_at": str(order["created_at"])
+    }
 
 
 # ============ API Endpoints ============
 
+API_ENDPOINTS = {
+    "/livez": "Liveness probe (no dependency checks)",
+    "/readyz": "Readiness with dependency status (/health is an alias)",
+    "/users": "List users (?after=<id>&limit=<n>, ?stream=1 for a full export; ETag/If-None-Match)",
+    "/users/<id>": "Get user by ID",
+    "/items": "List items (cached pages, ?after=<id>&limit=<n>, ?stream=1; ETag/If-None-Match)",
+    "/items/<id>": "Get item by ID",
+    "/orders": "Create order (POST) or list orders (GET, ETag/If-None-Match)",
+    "/orders/bulk": "Bulk-load orders from a JSON array or NDJSON (POST)",
+    "/stats": "Order count and revenue (rollups, no table scans)",
+    "/stats/users": "Top users by revenue or orders (?sort=&limit=)",
+    "/stats/items": "Top items by revenue or quantity (?sort=&limit=)",
+    "/stats/timeline": "Orders and revenue per hour or day (?bucket=&since=&until=)",
+    "/slow": "Simulated slow endpoint",
+    "/error": "Simulated error endpoint",
+    "/metrics": "Prometheus metrics",
+    "/admin/profile": "High-frequency profiling window: POST ?seconds=&rate= to open, GET, DELETE",
+}
+
+
 @app.route("/")
 def index():
     """Homepage with API documentation."""
-    return jsonify({
-        "service": SERVICE_NAME,
-        "version": "1.0.0",
-        "endpoints": {
-            "/health": "Health check",
-            "/users": "List all users",
-            "/users/<id>": "Get user by ID",
-            "/items": "List all items (cached)",
-            "/items/<id>": "Get item by ID",
-            "/orders": "Create order (POST) or list orders (GET)",
-            "/slow": "Simulated slow endpoint",
-            "/error": "Simulated error endpoint",
-            "/metrics": "Prometheus metrics"
-        }
-    })
+    return jsonify({"service": SERVICE_NAME, "version": "1.0.0", "endpoints": API_ENDPOINTS})
 
 
-@app.route("/health")
-def health():
-    """Health check with dependency status."""
-    with tracer.start_as_current_span("health_check") as span:
-        status = {"status": "healthy", "checks": {}}
-        
-        # Check PostgreSQL
-        with tracer.start_as_current_span("check_postgres"):
+# Health probes
+class HealthChecker:
+    """Dependency readiness, checked in the background and served from a snapshot.
+
+    A checker thread runs every check each ``interval`` seconds on its own
+    worker thread, waiting at most ``timeout`` seconds for it, so a hung
+    dependency is reported as timed out instead of stalling the probe; a
+    check still stuck from an earlier round is not started again. Probes
+    only read the pre-rendered snapshot, and a snapshot older than
+    ``stale_after`` seconds (the checker itself is stuck) is not ready.
+    Until the first round completes, the process reports "starting".
+    """
+
+    def __init__(self, checks, interval=5.0, timeout=2.0, stale_after=15.0):
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._snapshot = None       # (checked_at monotonic, healthy, body)
+        self._running = {}
+        self._pid = None
+        self._executor = None
+
+    def start(self):
+        """Start the checker in this process; the first round runs in the background too."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._snapshot = None
+                self._running = {}
+                self._executor = ThreadPoolExecutor(max_workers=len(self.checks), thread_name_prefix="health-check")
+                threading.Thread(target=self._run, name="health-checker", daemon=True).start()
+
+    def _run(self):
+        while True:
             try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute("SELECT 1")
-                cur.close()
-                conn.close()
-                status["checks"]["postgres"] = "healthy"
+                self.check()
+            except RuntimeError:
+                return      # executor shut down: the interpreter is exiting
             except Exception as e:
-                status["checks"]["postgres"] = f"unhealthy: {e}"
-                status["status"] = "degraded"
-        
-        # Check Redis
-        with tracer.start_as_current_span("check_redis"):
+                logger.error(f"Health check round failed: {e}")
+            time.sleep(self.interval)
+
+    def _timed(self, name, check):
+        # Background checks would otherwise each start a new trace
+        with suppress_instrumentation():
+            start = time.perf_counter()
             try:
-                r = get_redis_client()
-                r.ping()
-                status["checks"]["redis"] = "healthy"
+                check()
+            except Exception:
+                HEALTH_CHECK_LATENCY.labels(dependency=name, result="error").observe(time.perf_counter() - start)
+                raise
+            elapsed = time.perf_counter() - start
+            HEALTH_CHECK_LATENCY.labels(dependency=name, result="success").observe(elapsed)
+            return elapsed
+
+    def check(self):
+        """Run one round of checks and publish the result."""
+        for name, check in self.checks.items():
+            if name not in self._running or self._running[name].done():
+                self._running[name] = self._executor.submit(self._timed, name, check)
+
+        deadline = time.monotonic() + self.timeout
+        checks, healthy = {}, True
+        for name, future in self._running.items():
+            try:
+                elapsed = future.result(max(0.0, deadline - time.monotonic()))
+                checks[name] = {"status": "healthy", "latency_ms": round(elapsed * 1000, 3)}
+            except FutureTimeout:
+                HEALTH_CHECK_LATENCY.labels(dependency=name, result="timeout").observe(self.timeout)
+                checks[name] = {"status": "unhealthy", "error": f"timed out after {self.timeout}s"}
             except Exception as e:
-                status["checks"]["redis"] = f"unhealthy: {e}"
-                status["status"] = "degraded"
-        
-        span.set_attribute("health.status", status["status"])
-        return jsonify(status), 200 if status["status"] == "healthy" else 503
+                checks[name] = {"status": "unhealthy", "error": str(e)}
+            up = checks[name]["status"] == "healthy"
+            HEALTH_CHECK_UP.labels(dependency=name).set(1 if up else 0)
+            healthy = healthy and up
+
+        checked_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        body = json.dumps({
+            "status": "healthy" if healthy else "degraded",
+            "checked_at": checked_at,
+            "checks": checks,
+        })
+        self._snapshot = (time.monotonic(), healthy, body)
+
+    def snapshot(self):
+        """Return ``(healthy, body)`` from the last round, without touching dependencies."""
+        if self._pid != os.getpid():
+            self.start()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return False, json.dumps({"status": "starting", "checks": {}})
+        checked_at, healthy, body = snapshot
+        age = time.monotonic() - checked_at
+        if age > self.stale_after:
+            return False, json.dumps({"status": "stale", "age_seconds": round(age, 1), "checks": {}})
+        return healthy, body
+
+
+def check_postgres():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+
+
+def check_redis():
+    get_redis_client().ping()
+
+
+health_checker = HealthChecker(
+    {"postgres": check_postgres, "redis": check_redis},
+    interval=HEALTH_CHECK_INTERVAL,
+    timeout=HEALTH_CHECK_TIMEOUT,
+    stale_after=HEALTH_STALE_AFTER,
+)
+
+
+@app.route("/livez")
+def livez():
+    """Liveness: the process is up and serving requests; no dependency checks."""
+    return Response('{"status": "alive"}', mimetype="application/json")
+
+
+@app.route("/readyz")
+@app.route("/health")
+def readyz():
+    """Readiness with dependency status, from the background checker's snapshot."""
+    healthy, body = health_checker.snapshot()
+    return Response(body, status=200 if healthy else 503, mimetype="application/json")
+
+
+USERS_SQL = """
+    SELECT id, username, email, created_at
+    FROM users
+    WHERE (%(after)s IS NULL OR id > %(after)s)
+    ORDER BY id
+    LIMIT %(limit)s
+"""
 
 
 @app.route("/users")
+@conditional
 def list_users():
-    """List all users from database."""
+    """List users from database, one keyset page at a time."""
+    after, limit = page_params()
+    if wants_stream():
+        return stream_rows("users", USERS_SQL, {"after": after, "limit": None}, user_json)
+    
     with tracer.start_as_current_span("list_users") as span:
         DB_QUERY_COUNT.labels(operation="select").inc()
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, username, email, created_at FROM users ORDER BY id")
-        users = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_read_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(USERS_SQL, {"after": after, "limit": limit})
+            users = cur.fetchall()
+            cur.close()
         
         span.set_attribute("users.count", len(users))
         
         # Convert datetime to string
-        result = []
-        for user in users:
-            result.append({
-                "id": user["id"],
-                "username": user["username"],
-                "email": user["email"],
-                "created_at": str(user["created_at"])
-            })
+        result = [user_json(user) for user in users]
         
-        return jsonify({"users": result, "count": len(result)})
+        return jsonify(page_response("users", result, limit))
 
 
 @app.route("/users/<int:user_id>")
@@ -251,26 +2758,24 @@ def get_user(user_id):
     with tracer.start_as_current_span("get_user") as span:
         span.set_attribute("user.id", user_id)
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Get user
-        DB_QUERY_COUNT.labels(operation="select").inc()
-        cur.execute("SELECT id, username, email, created_at FROM users WHERE id = %s", (user_id,))
-        user = cur.fetchone()
-        
-        if not user:
+        with db_read_connection() as conn:
+            cur = conn.cursor()
+            
+            # Get user
+            DB_QUERY_COUNT.labels(operation="select").inc()
+            cur.execute("SELECT id, username, email, created_at FROM users WHERE id = %s", (user_id,))
+            user = cur.fetchone()
+            
+            if not user:
+                cur.close()
+                return jsonify({"error": "User not found"}), 404
+            
+            # Get user's items
+            DB_QUERY_COUNT.labels(operation="select").inc()
+            cur.execute("SELECT id, name, description, price FROM items WHERE user_id = %s", (user_id,))
+            items = cur.fetchall()
+            
             cur.close()
-            conn.close()
-            return jsonify({"error": "User not found"}), 404
-        
-        # Get user's items
-        DB_QUERY_COUNT.labels(operation="select").inc()
-        cur.execute("SELECT id, name, description, price FROM items WHERE user_id = %s", (user_id,))
-        items = cur.fetchall()
-        
-        cur.close()
-        conn.close()
         
         span.set_attribute("user.items_count", len(items))
         
@@ -285,87 +2790,113 @@ def get_user(user_id):
         })
 
 
+ITEMS_SQL = """
+    SELECT i.id, i.name, i.description, i.price, u.username as seller
+    FROM items i
+    JOIN users u ON i.user_id = u.id
+    WHERE (%(after)s IS NULL OR i.id > %(after)s)
+    ORDER BY i.id
+    LIMIT %(limit)s
+"""
+
+
 @app.route("/items")
-@cached(ttl=30, prefix="items")
+@conditional
 def list_items():
-    """List all items (cached for 30 seconds)."""
+    """List items, one keyset page at a time (pages cached for 30 seconds)."""
+    after, limit = page_params()
+    if wants_stream():
+        return stream_rows("items", ITEMS_SQL, {"after": after, "limit": None}, item_json)
+    return jsonify(items_page(after, limit))
+
+
+@cached(ttl=30, prefix="items", stale_ttl=30, early_refresh=0.1)
+def items_page(after, limit):
     with tracer.start_as_current_span("list_items_db") as span:
         DB_QUERY_COUNT.labels(operation="select").inc()
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT i.id, i.name, i.description, i.price, u.username as seller
-            FROM items i
-            JOIN users u ON i.user_id = u.id
-            ORDER BY i.id
-        """)
-        items = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_read_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(ITEMS_SQL, {"after": after, "limit": limit})
+            items = cur.fetchall()
+            cur.close()
         
         span.set_attribute("items.count", len(items))
         
-        result = []
-        for item in items:
-            result.append({
-                "id": item["id"],
-                "name": item["name"],
-                "description": item["description"],
-                "price": float(item["price"]) if item["price"] else 0,
-                "seller": item["seller"]
-            })
+        result = [item_json(item) for item in items]
         
-        return {"items": result, "count": len(result)}
+        return page_response("items", result, limit)
 
 
 @app.route("/items/<int:item_id>")
 def get_item(item_id):
-    """Get item by ID with view counter."""
-    cache_key = f"item_views:{item_id}"
+    """Get item by ID with view counter (item cached in Redis)."""
+    cache_suffix = f"item:{item_id}"
+    views_key = f"item_views:{item_id}"
     
     with tracer.start_as_current_span("get_item") as span:
         span.set_attribute("item.id", item_id)
         
-        # Increment view counter in Redis
-        with tracer.start_as_current_span("increment_view_counter"):
-            try:
-                r = get_redis_client()
-                views = r.incr(cache_key)
-                CACHE_OPS.labels(operation="incr", result="success").inc()
-            except redis.RedisError:
-                views = 0
-                CACHE_OPS.labels(operation="incr", result="error").inc()
+        item = catalog.get(item_id) if CATALOG_INDEX_ENABLED else None
+        span.set_attribute("catalog.hit", item is not None)
         
-        # Get item from database
-        DB_QUERY_COUNT.labels(operation="select").inc()
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT i.id, i.name, i.description, i.price, u.username as seller
-            FROM items i
-            JOIN users u ON i.user_id = u.id
-            WHERE i.id = %s
-        """, (item_id,))
-        item = cur.fetchone()
-        cur.close()
-        conn.close()
+        # Views are counted write-behind; the first view of an item in this
+        # process reads its flushed total in the same round trip as the cache
+        # The Redis copy lives under the "items" cache generation, so every
+        # invalidate_cache("items") retires it along with the list pages
+        cached_item = total_views = generation = None
+        need_cache, need_views = item is None, not view_counter.known(item_id)
+        if need_cache or need_views:
+            with tracer.start_as_current_span("cache_lookup"):
+                try:
+                    if need_cache:
+                        generation, cached_item, *views = _cache_get_script(
+                            keys=[_generation_key("items"), *([views_key] if need_views else [])],
+                            args=["items", cache_suffix],
+                        )
+                        generation = int(generation)
+                        CACHE_OPS.labels(tier="redis", operation="get", result="hit" if cached_item else "miss").inc()
+                    else:
+                        views = [get_redis_client().get(views_key)]
+                    if need_views:
+                        total_views = int(views[0] or 0)
+                except redis.RedisError:
+                    CACHE_OPS.labels(tier="redis", operation="get", result="error").inc()
         
-        if not item:
-            return jsonify({"error": "Item not found"}), 404
+        if item is None and cached_item:
+            item = cache_codec.loads(cached_item)
+        elif item is None:
+            # Get item from database
+            DB_QUERY_COUNT.labels(operation="select").inc()
+            with db_read_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT i.id, i.name, i.description, i.price, u.username as seller
+                    FROM items i
+                    JOIN users u ON i.user_id = u.id
+                    WHERE i.id = %s
+                """, (item_id,))
+                row = cur.fetchone()
+                cur.close()
+            
+            if not row:
+                return jsonify({"error": "Item not found"}), 404
+            
+            item = item_json(row)
+            if generation is not None:
+                try:
+                    get_redis_client().setex(
+                        f"items:g{generation}:{cache_suffix}", ITEM_CACHE_TTL, cache_codec.dumps(item)
+                    )
+                    CACHE_OPS.labels(tier="redis", operation="set", result="success").inc()
+                except redis.RedisError:
+                    CACHE_OPS.labels(tier="redis", operation="set", result="error").inc()
         
+        views = view_counter.incr(item_id, total_views)
         span.set_attribute("item.views", views)
+        span.set_attribute("cache.hit", bool(cached_item))
         
-        return jsonify({
-            "item": {
-                "id": item["id"],
-                "name": item["name"],
-                "description": item["description"],
-                "price": float(item["price"]) if item["price"] else 0,
-                "seller": item["seller"],
-                "views": views
-            }
-        })
+        return jsonify({"item": dict(item, views=views)})
 
 
 @app.route("/orders", methods=["GET", "POST"])
@@ -377,113 +2908,473 @@ def orders():
         return create_order()
 
 
+# Newest first; ids are assigned in creation order so they double as the
+# keyset cursor (``after`` returns orders older than the given id).
+ORDERS_SQL = """
+    SELECT o.id, o.total, o.status, o.created_at, u.username
+    FROM orders o
+    JOIN users u ON o.user_id = u.id
+    WHERE (%(after)s IS NULL OR o.id < %(after)s)
+    ORDER BY o.id DESC
+    LIMIT %(limit)s
+"""
+
+
+@conditional
 def list_orders():
-    """List all orders."""
+    """List orders, newest first, one keyset page at a time."""
+    after, limit = page_params(default_limit=50)
+    if wants_stream():
+        return stream_rows("orders", ORDERS_SQL, {"after": after, "limit": None}, order_json)
+    
     with tracer.start_as_current_span("list_orders") as span:
         DB_QUERY_COUNT.labels(operation="select").inc()
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT o.id, o.total, o.status, o.created_at, u.username
-            FROM orders o
-            JOIN users u ON o.user_id = u.id
-            ORDER BY o.created_at DESC
-            LIMIT 50
-        """)
-        orders = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_read_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(ORDERS_SQL, {"after": after, "limit": limit})
+            orders = cur.fetchall()
+            cur.close()
         
         span.set_attribute("orders.count", len(orders))
         
-        result = []
-        for order in orders:
-            result.append({
-                "id": order["id"],
-                "total": float(order["total"]) if order["total"] else 0,
-                "status": order["status"],
-                "username": order["username"],
-                "created_at": str(order["created_at"])
-            })
+        result = [order_json(order) for order in orders]
         
-        return jsonify({"orders": result, "count": len(result)})
+        return jsonify(page_response("orders", result, limit))
+
+
+class InvalidQuantity(ValueError):
+    pass
+
+
+def order_lines(data):
+    """Collapse an order payload into parallel (item_ids, quantities) lists.
+
+    Accepts ``item_ids`` (repeated ids add up) and/or ``items`` as
+    ``[{"item_id": 1, "quantity": 2}, ...]``. Raises InvalidQuantity unless
+    every line and every item's total is between 1 and ORDER_MAX_QUANTITY.
+    """
+    quantities = {}
+    for item_id in data.get("item_ids", []):
+        quantities[int(item_id)] = quantities.get(int(item_id), 0) + 1
+    for line in data.get("items", []):
+        item_id = int(line["item_id"])
+        quantity = int(line.get("quantity", 1))
+        if not 1 <= quantity <= ORDER_MAX_QUANTITY:
+            raise InvalidQuantity(quantity)
+        quantities[item_id] = quantities.get(item_id, 0) + quantity
+    if any(quantity > ORDER_MAX_QUANTITY for quantity in quantities.values()):
+        raise InvalidQuantity(max(quantities.values()))
+    return list(quantities), list(quantities.values())
+
+
+# Prices the requested lines, inserts the order and all of its items in one
+# statement. order_items is fed from the request rather than the priced join so
+# unknown item ids still fail on the foreign key instead of being dropped.
+CREATE_ORDER_SQL = """
+    WITH requested AS (
+        SELECT item_id, quantity
+        FROM unnest(%(item_ids)s::int[], %(quantities)s::int[]) AS r(item_id, quantity)
+    ), new_order AS (
+        INSERT INTO orders (user_id, total, status)
+        SELECT %(user_id)s, COALESCE(SUM(i.price * r.quantity), 0), 'pending'
+        FROM requested r
+        LEFT JOIN items i ON i.id = r.item_id
+        RETURNING id, total
+    ), new_items AS (
+        INSERT INTO order_items (order_id, item_id, quantity)
+        SELECT o.id, r.item_id, r.quantity
+        FROM new_order o, requested r
+    )
+    SELECT id, total FROM new_order
+"""
+
+# Same, with the total already priced from the catalog index
+CREATE_PRICED_ORDER_SQL = """
+    WITH new_order AS (
+        INSERT INTO orders (user_id, total, status)
+        VALUES (%(user_id)s, %(total)s, 'pending')
+        RETURNING id, total
+    ), new_items AS (
+        INSERT INTO order_items (order_id, item_id, quantity)
+        SELECT o.id, r.item_id, r.quantity
+        FROM new_order o, unnest(%(item_ids)s::int[], %(quantities)s::int[]) AS r(item_id, quantity)
+    )
+    SELECT id, total FROM new_order
+"""
 
 
 def create_order():
     """Create a new order with items."""
     with tracer.start_as_current_span("create_order") as span:
         data = request.get_json() or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Order must be a JSON object"}), 400
         user_id = data.get("user_id", random.randint(1, 3))
-        item_ids = data.get("item_ids", [random.randint(1, 5) for _ in range(random.randint(1, 3))])
+        if "item_ids" not in data and "items" not in data:
+            data["item_ids"] = [random.randint(1, 5) for _ in range(random.randint(1, 3))]
+        try:
+            item_ids, quantities = order_lines(data)
+        except InvalidQuantity:
+            return jsonify({"error": f"Quantities must be between 1 and {ORDER_MAX_QUANTITY}"}), 400
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "Invalid order items"}), 400
         
         span.set_attribute("order.user_id", user_id)
         span.set_attribute("order.items_count", len(item_ids))
+        span.set_attribute("order.quantity", sum(quantities))
         
-        conn = get_db_connection()
-        cur = conn.cursor()
+        # Price from the catalog index when it has every item; otherwise (or
+        # for unknown ids, which must fail on the foreign key) in Postgres
+        prices = catalog.prices(item_ids) if CATALOG_INDEX_ENABLED else None
+        span.set_attribute("order.priced_by", "catalog" if prices is not None else "db")
         
-        try:
-            # Calculate total
-            with tracer.start_as_current_span("calculate_total"):
-                DB_QUERY_COUNT.labels(operation="select").inc()
-                cur.execute("SELECT SUM(price) as total FROM items WHERE id = ANY(%s)", (item_ids,))
-                result = cur.fetchone()
-                total = float(result["total"]) if result["total"] else 0
+        with db_connection() as conn:
+            cur = conn.cursor()
+        
+            try:
+                # Calculate total, create order and add its items in one round trip
+                with tracer.start_as_current_span("insert_order"):
+                    DB_QUERY_COUNT.labels(operation="insert").inc()
+                    params = {"user_id": user_id, "item_ids": item_ids, "quantities": quantities}
+                    if prices is not None:
+                        params["total"] = sum(price * quantity for price, quantity in zip(prices, quantities))
+                        cur.execute(CREATE_PRICED_ORDER_SQL, params)
+                    else:
+                        cur.execute(CREATE_ORDER_SQL, params)
+                    result = cur.fetchone()
+                    order_id = result["id"]
+                    total = float(result["total"]) if result["total"] else 0
             
-            # Create order
-            with tracer.start_as_current_span("insert_order"):
-                DB_QUERY_COUNT.labels(operation="insert").inc()
-                cur.execute(
-                    "INSERT INTO orders (user_id, total, status) VALUES (%s, %s, 'pending') RETURNING id",
-                    (user_id, total)
-                )
-                order_id = cur.fetchone()["id"]
+                conn.commit()
+                mark_write()
+                span.set_attribute("order.id", order_id)
+                span.set_attribute("order.total", total)
+                span.set_attribute("order.db_statements", 1)
             
-            # Add order items
-            with tracer.start_as_current_span("insert_order_items"):
-                for item_id in item_ids:
-                    DB_QUERY_COUNT.labels(operation="insert").inc()
-                    cur.execute(
-                        "INSERT INTO order_items (order_id, item_id) VALUES (%s, %s)",
-                        (order_id, item_id)
-                    )
+                # Invalidate items cache
+                with tracer.start_as_current_span("invalidate_cache") as cache_span:
+                    try:
+                        cache_span.set_attribute("cache.generation", invalidate_cache("items"))
+                        CACHE_OPS.labels(tier="redis", operation="invalidate", result="success").inc()
+                    except redis.RedisError:
+                        CACHE_OPS.labels(tier="redis", operation="invalidate", result="error").inc()
             
-            conn.commit()
-            span.set_attribute("order.id", order_id)
-            span.set_attribute("order.total", total)
+                log_event("order_created", "Created order", order_id=order_id, total=total)
             
-            # Invalidate items cache
-            with tracer.start_as_current_span("invalidate_cache"):
-                try:
-                    r = get_redis_client()
-                    keys = r.keys("items:*")
-                    if keys:
-                        r.delete(*keys)
-                    CACHE_OPS.labels(operation="delete", result="success").inc()
-                except redis.RedisError:
-                    CACHE_OPS.labels(operation="delete", result="error").inc()
+                return jsonify({
+                    "order": {
+                        "id": order_id,
+                        "user_id": user_id,
+                        "total": total,
+                        "status": "pending",
+                        "items": item_ids,
+                        "quantities": quantities
+                    }
+                }), 201
             
-            logger.info(f"Created order {order_id} with total {total}")
+            except psycopg2.IntegrityError:
+                conn.rollback()
+                return jsonify({"error": "Unknown user or item"}), 400
+            except psycopg2.DataError:
+                conn.rollback()
+                return jsonify({"error": "Invalid order"}), 400
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Order creation failed: {e}")
+                span.set_attribute("error", str(e))
+                return jsonify({"error": str(e)}), 500
+            finally:
+                cur.close()
+
+
+@app.route("/orders/bulk", methods=["POST"])
+def bulk_orders():
+    """Bulk-load orders from a JSON array or an NDJSON stream using COPY.
+
+    Orders are processed in chunks of BULK_ORDER_CHUNK, each chunk in its own
+    transaction, so one bad chunk does not discard the rest of the upload.
+    """
+    with tracer.start_as_current_span("bulk_orders") as span:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            orders_iter = iter_ndjson(request.stream)
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, list):
+                return jsonify({"error": "Expected a JSON array or NDJSON body"}), 400
+            orders_iter = iter(data)
+        
+        started = time.perf_counter()
+        chunks = []
+        known = {"items": {}, "users": set()}
+        loaded = {"orders": 0, "order_items": 0, "rejected": 0}
+        
+        with db_connection() as conn:
+            for index, chunk in enumerate(iter_chunks(orders_iter, BULK_ORDER_CHUNK)):
+                result = load_order_chunk(conn, index, index * BULK_ORDER_CHUNK, chunk, known)
+                chunks.append(result)
+                loaded["rejected"] += len(result["rejected"])
+                if result["status"] == "committed":
+                    loaded["orders"] += result["orders"]
+                    loaded["order_items"] += result["order_items"]
+        
+        elapsed = time.perf_counter() - started
+        rows = loaded["orders"] + loaded["order_items"]
+        rows_per_second = rows / elapsed if elapsed > 0 else 0.0
+        BULK_ROWS_PER_SECOND.set(rows_per_second)
+        
+        span.set_attribute("bulk.chunks", len(chunks))
+        span.set_attribute("bulk.orders", loaded["orders"])
+        span.set_attribute("bulk.rejected", loaded["rejected"])
+        span.set_attribute("bulk.rows_per_second", rows_per_second)
+        
+        if loaded["orders"]:
+            mark_write()
+            try:
+                invalidate_cache("items")
+                CACHE_OPS.labels(tier="redis", operation="invalidate", result="success").inc()
+            except redis.RedisError:
+                CACHE_OPS.labels(tier="redis", operation="invalidate", result="error").inc()
+        
+        logger.info(f"Bulk loaded {loaded['orders']} orders in {len(chunks)} chunks ({rows_per_second:.0f} rows/s)")
+        
+        failed = any(chunk["status"] != "committed" for chunk in chunks)
+        return jsonify({
+            **loaded,
+            "chunks": chunks,
+            "seconds": round(elapsed, 4),
+            "rows_per_second": round(rows_per_second, 1)
+        }), 207 if failed else 200
+
+
+def iter_ndjson(stream):
+    """Yield one decoded object per non-empty line of an NDJSON stream."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def iter_chunks(iterable, size):
+    chunk = []
+    for entry in iterable:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_order_chunk(conn, index, offset, chunk, known):
+    """Validate and COPY one chunk of orders in a single transaction.
+
+    Rejected orders are reported by their position in the whole upload
+    (``offset`` is the position of the chunk's first order).
+
+    ``known`` caches item prices and user ids already looked up earlier in the
+    same upload, so each id is validated against Postgres at most once.
+    """
+    with tracer.start_as_current_span("bulk_chunk") as span:
+        span.set_attribute("bulk.chunk", index)
+        span.set_attribute("bulk.chunk_size", len(chunk))
+        started = time.perf_counter()
+        result = {"chunk": index, "received": len(chunk), "orders": 0, "order_items": 0, "rejected": []}
+        
+        parsed = []
+        for position, order in enumerate(chunk, start=offset):
+            try:
+                user_id = int(order["user_id"])
+                item_ids, quantities = order_lines(order)
+            except InvalidQuantity:
+                result["rejected"].append({"index": position, "reason": "invalid_quantity"})
+                BULK_REJECTED.labels(reason="invalid_quantity").inc()
+                continue
+            except (KeyError, TypeError, ValueError):
+                result["rejected"].append({"index": position, "reason": "invalid"})
+                BULK_REJECTED.labels(reason="invalid").inc()
+                continue
+            if not item_ids:
+                result["rejected"].append({"index": position, "reason": "empty"})
+                BULK_REJECTED.labels(reason="empty").inc()
+                continue
+            parsed.append((position, user_id, item_ids, quantities))
+        
+        cur = conn.cursor()
+        try:
+            # Look up every item and user this chunk needs in one query
+            new_items = {i for _, _, ids, _ in parsed for i in ids} - known["items"].keys()
+            new_users = {u for _, u, _, _ in parsed} - known["users"]
+            if new_items or new_users:
+                DB_QUERY_COUNT.labels(operation="select").inc()
+                cur.execute("""
+                    SELECT 'item' AS kind, id, price FROM items WHERE id = ANY(%s)
+                    UNION ALL
+                    SELECT 'user' AS kind, id, NULL FROM users WHERE id = ANY(%s)
+                """, (list(new_items), list(new_users)))
+                for row in cur.fetchall():
+                    if row["kind"] == "item":
+                        known["items"][row["id"]] = row["price"] or 0
+                    else:
+                        known["users"].add(row["id"])
             
-            return jsonify({
-                "order": {
-                    "id": order_id,
-                    "user_id": user_id,
-                    "total": total,
-                    "status": "pending",
-                    "items": item_ids
-                }
-            }), 201
+            valid = []
+            for position, user_id, item_ids, quantities in parsed:
+                if user_id not in known["users"]:
+                    reason = "unknown_user"
+                elif any(i not in known["items"] for i in item_ids):
+                    reason = "unknown_item"
+                else:
+                    valid.append((user_id, item_ids, quantities))
+                    continue
+                result["rejected"].append({"index": position, "reason": reason})
+                BULK_REJECTED.labels(reason=reason).inc()
             
-        except Exception as e:
+            if valid:
+                # Reserve order ids up front because COPY cannot return them
+                DB_QUERY_COUNT.labels(operation="select").inc()
+                cur.execute(
+                    "SELECT nextval(pg_get_serial_sequence('orders', 'id')) AS id FROM generate_series(1, %s)",
+                    (len(valid),)
+                )
+                order_ids = [row["id"] for row in cur.fetchall()]
+                
+                orders_buf, items_buf = io.StringIO(), io.StringIO()
+                for order_id, (user_id, item_ids, quantities) in zip(order_ids, valid):
+                    total = sum(known["items"][i] * q for i, q in zip(item_ids, quantities))
+                    orders_buf.write(f"{order_id}\t{user_id}\t{total}\tpending\n")
+                    for item_id, quantity in zip(item_ids, quantities):
+                        items_buf.write(f"{order_id}\t{item_id}\t{quantity}\n")
+                        result["order_items"] += 1
+                orders_buf.seek(0)
+                items_buf.seek(0)
+                
+                DB_QUERY_COUNT.labels(operation="copy").inc(2)
+                cur.copy_expert("COPY orders (id, user_id, total, status) FROM STDIN", orders_buf)
+                cur.copy_expert("COPY order_items (order_id, item_id, quantity) FROM STDIN", items_buf)
+                result["orders"] = len(valid)
+                result["first_order_id"] = order_ids[0]
+            
+            conn.commit()
+            result["status"] = "committed"
+            BULK_ROWS.labels(table="orders").inc(result["orders"])
+            BULK_ROWS.labels(table="order_items").inc(result["order_items"])
+        except psycopg2.Error as e:
             conn.rollback()
-            logger.error(f"Order creation failed: {e}")
-            span.set_attribute("error", str(e))
-            return jsonify({"error": str(e)}), 500
+            logger.error(f"Bulk chunk {index} failed: {e}")
+            span.record_exception(e)
+            result.update(status="failed", error=str(e).strip(), orders=0, order_items=0)
         finally:
             cur.close()
-            conn.close()
+        
+        elapsed = time.perf_counter() - started
+        BULK_CHUNK_LATENCY.labels(result=result["status"]).observe(elapsed)
+        result["seconds"] = round(elapsed, 4)
+        span.set_attribute("bulk.status", result["status"])
+        return result
+
+
+# Order statistics, read from rollup tables that triggers keep up to date on
+# every order insert (see services/init/01-schema.sql)
+STATS_SORTS = {
+    "users": ("revenue", "orders"),
+    "items": ("revenue", "quantity"),
+}
+
+STATS_TOP_SQL = {
+    "users": """
+        SELECT s.user_id, u.username, s.orders, s.revenue
+        FROM order_stats_by_user s
+        JOIN users u ON u.id = s.user_id
+        ORDER BY s.{sort} DESC
+        LIMIT %(limit)s
+    """,
+    "items": """
+        SELECT s.item_id, i.name, s.orders, s.quantity, s.revenue
+        FROM order_stats_by_item s
+        JOIN items i ON i.id = s.item_id
+        ORDER BY s.{sort} DESC
+        LIMIT %(limit)s
+    """,
+}
+
+STATS_TIMELINE_SQL = """
+    SELECT date_trunc(%(bucket)s, bucket) AS bucket, SUM(orders)::bigint AS orders, SUM(revenue) AS revenue
+    FROM order_stats_by_hour
+    WHERE bucket >= %(since)s AND bucket < %(until)s
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+STATS_TIMELINE_SPANS = {"hour": timedelta(hours=24), "day": timedelta(days=30)}
+
+
+def stats_json(row):
+    return {
+        key: float(value) if key == "revenue" else value
+        for key, value in row.items()
+    }
+
+
+def stats_query(span_name, sql, params):
+    with tracer.start_as_current_span(span_name) as span:
+        DB_QUERY_COUNT.labels(operation="select").inc()
+        with db_read_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cur.close()
+        span.set_attribute("stats.rows", len(rows))
+        return rows
+
+
+@app.route("/stats")
+def stats():
+    """Total order count and revenue."""
+    rows = stats_query(
+        "stats_totals",
+        "SELECT COALESCE(SUM(orders), 0)::bigint AS orders, COALESCE(SUM(revenue), 0) AS revenue FROM order_stats_by_hour",
+        None,
+    )
+    return jsonify(stats_json(rows[0]))
+
+
+@app.route("/stats/<any(users, items):kind>")
+def stats_top(kind):
+    """Top users or items by revenue (default), orders or quantity."""
+    sort = request.args.get("sort", "revenue")
+    if sort not in STATS_SORTS[kind]:
+        return jsonify({"error": f"sort must be one of {', '.join(STATS_SORTS[kind])}"}), 400
+    limit = max(1, min(request.args.get("limit", default=10, type=int), PAGE_MAX_LIMIT))
+    rows = stats_query(f"stats_top_{kind}", STATS_TOP_SQL[kind].format(sort=sort), {"limit": limit})
+    return jsonify({"sort": sort, kind: [stats_json(row) for row in rows]})
+
+
+@app.route("/stats/timeline")
+def stats_timeline():
+    """Orders and revenue per hour or day, over the last day/month by default."""
+    bucket = request.args.get("bucket", "hour")
+    if bucket not in STATS_TIMELINE_SPANS:
+        return jsonify({"error": "bucket must be hour or day"}), 400
+    # Aware timestamps are converted to the database's time zone, which is
+    # the one the buckets are stored in; the app's own zone may differ
+    try:
+        until = datetime.fromisoformat(request.args["until"]) if "until" in request.args else datetime.now(timezone.utc)
+        since = (datetime.fromisoformat(request.args["since"]) if "since" in request.args
+                 else until - STATS_TIMELINE_SPANS[bucket])
+    except ValueError:
+        return jsonify({"error": "since/until must be ISO 8601 timestamps"}), 400
+    rows = stats_query("stats_timeline", STATS_TIMELINE_SQL, {"bucket": bucket, "since": since, "until": until})
+    return jsonify({
+        "bucket": bucket,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "points": [dict(stats_json(row), bucket=row["bucket"].isoformat()) for row in rows],
+    })
 
 
 @app.route("/slow")
@@ -505,12 +3396,11 @@ def slow_endpoint():
         # Simulate database query
         with tracer.start_as_current_span("slow_db_query"):
             DB_QUERY_COUNT.labels(operation="select").inc()
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT pg_sleep(%s), COUNT(*) FROM items", (delay * 0.3,))
-            cur.fetchone()
-            cur.close()
-            conn.close()
+            with db_read_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT pg_sleep(%s), COUNT(*) FROM items", (delay * 0.3,))
+                cur.fetchone()
+                cur.close()
         
         # Additional processing time
         time.sleep(delay * 0.4)
@@ -530,9 +3420,9 @@ def error_endpoint():
         
         if error_type == "database":
             try:
-                conn = get_db_connection()
-                cur = conn.cursor()
-                cur.execute("SELECT * FROM nonexistent_table")
+                with db_connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute("SELECT * FROM nonexistent_table")
             except Exception as e:
                 span.record_exception(e)
                 return jsonify({"error": "Database error", "details": str(e)}), 500
@@ -549,8 +3439,127 @@ def error_endpoint():
 
 @app.route("/metrics")
 def metrics():
-    """Prometheus metrics endpoint."""
-    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+    """Prometheus metrics endpoint.
+
+    Serves OpenMetrics (with trace exemplars) when the scraper asks for it,
+    aggregated across workers in multi-process mode.
+    """
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        registry.register(ExemplarCollector(multiprocess.MultiProcessCollector(None), PROMETHEUS_MULTIPROC_DIR))
+    encoder, content_type = choose_encoder(request.headers.get("Accept"))
+    return encoder(registry), 200, {"Content-Type": content_type}
+
+
+# On-demand profiling
+class ProfilingWindow:
+    """High-frequency profiling for a limited time, in every worker.
+
+    Opening a window stores its sample rate and id in Redis, expiring with
+    the window. A thread in each process polls that key every
+    ``poll_interval`` seconds (one GET) and restarts the profiler at the
+    window's rate with a ``profile_window=<id>`` tag, so the window's
+    samples can be selected on their own, until the key is gone.
+    """
+
+    KEY = "profiling:window"
+
+    def __init__(self, profiler, poll_interval=1.0):
+        self.profiler = profiler
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._applied = None
+        self._pid = None
+
+    def open(self, seconds, rate):
+        now = datetime.now(timezone.utc)
+        window = {
+            "id": str(int(now.timestamp() * 1000)),
+            "rate": rate,
+            "until": (now + timedelta(seconds=seconds)).isoformat(timespec="seconds"),
+        }
+        get_redis_client().set(self.KEY, json.dumps(window), ex=seconds)
+        self._wakeup.set()
+        return window
+
+    def close(self):
+        get_redis_client().delete(self.KEY)
+        self._wakeup.set()
+
+    def current(self):
+        raw = get_redis_client().get(self.KEY)
+        return json.loads(raw) if raw else None
+
+    def start(self):
+        """Start polling in this process (a no-op unless the profiler runs)."""
+        if self._pid != os.getpid() and self.profiler.active:
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="profile-window", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                with suppress_instrumentation():
+                    window = self.current()
+                self.apply(window)
+            except Exception as e:
+                logger.warning(f"Profiling window check failed: {e}")
+
+    def apply(self, window):
+        window_id = window["id"] if window else None
+        if window_id == self._applied:
+            return
+        if window:
+            self.profiler.start(min(window["rate"], PROFILE_WINDOW_MAX_RATE), {"profile_window": window_id})
+            PROFILE_WINDOWS.inc()
+            logger.info(f"Profiling at {self.profiler.rate} Hz until {window['until']} (window {window_id})")
+        else:
+            self.profiler.start()
+            logger.info(f"Profiling back at {self.profiler.rate} Hz")
+        self._applied = window_id
+
+
+profile_window = ProfilingWindow(profiler, poll_interval=PROFILE_WINDOW_POLL_INTERVAL)
+
+
+def admin_authorized():
+    return not ADMIN_TOKEN or hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {ADMIN_TOKEN}"
+    )
+
+
+@app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+def admin_profile():
+    """Open (POST ?seconds=&rate=), show (GET) or close (DELETE) a high-frequency profiling window."""
+    if not admin_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    if not profiler.active:
+        return jsonify({"error": "Profiling is disabled"}), 409
+    try:
+        if request.method == "POST":
+            seconds = request.args.get("seconds", default=30, type=int)
+            rate = request.args.get("rate", default=PROFILE_WINDOW_MAX_RATE, type=int)
+            window = profile_window.open(
+                max(1, min(seconds, PROFILE_WINDOW_MAX_SECONDS)), max(1, min(rate, PROFILE_WINDOW_MAX_RATE))
+            )
+        elif request.method == "DELETE":
+            profile_window.close()
+            window = None
+        else:
+            window = profile_window.current()
+    except redis.RedisError as e:
+        logger.warning(f"Profiling window unavailable: {e}")
+        return jsonify({"error": "Profiling window unavailable"}), 503
+    body = {"window": window, "sample_rate": profiler.rate}
+    if window:
+        body["query"] = (
+            f'process_cpu:cpu:nanoseconds:cpu:nanoseconds'
+            f'{{service_name="{SERVICE_NAME}", profile_window="{window["id"]}"}}'
+        )
+    return jsonify(body), 201 if request.method == "POST" else 200
 
 
 # Error handlers
@@ -567,6 +3576,11 @@ def internal_error(e):
 if __name__ == "__main__":
     logger.info(f"Starting {SERVICE_NAME}")
     logger.info(f"OTLP endpoint: {OTLP_ENDPOINT}")
-    logger.info(f"PostgreSQL: {POSTGRES_HOST}:{POSTGRES_PORT}")
+    logger.info(f"PostgreSQL: {POSTGRES_HOST}:{POSTGRES_PORT} (pool {POSTGRES_POOL_MIN}-{POSTGRES_POOL_MAX})")
+    try:
+        db_pool.warm()
+    except Exception as e:
+        logger.warning(f"Failed to warm database pool: {e}")
     logger.info(f"Redis: {REDIS_HOST}:{REDIS_PORT}")
+    profile_window.start()
     app.run(host="0.0.0.0", port=5000, debug=False)
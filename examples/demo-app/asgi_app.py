@@ -0,0 +1,939 @@
+"""
+OIB demo app, asyncio (ASGI) serving mode
+
+The same API as app.py, with the same spans and Prometheus metrics, served
+from an event loop: Postgres through psycopg 3's async pool and Redis
+through redis.asyncio, so a request waiting on I/O (or on ``/slow``'s
+sleeps) holds no thread and concurrency is bounded by the connection pools
+rather than by the thread count. Independent I/O within a request runs
+concurrently (the readiness checks, and the user and items queries of
+``/users/<id>``).
+
+    uvicorn asgi_app:application --host 0.0.0.0 --port 5000 --loop uvloop
+
+Configuration, SQL, metrics, tracing setup and the in-process catalog
+index and view counters come from app.py. ``/orders/bulk`` is served by
+app.py's Flask handler in a thread (COPY ingestion is bound by Postgres,
+not by waiting), and admission control only applies to that route.
+Serve one process per container (or per core) and scale out; metrics are
+per process unless PROMETHEUS_MULTIPROC_DIR is set.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import psycopg
+import redis
+import redis.asyncio
+from asgiref.wsgi import WsgiToAsgi
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from quart import Quart, Response, g, has_request_context, jsonify, request
+
+from opentelemetry import trace
+from opentelemetry.instrumentation.asgi import OpenTelemetryMiddleware
+from opentelemetry.instrumentation.psycopg import PsycopgInstrumentor
+from opentelemetry.instrumentation.utils import suppress_instrumentation
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.exposition import choose_encoder
+
+import app as sync_app
+from app import (
+    API_ENDPOINTS, CACHE_COALESCE_TIMEOUT, CACHE_OPS, CATALOG_INDEX_ENABLED, CONDITIONAL_RESPONSES, CREATE_ORDER_SQL,
+    CREATE_PRICED_ORDER_SQL, DB_POOL_CONNECTIONS, DB_POOL_TIMEOUTS, DB_POOL_WAIT, DB_QUERY_COUNT, DB_QUERY_LATENCY, DB_READ_ROUTES,
+    DB_TARGETS, HEALTH_CHECK_INTERVAL, HEALTH_CHECK_LATENCY, HEALTH_CHECK_TIMEOUT, HEALTH_CHECK_UP,
+    HEALTH_STALE_AFTER, HTTP_CACHE_CONTROL, HTTP_ETAGS_ENABLED, ITEM_CACHE_TTL, ITEMS_SQL, ORDER_MAX_QUANTITY,
+    ORDERS_SQL, PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT,
+    POSTGRES_DB, POSTGRES_HOST, POSTGRES_PASSWORD, POSTGRES_POOL_MAX,
+    POSTGRES_POOL_MAX_LIFETIME, POSTGRES_POOL_MIN, POSTGRES_POOL_TIMEOUT, POSTGRES_PORT,
+    POSTGRES_READ_YOUR_WRITES, POSTGRES_REPLICA_EJECT_SECONDS, POSTGRES_REPLICA_HOSTS,
+    POSTGRES_REPLICA_STRATEGY, POSTGRES_USER, PROMETHEUS_MULTIPROC_DIR, READ_YOUR_WRITES_COOKIE,
+    REDIS_HOST, REDIS_POOL_MAX, REDIS_POOL_TIMEOUT, REDIS_PORT, REDIS_ROUNDTRIPS,
+    REDIS_ROUNDTRIPS_PER_REQUEST, REDIS_SOCKET_TIMEOUT, REQUEST_COUNT, REQUEST_LATENCY, SERVICE_NAME,
+    STATS_SORTS, STATS_TIMELINE_SPANS, STATS_TIMELINE_SQL, STATS_TOP_SQL, STREAM_FETCH_SIZE, USERS_SQL,
+    ExemplarCollector, InvalidQuantity, ReplicaSet, _MISSING, _cache_get_script, _generation_key, cache_codec,
+    cache_key_digest, catalog, check_etag, exemplar_store, item_json, local_cache, log_event, order_json,
+    order_lines, page_response, profile_window, profiler, stats_json, trace_exemplar, user_json, view_counter,
+)
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer(__name__)
+
+# psycopg 3 (psycopg2 and redis, including redis.asyncio, are instrumented by app.py)
+PsycopgInstrumentor().instrument()
+
+# Profiling tags are per thread, and every request here runs on the event
+# loop's thread: samples keep only the static tags
+profiler.thread_tags = False
+
+quart_app = Quart(__name__)
+
+
+# Database connection pools
+class TimedAsyncCursor(psycopg.AsyncClientCursor):
+    """Async cursor that records query latency per database target.
+
+    Parameters are bound client-side, as psycopg2 does, so app.py's SQL
+    (``%(after)s IS NULL`` with a None ``after``) runs unchanged.
+    """
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            info = self.connection.info
+            target = DB_TARGETS.get((info.host, info.port), "primary")
+            DB_QUERY_LATENCY.labels(target=target).observe(elapsed)
+            if replicas is not None:
+                replicas.observe(target, elapsed)
+
+
+async def _set_read_only(conn):
+    await conn.set_read_only(True)
+
+
+def make_pool(host, port, name, readonly=False):
+    return AsyncConnectionPool(
+        psycopg.conninfo.make_conninfo(
+            host=host, port=port, user=POSTGRES_USER, password=POSTGRES_PASSWORD, dbname=POSTGRES_DB
+        ),
+        kwargs={"row_factory": dict_row, "cursor_factory": TimedAsyncCursor},
+        configure=_set_read_only if readonly else None,
+        min_size=POSTGRES_POOL_MIN,
+        max_size=POSTGRES_POOL_MAX,
+        timeout=POSTGRES_POOL_TIMEOUT,
+        max_lifetime=POSTGRES_POOL_MAX_LIFETIME,
+        name=name,
+        open=False,
+    )
+
+
+db_pool = make_pool(POSTGRES_HOST, POSTGRES_PORT, "primary")
+
+replicas = ReplicaSet(
+    [
+        make_pool(host, port, f"replica-{index}", readonly=True)
+        for index, (host, port) in enumerate(POSTGRES_REPLICA_HOSTS, start=1)
+    ],
+    strategy=POSTGRES_REPLICA_STRATEGY,
+    eject_seconds=POSTGRES_REPLICA_EJECT_SECONDS,
+) if POSTGRES_REPLICA_HOSTS else None
+
+all_pools = [db_pool] + (replicas.pools if replicas is not None else [])
+
+
+def _report(pool):
+    stats = pool.get_stats()
+    DB_POOL_CONNECTIONS.labels(pool=pool.name, state="in_use").set(
+        stats["pool_size"] - stats["pool_available"]
+    )
+    DB_POOL_CONNECTIONS.labels(pool=pool.name, state="idle").set(stats["pool_available"])
+
+
+@asynccontextmanager
+async def pool_connection(pool):
+    """Borrow a connection from ``pool``; it commits (or rolls back on error) on exit."""
+    start = time.monotonic()
+    try:
+        async with pool.connection() as conn:
+            DB_POOL_WAIT.labels(pool=pool.name).observe(time.monotonic() - start)
+            _report(pool)
+            yield conn
+    except PoolTimeout:
+        DB_POOL_TIMEOUTS.labels(pool=pool.name).inc()
+        raise
+    finally:
+        _report(pool)
+
+
+def db_connection():
+    """Borrow a primary connection (use as an async context manager)."""
+    return pool_connection(db_pool)
+
+
+def mark_write():
+    """Record that this request wrote, so the client reads its own writes."""
+    g.db_wrote = True
+
+
+def reads_from_primary():
+    if g.get("db_wrote"):
+        return True
+    until = request.cookies.get(READ_YOUR_WRITES_COOKIE, type=float)
+    return until is not None and until > time.time()
+
+
+@asynccontextmanager
+async def db_read_connection(primary=None):
+    """Borrow a connection for read-only queries, routed as in app.py.
+
+    Response generators run outside the request context, so they pass the
+    request's reads_from_primary() in.
+    """
+    pool = None
+    if replicas is not None:
+        if primary is None:
+            primary = has_request_context() and reads_from_primary()
+        if primary:
+            DB_READ_ROUTES.labels(target="primary", reason="read_your_writes").inc()
+        else:
+            pool = replicas.pick()
+            if pool is None:
+                DB_READ_ROUTES.labels(target="primary", reason="replicas_ejected").inc()
+    if pool is not None:
+        acquired = False
+        try:
+            async with pool_connection(pool) as conn:
+                acquired = True
+                DB_READ_ROUTES.labels(target=pool.name, reason="replica").inc()
+                yield conn
+            return
+        except Exception as e:
+            if acquired and not isinstance(e, psycopg.OperationalError):
+                raise
+            replicas.eject(pool, e)
+            if acquired:
+                raise
+            DB_READ_ROUTES.labels(target="primary", reason="replica_failed").inc()
+
+    async with db_connection() as conn:
+        yield conn
+
+
+async def fetch(query, params=None, read=True):
+    """Run one query on a pooled connection and return every row."""
+    async with (db_read_connection() if read else db_connection()) as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchall()
+
+
+# Redis connection
+class CountingConnection(redis.asyncio.Connection):
+    """Async Redis connection that counts network round trips per HTTP request."""
+
+    async def send_packed_command(self, command, check_health=True):
+        if has_request_context():
+            g.redis_roundtrips = g.get("redis_roundtrips", 0) + 1
+        return await super().send_packed_command(command, check_health=check_health)
+
+
+redis_pool = redis.asyncio.BlockingConnectionPool(
+    connection_class=CountingConnection,
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    max_connections=REDIS_POOL_MAX,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+    health_check_interval=30,
+    decode_responses=False,
+)
+redis_client = redis.asyncio.Redis(connection_pool=redis_pool)
+cache_get_script = redis_client.register_script(_cache_get_script.script)
+
+
+# Request metrics middleware
+@quart_app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+    if request.url_rule is not None:
+        # Name the server span by route, as the Flask instrumentation does
+        span = trace.get_current_span()
+        span.update_name(f"{request.method} {request.url_rule.rule}")
+        span.set_attribute("http.route", request.url_rule.rule)
+
+
+@quart_app.after_request
+async def record_request_metrics(response):
+    """Per-route request count/latency (with trace exemplars) and Redis round trips."""
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_COUNT.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+    if "request_start" in g:
+        elapsed = time.perf_counter() - g.request_start
+        labels = {"method": request.method, "endpoint": endpoint}
+        exemplar = trace_exemplar()
+        REQUEST_LATENCY.labels(**labels).observe(elapsed, exemplar=exemplar)
+        if exemplar and exemplar_store:
+            exemplar_store.record(REQUEST_LATENCY, labels, elapsed, exemplar)
+
+    roundtrips = g.get("redis_roundtrips", 0)
+    REDIS_ROUNDTRIPS_PER_REQUEST.labels(endpoint=endpoint).observe(roundtrips)
+    if roundtrips:
+        REDIS_ROUNDTRIPS.labels(endpoint=endpoint).inc(roundtrips)
+    return response
+
+
+@quart_app.after_request
+async def set_read_your_writes_cookie(response):
+    if g.get("db_wrote") and replicas is not None and POSTGRES_READ_YOUR_WRITES > 0:
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE, f"{time.time() + POSTGRES_READ_YOUR_WRITES:.3f}",
+            max_age=math.ceil(POSTGRES_READ_YOUR_WRITES), httponly=True, samesite="Lax",
+        )
+    return response
+
+
+# Cache
+_flights = {}   # cache key -> task loading it
+
+
+def _flight(key, load):
+    """Return ``(task, joined)``: the running load for ``key``, or a new one."""
+    task = _flights.get(key)
+    if task is not None:
+        return task, True
+    task = asyncio.ensure_future(load())
+    _flights[key] = task
+    task.add_done_callback(lambda _: _flights.pop(key, None))
+    return task, False
+
+
+def cached(ttl=60, prefix="cache", local_ttl=None, stale_ttl=0, early_refresh=0.0):
+    """Async twin of app.cached(): same tiers, keys, envelopes and generations.
+
+    Sync and async processes share Redis entries and invalidations.
+    Concurrent misses for a key share one load task, and stale or early
+    refreshes run as background tasks.
+    """
+    if local_ttl is None:
+        local_ttl = min(ttl, sync_app.LOCAL_CACHE_TTL)
+
+    def decorator(f):
+        async def wrapper(*args, **kwargs):
+            suffix = f"{f.__name__}:{cache_key_digest(*args, **kwargs)}"
+            cache_key = f"{prefix}:{suffix}"
+            redis_key = None
+
+            value = local_cache.get(cache_key)
+            if value is not _MISSING:
+                CACHE_OPS.labels(tier="local", operation="get", result="hit").inc()
+                return value
+            CACHE_OPS.labels(tier="local", operation="get", result="miss").inc()
+
+            async def load():
+                result = await f(*args, **kwargs)
+                if redis_key is not None:
+                    with tracer.start_as_current_span("cache_store") as span:
+                        span.set_attribute("cache.key", redis_key)
+                        span.set_attribute("cache.ttl", ttl)
+                        envelope = {"v": result, "exp": time.time() + ttl}
+                        try:
+                            await redis_client.setex(redis_key, ttl + stale_ttl, cache_codec.dumps(envelope))
+                            CACHE_OPS.labels(tier="redis", operation="set", result="success").inc()
+                        except redis.RedisError as e:
+                            logger.warning(f"Redis store error: {e}")
+                            CACHE_OPS.labels(tier="redis", operation="set", result="error").inc()
+                local_cache.set(cache_key, result, local_ttl)
+                return result
+
+            def refresh():
+                if not _flight(redis_key, load)[1]:
+                    CACHE_OPS.labels(tier="origin", operation="load", result="refresh").inc()
+
+            with tracer.start_as_current_span("cache_lookup") as span:
+                span.set_attribute("cache.key", cache_key)
+
+                try:
+                    generation, cached_value = await cache_get_script(
+                        keys=[_generation_key(prefix)], args=[prefix, suffix]
+                    )
+                    generation = int(generation)
+                    redis_key = f"{prefix}:g{generation}:{suffix}"
+                    span.set_attribute("cache.generation", generation)
+
+                    if cached_value:
+                        envelope = cache_codec.loads(cached_value)
+                        value = envelope["v"]
+                        remaining = envelope["exp"] - time.time()
+                        span.set_attribute("cache.hit", True)
+
+                        if remaining > 0:
+                            CACHE_OPS.labels(tier="redis", operation="get", result="hit").inc()
+                            log_event("cache_hit", "Cache hit", cache_key=cache_key)
+                            local_cache.set(cache_key, value, min(local_ttl, remaining))
+                            if early_refresh and remaining < ttl * early_refresh * random.random():
+                                span.set_attribute("cache.early_refresh", True)
+                                refresh()
+                            return value
+
+                        span.set_attribute("cache.stale", True)
+                        CACHE_OPS.labels(tier="redis", operation="get", result="stale").inc()
+                        log_event("cache_stale", "Serving stale value", cache_key=cache_key)
+                        refresh()
+                        return value
+
+                    span.set_attribute("cache.hit", False)
+                    CACHE_OPS.labels(tier="redis", operation="get", result="miss").inc()
+                    log_event("cache_miss", "Cache miss", cache_key=cache_key)
+
+                except redis.RedisError as e:
+                    logger.warning(f"Redis error: {e}")
+                    span.set_attribute("cache.error", str(e))
+                    CACHE_OPS.labels(tier="redis", operation="get", result="error").inc()
+
+            task, coalesced = _flight(redis_key or cache_key, load)
+            if not coalesced:
+                result = await task
+            else:
+                try:
+                    result = await asyncio.wait_for(asyncio.shield(task), CACHE_COALESCE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # Like SingleFlight.do(): don't queue behind a hung load
+                    result, coalesced = await load(), False
+            CACHE_OPS.labels(
+                tier="origin", operation="load", result="coalesced" if coalesced else "computed"
+            ).inc()
+            return result
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorator
+
+
+async def invalidate_cache(prefix):
+    local_cache.invalidate_prefix(f"{prefix}:")
+    return await redis_client.incr(_generation_key(prefix))
+
+
+def conditional(f):
+    """Async twin of app.conditional(): the same body-digest ETags."""
+    async def wrapper(*args, **kwargs):
+        if not HTTP_ETAGS_ENABLED:
+            return await f(*args, **kwargs)
+        endpoint = request.url_rule.rule
+        if wants_stream():
+            CONDITIONAL_RESPONSES.labels(endpoint=endpoint, result="streamed").inc()
+            return await f(*args, **kwargs)
+        response = await quart_app.make_response(await f(*args, **kwargs))
+        if response.status_code != 200:
+            return response
+        etag, not_modified = check_etag(endpoint, await response.get_data(), request.if_none_match)
+        if not_modified:
+            response = Response("", status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = HTTP_CACHE_CONTROL
+        return response
+    wrapper.__name__ = f.__name__
+    return wrapper
+
+
+# Pagination and streaming helpers
+def page_params(default_limit=None):
+    after = request.args.get("after", type=int)
+    limit = request.args.get("limit", default=default_limit or PAGE_DEFAULT_LIMIT, type=int)
+    return after, max(1, min(limit, PAGE_MAX_LIMIT))
+
+
+def wants_stream():
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def stream_rows(key, query, params, to_json):
+    """Stream query results as ``{"<key>": [...], "count": n}``.
+
+    Rows arrive in chunks of STREAM_FETCH_SIZE (libpq chunked-rows mode) and
+    are written out as they arrive, like app.stream_rows()'s named cursor.
+    """
+    primary = reads_from_primary()
+
+    async def generate():
+        with tracer.start_as_current_span(f"stream_{key}") as span:
+            DB_QUERY_COUNT.labels(operation="select").inc()
+            count = 0
+            yield f'{{"{key}": ['
+            async with db_read_connection(primary) as conn:
+                rows = []
+                async for row in conn.cursor().stream(query, params, size=STREAM_FETCH_SIZE):
+                    rows.append(row)
+                    if len(rows) == STREAM_FETCH_SIZE:
+                        yield ("," if count else "") + ",".join(json.dumps(to_json(row)) for row in rows)
+                        count += len(rows)
+                        rows = []
+                if rows:
+                    yield ("," if count else "") + ",".join(json.dumps(to_json(row)) for row in rows)
+                    count += len(rows)
+            yield f'], "count": {count}}}'
+            span.set_attribute(f"{key}.count", count)
+    return Response(generate(), mimetype="application/json")
+
+
+# ============ API Endpoints ============
+
+@quart_app.route("/")
+async def index():
+    """Homepage with API documentation."""
+    return jsonify({"service": SERVICE_NAME, "version": "1.0.0", "endpoints": API_ENDPOINTS})
+
+
+# Health probes
+class AsyncHealthChecker:
+    """Readiness checks on the event loop, served from a snapshot.
+
+    Every ``interval`` seconds a background task runs all checks
+    concurrently, each cancelled after ``timeout`` seconds. Snapshots are
+    in the same format as app.HealthChecker's, and one older than
+    ``stale_after`` seconds is not ready.
+    """
+
+    def __init__(self, checks, interval=5.0, timeout=2.0, stale_after=15.0):
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self._snapshot = None       # (checked_at monotonic, healthy, body)
+        self._task = None
+
+    async def start(self):
+        """Check in the background, starting now (not ready until the first round)."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Health check round failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _timed(self, name, check):
+        # Background checks would otherwise each start a new trace
+        with suppress_instrumentation():
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(check(), self.timeout)
+            except asyncio.TimeoutError:
+                HEALTH_CHECK_LATENCY.labels(dependency=name, result="timeout").observe(self.timeout)
+                return {"status": "unhealthy", "error": f"timed out after {self.timeout}s"}
+            except Exception as e:
+                HEALTH_CHECK_LATENCY.labels(dependency=name, result="error").observe(time.perf_counter() - start)
+                return {"status": "unhealthy", "error": str(e)}
+            elapsed = time.perf_counter() - start
+            HEALTH_CHECK_LATENCY.labels(dependency=name, result="success").observe(elapsed)
+            return {"status": "healthy", "latency_ms": round(elapsed * 1000, 3)}
+
+    async def check(self):
+        """Run one round of checks concurrently and publish the result."""
+        results = await asyncio.gather(*(self._timed(name, check) for name, check in self.checks.items()))
+        checks = dict(zip(self.checks, results))
+        healthy = True
+        for name, result in checks.items():
+            up = result["status"] == "healthy"
+            HEALTH_CHECK_UP.labels(dependency=name).set(1 if up else 0)
+            healthy = healthy and up
+
+        body = json.dumps({
+            "status": "healthy" if healthy else "degraded",
+            "checked_at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "checks": checks,
+        })
+        self._snapshot = (time.monotonic(), healthy, body)
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return False, json.dumps({"status": "starting", "checks": {}})
+        checked_at, healthy, body = snapshot
+        age = time.monotonic() - checked_at
+        if age > self.stale_after:
+            return False, json.dumps({"status": "stale", "age_seconds": round(age, 1), "checks": {}})
+        return healthy, body
+
+
+async def check_postgres():
+    async with db_connection() as conn:
+        await conn.execute("SELECT 1")
+
+
+async def check_redis():
+    await redis_client.ping()
+
+
+health_checker = AsyncHealthChecker(
+    {"postgres": check_postgres, "redis": check_redis},
+    interval=HEALTH_CHECK_INTERVAL,
+    timeout=HEALTH_CHECK_TIMEOUT,
+    stale_after=HEALTH_STALE_AFTER,
+)
+
+
+@quart_app.route("/livez")
+async def livez():
+    return Response('{"status": "alive"}', mimetype="application/json")
+
+
+@quart_app.route("/readyz")
+@quart_app.route("/health")
+async def readyz():
+    healthy, body = health_checker.snapshot()
+    return Response(body, status=200 if healthy else 503, mimetype="application/json")
+
+
+@quart_app.route("/users")
+@conditional
+async def list_users():
+    after, limit = page_params()
+    if wants_stream():
+        return stream_rows("users", USERS_SQL, {"after": after, "limit": None}, user_json)
+
+    with tracer.start_as_current_span("list_users") as span:
+        DB_QUERY_COUNT.labels(operation="select").inc()
+        users = await fetch(USERS_SQL, {"after": after, "limit": limit})
+        span.set_attribute("users.count", len(users))
+        return jsonify(page_response("users", [user_json(user) for user in users], limit))
+
+
+@quart_app.route("/users/<int:user_id>")
+async def get_user(user_id):
+    """Get user by ID with their items; both queries run at once."""
+    with tracer.start_as_current_span("get_user") as span:
+        span.set_attribute("user.id", user_id)
+
+        DB_QUERY_COUNT.labels(operation="select").inc(2)
+        users, items = await asyncio.gather(
+            fetch("SELECT id, username, email, created_at FROM users WHERE id = %s", (user_id,)),
+            fetch("SELECT id, name, description, price FROM items WHERE user_id = %s", (user_id,)),
+        )
+        if not users:
+            return jsonify({"error": "User not found"}), 404
+
+        span.set_attribute("user.items_count", len(items))
+
+        return jsonify({
+            "user": user_json(users[0]),
+            "items": [dict(item, price=str(item["price"])) for item in items]
+        })
+
+
+@quart_app.route("/items")
+@conditional
+async def list_items():
+    after, limit = page_params()
+    if wants_stream():
+        return stream_rows("items", ITEMS_SQL, {"after": after, "limit": None}, item_json)
+    return jsonify(await items_page(after, limit))
+
+
+@cached(ttl=30, prefix="items", stale_ttl=30, early_refresh=0.1)
+async def items_page(after, limit):
+    with tracer.start_as_current_span("list_items_db") as span:
+        DB_QUERY_COUNT.labels(operation="select").inc()
+        items = await fetch(ITEMS_SQL, {"after": after, "limit": limit})
+        span.set_attribute("items.count", len(items))
+        return page_response("items", [item_json(item) for item in items], limit)
+
+
+@quart_app.route("/items/<int:item_id>")
+async def get_item(item_id):
+    """Get item by ID with view counter (item cached in Redis)."""
+    cache_suffix = f"item:{item_id}"
+    views_key = f"item_views:{item_id}"
+
+    with tracer.start_as_current_span("get_item") as span:
+        span.set_attribute("item.id", item_id)
+
+        item = catalog.get(item_id) if CATALOG_INDEX_ENABLED else None
+        span.set_attribute("catalog.hit", item is not None)
+
+        cached_item = total_views = generation = None
+        need_cache, need_views = item is None, not view_counter.known(item_id)
+        if need_cache or need_views:
+            with tracer.start_as_current_span("cache_lookup"):
+                try:
+                    if need_cache:
+                        generation, cached_item, *views = await cache_get_script(
+                            keys=[_generation_key("items"), *([views_key] if need_views else [])],
+                            args=["items", cache_suffix],
+                        )
+                        generation = int(generation)
+                        CACHE_OPS.labels(tier="redis", operation="get", result="hit" if cached_item else "miss").inc()
+                    else:
+                        views = [await redis_client.get(views_key)]
+                    if need_views:
+                        total_views = int(views[0] or 0)
+                except redis.RedisError:
+                    CACHE_OPS.labels(tier="redis", operation="get", result="error").inc()
+
+        if item is None and cached_item:
+            item = cache_codec.loads(cached_item)
+        elif item is None:
+            DB_QUERY_COUNT.labels(operation="select").inc()
+            rows = await fetch("""
+                SELECT i.id, i.name, i.description, i.price, u.username as seller
+                FROM items i
+                JOIN users u ON i.user_id = u.id
+                WHERE i.id = %s
+            """, (item_id,))
+            if not rows:
+                return jsonify({"error": "Item not found"}), 404
+
+            item = item_json(rows[0])
+            if generation is not None:
+                try:
+                    await redis_client.setex(
+                        f"items:g{generation}:{cache_suffix}", ITEM_CACHE_TTL, cache_codec.dumps(item)
+                    )
+                    CACHE_OPS.labels(tier="redis", operation="set", result="success").inc()
+                except redis.RedisError:
+                    CACHE_OPS.labels(tier="redis", operation="set", result="error").inc()
+
+        views = view_counter.incr(item_id, total_views)
+        span.set_attribute("item.views", views)
+        span.set_attribute("cache.hit", bool(cached_item))
+
+        return jsonify({"item": dict(item, views=views)})
+
+
+@quart_app.route("/orders", methods=["GET", "POST"])
+async def orders():
+    if request.method == "GET":
+        return await list_orders()
+    return await create_order()
+
+
+@conditional
+async def list_orders():
+    after, limit = page_params(default_limit=50)
+    if wants_stream():
+        return stream_rows("orders", ORDERS_SQL, {"after": after, "limit": None}, order_json)
+
+    with tracer.start_as_current_span("list_orders") as span:
+        DB_QUERY_COUNT.labels(operation="select").inc()
+        orders = await fetch(ORDERS_SQL, {"after": after, "limit": limit})
+        span.set_attribute("orders.count", len(orders))
+        return jsonify(page_response("orders", [order_json(order) for order in orders], limit))
+
+
+async def create_order():
+    with tracer.start_as_current_span("create_order") as span:
+        data = await request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Order must be a JSON object"}), 400
+        user_id = data.get("user_id", random.randint(1, 3))
+        if "item_ids" not in data and "items" not in data:
+            data["item_ids"] = [random.randint(1, 5) for _ in range(random.randint(1, 3))]
+        try:
+            item_ids, quantities = order_lines(data)
+        except InvalidQuantity:
+            return jsonify({"error": f"Quantities must be between 1 and {ORDER_MAX_QUANTITY}"}), 400
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "Invalid order items"}), 400
+
+        span.set_attribute("order.user_id", user_id)
+        span.set_attribute("order.items_count", len(item_ids))
+        span.set_attribute("order.quantity", sum(quantities))
+
+        prices = catalog.prices(item_ids) if CATALOG_INDEX_ENABLED else None
+        span.set_attribute("order.priced_by", "catalog" if prices is not None else "db")
+
+        try:
+            with tracer.start_as_current_span("insert_order"):
+                DB_QUERY_COUNT.labels(operation="insert").inc()
+                params = {"user_id": user_id, "item_ids": item_ids, "quantities": quantities}
+                if prices is not None:
+                    params["total"] = sum(price * quantity for price, quantity in zip(prices, quantities))
+                rows = await fetch(
+                    CREATE_PRICED_ORDER_SQL if prices is not None else CREATE_ORDER_SQL, params, read=False
+                )
+                order_id = rows[0]["id"]
+                total = float(rows[0]["total"]) if rows[0]["total"] else 0
+        except psycopg.IntegrityError:
+            return jsonify({"error": "Unknown user or item"}), 400
+        except psycopg.DataError:
+            return jsonify({"error": "Invalid order"}), 400
+        except Exception as e:
+            logger.error(f"Order creation failed: {e}")
+            span.set_attribute("error", str(e))
+            return jsonify({"error": str(e)}), 500
+
+        mark_write()
+        span.set_attribute("order.id", order_id)
+        span.set_attribute("order.total", total)
+        span.set_attribute("order.db_statements", 1)
+
+        with tracer.start_as_current_span("invalidate_cache") as cache_span:
+            try:
+                cache_span.set_attribute("cache.generation", await invalidate_cache("items"))
+                CACHE_OPS.labels(tier="redis", operation="invalidate", result="success").inc()
+            except redis.RedisError:
+                CACHE_OPS.labels(tier="redis", operation="invalidate", result="error").inc()
+
+        log_event("order_created", "Created order", order_id=order_id, total=total)
+
+        return jsonify({
+            "order": {
+                "id": order_id,
+                "user_id": user_id,
+                "total": total,
+                "status": "pending",
+                "items": item_ids,
+                "quantities": quantities
+            }
+        }), 201
+
+
+async def stats_query(span_name, sql, params):
+    with tracer.start_as_current_span(span_name) as span:
+        DB_QUERY_COUNT.labels(operation="select").inc()
+        rows = await fetch(sql, params)
+        span.set_attribute("stats.rows", len(rows))
+        return rows
+
+
+@quart_app.route("/stats")
+async def stats():
+    rows = await stats_query(
+        "stats_totals",
+        "SELECT COALESCE(SUM(orders), 0)::bigint AS orders, COALESCE(SUM(revenue), 0) AS revenue FROM order_stats_by_hour",
+        None,
+    )
+    return jsonify(stats_json(rows[0]))
+
+
+@quart_app.route("/stats/<any(users, items):kind>")
+async def stats_top(kind):
+    sort = request.args.get("sort", "revenue")
+    if sort not in STATS_SORTS[kind]:
+        return jsonify({"error": f"sort must be one of {', '.join(STATS_SORTS[kind])}"}), 400
+    limit = max(1, min(request.args.get("limit", default=10, type=int), PAGE_MAX_LIMIT))
+    rows = await stats_query(f"stats_top_{kind}", STATS_TOP_SQL[kind].format(sort=sort), {"limit": limit})
+    return jsonify({"sort": sort, kind: [stats_json(row) for row in rows]})
+
+
+@quart_app.route("/stats/timeline")
+async def stats_timeline():
+    bucket = request.args.get("bucket", "hour")
+    if bucket not in STATS_TIMELINE_SPANS:
+        return jsonify({"error": "bucket must be hour or day"}), 400
+    try:
+        until = datetime.fromisoformat(request.args["until"]) if "until" in request.args else datetime.now(timezone.utc)
+        since = (datetime.fromisoformat(request.args["since"]) if "since" in request.args
+                 else until - STATS_TIMELINE_SPANS[bucket])
+    except ValueError:
+        return jsonify({"error": "since/until must be ISO 8601 timestamps"}), 400
+    rows = await stats_query("stats_timeline", STATS_TIMELINE_SQL, {"bucket": bucket, "since": since, "until": until})
+    return jsonify({
+        "bucket": bucket,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "points": [dict(stats_json(row), bucket=row["bucket"].isoformat()) for row in rows],
+    })
+
+
+@quart_app.route("/slow")
+async def slow_endpoint():
+    """Simulated slow endpoint; its waits don't hold a thread here."""
+    with tracer.start_as_current_span("slow_operation") as span:
+        delay = random.uniform(0.3, 0.8)
+        span.set_attribute("delay.seconds", delay)
+
+        with tracer.start_as_current_span("slow_cache_check"):
+            try:
+                await redis_client.get("slow:check")
+                await asyncio.sleep(delay * 0.3)
+            except redis.RedisError:
+                pass
+
+        with tracer.start_as_current_span("slow_db_query"):
+            DB_QUERY_COUNT.labels(operation="select").inc()
+            await fetch("SELECT pg_sleep(%s), COUNT(*) FROM items", (delay * 0.3,))
+
+        await asyncio.sleep(delay * 0.4)
+
+        return jsonify({
+            "message": "Slow operation completed",
+            "delay_ms": int(delay * 1000)
+        })
+
+
+@quart_app.route("/error")
+async def error_endpoint():
+    with tracer.start_as_current_span("error_operation") as span:
+        error_type = random.choice(["database", "cache", "validation", "internal"])
+        span.set_attribute("error.type", error_type)
+
+        if error_type == "database":
+            try:
+                await fetch("SELECT * FROM nonexistent_table", read=False)
+            except Exception as e:
+                span.record_exception(e)
+                return jsonify({"error": "Database error", "details": str(e)}), 500
+
+        elif error_type == "cache":
+            return jsonify({"error": "Cache connection failed"}), 503
+
+        elif error_type == "validation":
+            return jsonify({"error": "Validation failed", "field": "user_id"}), 400
+
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@quart_app.route("/metrics")
+async def metrics():
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        registry.register(ExemplarCollector(multiprocess.MultiProcessCollector(None), PROMETHEUS_MULTIPROC_DIR))
+    encoder, content_type = choose_encoder(request.headers.get("Accept"))
+    return encoder(registry), 200, {"Content-Type": content_type}
+
+
+@quart_app.errorhandler(404)
+async def not_found(e):
+    return jsonify({"error": "Not found"}), 404
+
+
+@quart_app.errorhandler(500)
+async def internal_error(e):
+    return jsonify({"error": "Internal server error"}), 500
+
+
+# Lifecycle
+@quart_app.before_serving
+async def startup():
+    logger.info(f"Starting {SERVICE_NAME} (asyncio)")
+    for pool in all_pools:
+        await pool.open()
+    await health_checker.start()
+    profile_window.start()
+    if CATALOG_INDEX_ENABLED:
+        await asyncio.to_thread(catalog.start)
+
+
+@quart_app.after_serving
+async def shutdown():
+    await health_checker.stop()
+    await asyncio.to_thread(view_counter.close)
+    for pool in all_pools:
+        await pool.close()
+    await redis_client.aclose()
+
+
+# Routes served by the Flask app in a worker thread (admission control applies)
+WSGI_ROUTES = {"/orders/bulk", "/admin/profile"}
+
+wsgi_fallback = WsgiToAsgi(sync_app.app)
+traced_app = OpenTelemetryMiddleware(
+    quart_app,
+    # Probes are polled constantly and say nothing about request handling
+    excluded_urls="/health,/livez,/readyz",
+    exclude_spans=["receive", "send"],
+)
+
+
+async def application(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "http" and scope["path"] in WSGI_ROUTES:
+        return await wsgi_fallback(scope, receive, send)
+    return await traced_app(scope, receive, send)
@@ -0,0 +1,125 @@
+"""
+Admission control under a /slow flood
+
+Starts the app under gunicorn (one worker) with admission control on and
+off, floods /slow from many concurrent clients and meanwhile measures the
+latency of a steady stream of fast requests. Without admission control
+/slow requests take every worker thread and the fast requests queue behind
+them; with it /slow is capped and its excess is shed with 503s.
+
+Usage:
+    python benchmarks/admission.py --slow-clients 16 --duration 15
+
+Needs the demo app's Postgres and Redis (POSTGRES_HOST / REDIS_HOST) and
+gunicorn on PATH.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def request(url, timeout=30):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = "error"
+    return status, time.perf_counter() - start
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+def start_server(port, threads, env):
+    metrics_dir = tempfile.mkdtemp(prefix="admission-bench-")
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKERS="1", GUNICORN_THREADS=str(threads),
+               PROMETHEUS_MULTIPROC_DIR=metrics_dir, PYROSCOPE_ENABLED="false", OTEL_SDK_DISABLED="true",
+               LOG_LEVEL="WARNING", **env)
+    server = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "app:app"], cwd=APP_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if request(f"http://127.0.0.1:{port}/livez", timeout=1)[0] == 200:
+            return server, metrics_dir
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not come up")
+
+
+def run(name, env, args):
+    server, metrics_dir = start_server(args.port, args.threads, env)
+    base = f"http://127.0.0.1:{args.port}"
+    stop = threading.Event()
+    slow_statuses = Counter()
+
+    def flood():
+        while not stop.is_set():
+            status, _ = request(f"{base}/slow")
+            slow_statuses[status] += 1
+            if status == 503:
+                time.sleep(0.05)
+
+    flooders = [threading.Thread(target=flood, daemon=True) for _ in range(args.slow_clients)]
+    for thread in flooders:
+        thread.start()
+    time.sleep(1)
+
+    fast, fast_statuses = [], Counter()
+    end = time.monotonic() + args.duration
+    while time.monotonic() < end:
+        status, elapsed = request(f"{base}{args.fast_path}")
+        fast_statuses[status] += 1
+        if status == 200:
+            fast.append(elapsed)
+        time.sleep(1 / args.fast_rate)
+
+    stop.set()
+    for thread in flooders:
+        thread.join(35)
+    server.terminate()
+    server.wait(30)
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    print(f"{name:<10}  {percentile(fast, 0.5) * 1000:>8.1f}  {percentile(fast, 0.99) * 1000:>8.1f}  "
+          f"{fast_statuses[200]:>7}  {fast_statuses[503]:>8}  {slow_statuses[200]:>7}  {slow_statuses[503]:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--slow-clients", type=int, default=16)
+    parser.add_argument("--fast-path", default="/items/1")
+    parser.add_argument("--fast-rate", type=float, default=20, help="fast requests per second")
+    parser.add_argument("--duration", type=float, default=15)
+    args = parser.parse_args()
+
+    if shutil.which("gunicorn") is None:
+        sys.exit("gunicorn not found on PATH")
+
+    print(f"{'admission':<10}  {'fast p50':>8}  {'fast p99':>8}  {'fast ok':>7}  {'fast 503':>8}  "
+          f"{'slow ok':>7}  {'slow 503':>8}")
+    run("off", {"ADMISSION_ENABLED": "false"}, args)
+    run("on", {"ADMISSION_ENABLED": "true"}, args)
+    run("adaptive", {"ADMISSION_ENABLED": "true", "ADMISSION_ADAPTIVE": "true"}, args)
+
+
+if __name__ == "__main__":
+    main()
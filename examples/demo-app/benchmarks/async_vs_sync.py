@@ -0,0 +1,169 @@
+"""
+Sync (gunicorn gthread) vs asyncio (uvicorn) serving at high concurrency
+
+Starts the demo app in each serving mode with the same number of processes
+and database pool size, holds ``--connections`` keep-alive connections
+open against one path at a time, each sending its next request as soon as
+the previous one completes, and reports throughput and latency. The sync
+mode serves at most workers x threads requests at once and the rest wait
+in its accept queue; the async mode is bounded by its connection pools.
+
+Admission control is off in both modes (it would shed most of the /slow
+load in sync mode); pass --admission to keep the app's defaults.
+
+Usage:
+    python benchmarks/async_vs_sync.py --connections 1000 --duration 15 --paths /slow,/items/1
+
+Needs the demo app's Postgres and Redis (POSTGRES_HOST / REDIS_HOST), and
+gunicorn and uvicorn on PATH.
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+def server_command(mode, port, workers, threads):
+    if mode == "sync":
+        return ["gunicorn", "-c", "gunicorn.conf.py", "app:app"], {
+            "GUNICORN_WORKERS": str(workers), "GUNICORN_THREADS": str(threads),
+            "GUNICORN_MAX_REQUESTS": "0", "GUNICORN_BACKLOG": "4096",
+        }
+    return ["uvicorn", "asgi_app:application", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--backlog", "4096", "--log-level", "warning", "--no-access-log"], {}
+
+
+def start_server(mode, args):
+    command, extra_env = server_command(mode, args.port, args.workers, args.threads)
+    metrics_dir = tempfile.mkdtemp(prefix="async-bench-")
+    env = dict(os.environ, PORT=str(args.port), PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+               PYROSCOPE_ENABLED="false", OTEL_SDK_DISABLED="true", LOG_LEVEL="WARNING",
+               POSTGRES_POOL_MAX=str(args.pool_max), **extra_env)
+    if not args.admission:
+        env["ADMISSION_ENABLED"] = "false"
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{args.port}/readyz", timeout=1) as response:
+                if response.status == 200:
+                    return server, metrics_dir
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not come up")
+
+
+async def client(port, path, stop_at, latencies, statuses, timeout):
+    """One keep-alive connection sending requests back to back until ``stop_at``."""
+    request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode()
+    reader = writer = None
+    while time.monotonic() < stop_at:
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            writer.write(request)
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+            lines = head.decode("latin-1").split("\r\n")
+            headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+            headers = {name.lower(): value for name, value in headers.items()}
+            if "content-length" in headers:
+                await asyncio.wait_for(reader.readexactly(int(headers["content-length"])), timeout)
+            else:
+                while True:     # chunked
+                    size = int((await asyncio.wait_for(reader.readline(), timeout)).split(b";")[0], 16)
+                    await asyncio.wait_for(reader.readexactly(size + 2), timeout)
+                    if size == 0:
+                        break
+            status = int(lines[0].split()[1])
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+                writer = None
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            status = "error"
+            if writer is not None:
+                writer.close()
+                writer = None
+            await asyncio.sleep(0.1)
+        statuses[status] += 1
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+    if writer is not None:
+        writer.close()
+
+
+async def load(port, path, connections, duration, timeout):
+    latencies, statuses = [], Counter()
+    stop_at = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, path, stop_at, latencies, statuses, timeout) for _ in range(connections)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def run(mode, path, args):
+    # A fresh server per path: the sync one is still working through the
+    # previous path's backlog long after its clients have gone
+    server, metrics_dir = start_server(mode, args)
+    try:
+        latencies, statuses, elapsed = asyncio.run(
+            load(args.port, path, args.connections, args.duration, args.timeout)
+        )
+    finally:
+        server.terminate()
+        server.wait(30)
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+    other = " ".join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str)
+                     if status not in (200, "error"))
+    print(f"{mode:<6}  {path:<12}  {args.connections:>5}  {statuses[200] / elapsed:>8.1f}  "
+          f"{percentile(latencies, 0.5) * 1000:>8.1f}  {percentile(latencies, 0.99) * 1000:>8.1f}  "
+          f"{statuses['error']:>7}  {other or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--paths", default="/slow,/items/1")
+    parser.add_argument("--workers", type=int, default=1, help="server processes in both modes")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker (sync mode)")
+    parser.add_argument("--pool-max", type=int, default=10, help="POSTGRES_POOL_MAX per process")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request client timeout")
+    parser.add_argument("--admission", action="store_true", help="keep admission control on in sync mode")
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    for tool in ("gunicorn", "uvicorn"):
+        if shutil.which(tool) is None:
+            sys.exit(f"{tool} not found on PATH")
+    # Each connection is a file descriptor here and one in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < args.connections + 256:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.connections + 256), hard))
+
+    print(f"{'mode':<6}  {'path':<12}  {'conns':>5}  {'ok/s':>8}  {'p50 ms':>8}  {'p99 ms':>8}  "
+          f"{'errors':>7}  other statuses")
+    for path in args.paths.split(","):
+        for mode in args.modes.split(","):
+            run(mode, path, args)
+
+
+if __name__ == "__main__":
+    main()
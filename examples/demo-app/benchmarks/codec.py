@@ -0,0 +1,107 @@
+"""
+Cache codec microbenchmark
+
+Measures encode/decode time, encoded size and Redis memory per key for each
+CacheCodec format/compression combination, using synthetic `/items`
+payloads of increasing size, plus the cost of cache key derivation.
+
+Usage:
+    python benchmarks/codec.py --items 5,100,1000
+
+Keys are written to --db (default 15) under `codec-bench:` and deleted
+afterwards. Without a reachable Redis the memory column is skipped.
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+os.environ.setdefault("PYROSCOPE_ENABLED", "false")
+os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import redis  # noqa: E402
+
+from app import CacheCodec, cache_key_digest  # noqa: E402
+
+FORMATS = ("json", "msgpack")
+COMPRESSIONS = ("none", "zlib", "zstd")
+
+
+def items_payload(count):
+    """Envelope shaped like the cached /items response."""
+    rng = random.Random(count)
+    items = [{
+        "id": i,
+        "name": f"Item {i}",
+        "description": rng.choice(["A useful widget", "A fancy gadget", "Nobody knows what it does"]),
+        "price": round(rng.uniform(1, 100), 2),
+        "seller": rng.choice(["alice", "bob", "charlie"]),
+    } for i in range(1, count + 1)]
+    return {"v": {"items": items, "count": count}, "exp": 1700000000.0}
+
+
+def per_call_us(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def redis_memory(r, key, value):
+    if r is None:
+        return None
+    r.set(key, value)
+    return r.memory_usage(key, samples=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("REDIS_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("REDIS_PORT", "6379")))
+    parser.add_argument("--db", type=int, default=15)
+    parser.add_argument("--items", default="5,100,1000", help="comma-separated payload sizes")
+    parser.add_argument("--min-bytes", type=int, default=1024, help="compression threshold")
+    args = parser.parse_args()
+
+    r = redis.Redis(host=args.host, port=args.port, db=args.db)
+    try:
+        r.ping()
+    except redis.RedisError as e:
+        print(f"Redis unavailable ({e}); skipping memory measurements")
+        r = None
+
+    print("Key derivation (per call):")
+    call_args, call_kwargs = (42, "items"), {"limit": 50, "after": 1000}
+    print(f"  hash(str(...))      {per_call_us(lambda: hash(str(call_args) + str(call_kwargs)), 20000):8.2f} us")
+    print(f"  cache_key_digest    {per_call_us(lambda: cache_key_digest(*call_args, **call_kwargs), 20000):8.2f} us")
+    print()
+
+    print(f"{'items':>6}  {'codec':<14}  {'bytes':>8}  {'redis B':>8}  {'encode us':>10}  {'decode us':>10}")
+    keys = []
+    try:
+        for count in (int(n) for n in args.items.split(",")):
+            payload = items_payload(count)
+            number = max(10, 20000 // count)
+            for fmt in FORMATS:
+                for compression in COMPRESSIONS:
+                    codec = CacheCodec(fmt, compression, args.min_bytes)
+                    name = f"{fmt}+{compression}"
+                    if codec.format != CacheCodec._NAMES[fmt] or codec.compression != CacheCodec._NAMES[compression]:
+                        print(f"{count:>6}  {name:<14}  (unavailable)")
+                        continue
+                    encoded = codec.dumps(payload)
+                    assert codec.loads(encoded) == payload
+                    key = f"codec-bench:{count}:{name}"
+                    keys.append(key)
+                    memory = redis_memory(r, key, encoded)
+                    encode_us = per_call_us(lambda: codec.dumps(payload), number)
+                    decode_us = per_call_us(lambda: codec.loads(encoded), number)
+                    print(f"{count:>6}  {name:<14}  {len(encoded):>8}  {memory if memory is not None else '-':>8}  "
+                          f"{encode_us:>10.1f}  {decode_us:>10.1f}")
+    finally:
+        if r is not None and keys:
+            r.delete(*keys)
+
+
+if __name__ == "__main__":
+    main()
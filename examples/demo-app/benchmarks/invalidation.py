@@ -0,0 +1,100 @@
+"""
+Cache invalidation benchmark: KEYS + DEL vs. generation bump
+
+Fills a Redis database with an increasing number of unrelated keys plus a
+handful of cached `items:` entries, then times both invalidation schemes:
+
+  keys  - the old `KEYS items:*` + `DEL` scan (O(keyspace), blocks Redis)
+  gen   - `INCR cache_gen:items` as done by invalidate_cache() (O(1))
+
+Usage:
+    python benchmarks/invalidation.py --sizes 10000,100000,1000000
+
+WARNING: the target database (--db, default 15) is flushed before and after
+the run. Never point this at a database holding data you care about.
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import redis
+
+BATCH = 10_000
+CACHED_ENTRIES = 50
+
+
+def populate(r, target, current):
+    """Grow the keyspace from `current` to `target` filler keys."""
+    pipe = r.pipeline(transaction=False)
+    for i in range(current, target):
+        pipe.set(f"filler:{i}", "x")
+        if (i + 1) % BATCH == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def seed_items(r, generation):
+    pipe = r.pipeline(transaction=False)
+    for i in range(CACHED_ENTRIES):
+        pipe.set(f"items:g{generation}:list_items:{i}", "{}", ex=60)
+    pipe.execute()
+
+
+def time_keys_scan(r, rounds):
+    samples = []
+    for _ in range(rounds):
+        seed_items(r, 0)
+        start = time.perf_counter()
+        keys = r.keys("items:*")
+        if keys:
+            r.delete(*keys)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def time_generation_bump(r, rounds):
+    samples = []
+    for _ in range(rounds):
+        generation = int(r.get("cache_gen:items") or 0)
+        seed_items(r, generation)
+        start = time.perf_counter()
+        r.incr("cache_gen:items")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return statistics.median(samples) * 1000, p99 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("REDIS_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("REDIS_PORT", "6379")))
+    parser.add_argument("--db", type=int, default=15)
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma-separated keyspace sizes to test")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    r = redis.Redis(host=args.host, port=args.port, db=args.db)
+    r.flushdb()
+    current = 0
+    print(f"{'keyspace':>10}  {'keys p50 ms':>12}  {'keys p99 ms':>12}  {'gen p50 ms':>11}  {'gen p99 ms':>11}")
+    try:
+        for size in sorted(int(s) for s in args.sizes.split(",")):
+            populate(r, size, current)
+            current = size
+            keys_p50, keys_p99 = summarize(time_keys_scan(r, args.rounds))
+            gen_p50, gen_p99 = summarize(time_generation_bump(r, args.rounds))
+            print(f"{r.dbsize():>10}  {keys_p50:>12.3f}  {keys_p99:>12.3f}  {gen_p50:>11.3f}  {gen_p99:>11.3f}")
+    finally:
+        r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+In-process microbenchmarks: hot paths and instrumentation overhead
+
+Runs the app in-process against an in-memory Redis (fakeredis) and reports
+CPU time and peak allocation per operation for:
+
+- hot paths, with all instrumentation off: the ``cached`` decorator on a
+  local-tier hit, a Redis-tier hit and a miss (lookup, load and store),
+  and row-to-JSON conversion of a list endpoint page (rows as the
+  cursor returns them, through ``*_json``, ``page_response`` and
+  ``jsonify``);
+- requests through the Flask test client with each instrumentation layer
+  switched on alone (OTel Flask, psycopg2 and redis instrumentors,
+  manual spans, Prometheus metrics, Pyroscope), all of them, and none.
+  Spans are OTLP-encoded but not sent, and Pyroscope samples but its
+  uploads go nowhere.
+
+The hot paths and each configuration run in their own subprocess, because
+the tracer provider and Prometheus metrics are set up once per process.
+CPU time covers all threads (span export, the profiler). Peak allocation
+is measured in a separate, shorter tracemalloc pass. Redis-tier timings
+include fakeredis running the cache's Lua script, which is slower than a
+round trip to a real Redis, so compare them with each other rather than
+with production latencies.
+
+Results are compared against a stored baseline, and the run fails if an
+operation got more than --threshold slower or allocates that much more.
+Baselines are machine-specific: save one (--save-baseline) on the machine
+you compare on.
+
+Usage:
+    python benchmarks/microbench.py --save-baseline
+    python benchmarks/microbench.py --threshold 0.15
+
+Needs fakeredis with Lua support (pip install "fakeredis[lua]"). The
+request cases that query Postgres (POSTGRES_HOST) are skipped when it is
+unreachable.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "microbench.json")
+
+LAYERS = ("flask", "psycopg2", "redis", "spans", "prometheus", "pyroscope")
+OTEL_LAYERS = ("flask", "psycopg2", "redis", "spans")
+CONFIGS = {"none": (), **{layer: (layer,) for layer in LAYERS}, "all": LAYERS}
+
+# name -> (path, needs Postgres)
+REQUESTS = {
+    "GET /": ("/", False),
+    "GET /items (cached)": ("/items", False),
+    "GET /items/1": ("/items/1", False),
+    "GET /users": ("/users", True),
+    "GET /orders": ("/orders", True),
+}
+
+
+def measure(fn, number, repeat=3, flush=None):
+    """Lowest CPU and wall time per call over ``repeat`` rounds, in microseconds."""
+    best_cpu = best_wall = float("inf")
+    for _ in range(repeat):
+        cpu, wall = time.process_time(), time.perf_counter()
+        for _ in range(number):
+            fn()
+        if flush:
+            flush()
+        best_cpu = min(best_cpu, time.process_time() - cpu)
+        best_wall = min(best_wall, time.perf_counter() - wall)
+    return best_cpu / number * 1e6, best_wall / number * 1e6
+
+
+def peak_allocation(fn, number):
+    """Mean peak of memory allocated during one call, in bytes."""
+    tracemalloc.start()
+    total = 0
+    try:
+        for _ in range(number):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / number
+
+
+def disable_prometheus():
+    """Turn metric updates into no-ops (must run before the app is imported)."""
+    from prometheus_client import metrics
+
+    def noop(self, *args, **kwargs):
+        pass
+
+    metrics.MetricWrapperBase.labels = lambda self, *args, **kwargs: self
+    metrics.Counter.inc = noop
+    metrics.Gauge.inc = metrics.Gauge.dec = metrics.Gauge.set = noop
+    metrics.Histogram.observe = noop
+
+
+def synthetic_rows(count):
+    """Rows shaped like RealDictCursor results for the list endpoints."""
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    return {
+        "users": [{"id": i, "username": f"user{i}", "email": f"user{i}@example.com",
+                   "created_at": now - timedelta(minutes=i)} for i in range(1, count + 1)],
+        "items": [{"id": i, "name": f"Item {i}", "description": "A useful widget",
+                   "price": Decimal(f"{i % 100}.99"), "seller": f"user{i % 7}"} for i in range(1, count + 1)],
+        "orders": [{"id": i, "total": Decimal(f"{i % 500}.50"), "status": "pending", "username": f"user{i % 7}",
+                    "created_at": now - timedelta(minutes=i)} for i in range(1, count + 1)],
+    }
+
+
+def run_worker(args):
+    """Measure one configuration in this process and print the result as JSON."""
+    layers = set(args.layers.split(",")) - {""}
+    if "prometheus" not in layers:
+        disable_prometheus()
+    sys.path.insert(0, APP_DIR)
+    import logging
+
+    import fakeredis
+    from opentelemetry import trace
+    from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+    from opentelemetry.instrumentation.flask import FlaskInstrumentor
+    from opentelemetry.instrumentation.psycopg2 import Psycopg2Instrumentor
+    from opentelemetry.instrumentation.redis import RedisInstrumentor
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    import app
+
+    logging.disable(logging.WARNING)
+
+    class EncodeOnlyExporter(SpanExporter):
+        def export(self, spans):
+            encode_spans(spans).SerializeToString()
+            return SpanExportResult.SUCCESS
+
+    # The app instruments everything at import; take off what is not measured
+    if "flask" not in layers:
+        FlaskInstrumentor().uninstrument_app(app.app)
+    if "psycopg2" not in layers:
+        Psycopg2Instrumentor().uninstrument()
+    if "redis" not in layers:
+        RedisInstrumentor().uninstrument()
+    if "spans" not in layers:
+        app.tracer = trace.NoOpTracer()
+    if "prometheus" not in layers:
+        app.exemplar_store = None
+    app.init_telemetry(EncodeOnlyExporter())
+    provider = trace.get_tracer_provider()
+    flush = getattr(provider, "force_flush", None)
+
+    app.redis_client = fakeredis.FakeRedis()
+    app._cache_get_script = app.redis_client.register_script(app._cache_get_script.script)
+
+    try:
+        with app.db_connection() as conn:
+            conn.cursor().execute("SELECT 1")
+        has_db = True
+    except Exception:
+        has_db = False
+
+    cases = {}
+    client = app.app.test_client()
+    skipped = []
+    if args.hot:
+        rows = synthetic_rows(args.rows)
+        page = app.page_response("items", [app.item_json(row) for row in rows["items"]], args.rows)
+
+        @app.cached(ttl=3600, prefix="bench")
+        def local_page(after, limit):
+            return page
+
+        @app.cached(ttl=3600, prefix="bench_redis", local_ttl=0)
+        def redis_page(after, limit):
+            return page
+
+        @app.cached(ttl=3600, prefix="bench_miss", local_ttl=0)
+        def miss_page(after, limit):
+            return page
+
+        misses = iter(range(10 ** 9))
+        cases["cached hit (local)"] = lambda: local_page(None, args.rows)
+        cases["cached hit (redis)"] = lambda: redis_page(None, args.rows)
+        cases["cached miss"] = lambda: miss_page(next(misses), args.rows)
+
+        def to_json(key, convert):
+            def run():
+                with app.app.app_context():
+                    app.jsonify(app.page_response(key, [convert(row) for row in rows[key]], args.rows))
+            return run
+
+        cases[f"{args.rows} users to JSON"] = to_json("users", app.user_json)
+        cases[f"{args.rows} items to JSON"] = to_json("items", app.item_json)
+        cases[f"{args.rows} orders to JSON"] = to_json("orders", app.order_json)
+
+    # The hot paths run on their own, so earlier requests do not skew them
+    for name, (path, needs_db) in ({} if args.hot else REQUESTS).items():
+        if needs_db and not has_db:
+            skipped.append(name)
+            continue
+
+        def request(path=path):
+            response = client.get(path)
+            response.close()
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {path} returned {response.status_code}")
+        cases[name] = request
+
+    results = {}
+    for name, fn in cases.items():
+        number = args.requests if name in REQUESTS else args.number
+        for _ in range(max(10, number // 10)):
+            fn()
+        cpu_us, wall_us = measure(fn, number, flush=flush)
+        results[name] = {
+            "cpu_us": round(cpu_us, 2),
+            "wall_us": round(wall_us, 2),
+            "peak_bytes": round(peak_allocation(fn, max(10, number // 10))),
+        }
+    app.view_counter.close()
+    print(json.dumps({"results": results, "skipped": skipped}))
+
+
+def run_config(name, args, hot=False):
+    with tempfile.TemporaryDirectory(prefix="microbench-") as metrics_dir:
+        layers = CONFIGS[name]
+        env = dict(
+            os.environ, TELEMETRY_POST_FORK="true", PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+            CATALOG_INDEX_ENABLED="false", LOG_LEVEL="WARNING",
+            PYROSCOPE_ENABLED="true" if "pyroscope" in layers else "false",
+            PYROSCOPE_SERVER_ADDRESS="http://127.0.0.1:9",
+        )
+        if not set(layers) & set(OTEL_LAYERS):
+            env["OTEL_SDK_DISABLED"] = "true"
+        command = [sys.executable, __file__, "--worker", "--layers", ",".join(layers),
+                   "--requests", str(args.requests), "--number", str(args.number), "--rows", str(args.rows)]
+        out = subprocess.run(command + (["--hot"] if hot else []), env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"{name}: {(out.stderr.strip().splitlines() or ['no output'])[-1]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(current, baseline, threshold, min_us):
+    """Regressions of ``current`` against ``baseline`` beyond ``threshold``."""
+    regressions = []
+    for key, result in current.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result["cpu_us"] > base["cpu_us"] * (1 + threshold) and result["cpu_us"] - base["cpu_us"] > min_us:
+            regressions.append(f"{key}: {base['cpu_us']:.1f} -> {result['cpu_us']:.1f} cpu us")
+        if result["peak_bytes"] > base["peak_bytes"] * (1 + threshold) + 256:
+            regressions.append(f"{key}: {base['peak_bytes']} -> {result['peak_bytes']} peak bytes")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="test client requests per round")
+    parser.add_argument("--number", type=int, default=20000, help="hot path calls per round")
+    parser.add_argument("--rows", type=int, default=50, help="rows per list page")
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="comma-separated layer configurations")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown, as a fraction")
+    parser.add_argument("--min-us", type=float, default=1.0, help="ignore CPU regressions smaller than this")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--layers", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--hot", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    current = {}
+    try:
+        hot = run_config("none", args, hot=True)["results"]
+    except RuntimeError as e:
+        sys.exit(f"failed: {e}")
+    print(f"{'hot path (no instrumentation)':<28}  {'cpu us':>9}  {'wall us':>9}  {'peak KiB':>9}")
+    for case, result in hot.items():
+        current[case] = result
+        print(f"{case:<28}  {result['cpu_us']:>9.2f}  {result['wall_us']:>9.2f}  {result['peak_bytes'] / 1024:>9.2f}")
+    print()
+
+    runs = {}
+    for name in args.configs.split(","):
+        try:
+            runs[name] = run_config(name, args)
+        except RuntimeError as e:
+            print(f"failed: {e}")
+
+    cases = [case for case in REQUESTS if any(case in run["results"] for run in runs.values())]
+    base = runs.get("none", {}).get("results", {})
+    print("CPU us per request (overhead over none) and peak KiB allocated")
+    print(f"{'layers':<11}" + "".join(f"  {case:>22}" for case in cases))
+    for name, run in runs.items():
+        cells = []
+        for case in cases:
+            result = run["results"].get(case)
+            if result is None:
+                cells.append(f"  {'-':>22}")
+                continue
+            current[f"{name}:{case}"] = result
+            overhead = f"({result['cpu_us'] - base[case]['cpu_us']:+.0f})" if case in base and name != "none" else ""
+            cells.append(f"  {result['cpu_us']:>8.0f} {overhead:>7} {result['peak_bytes'] / 1024:>5.0f}K")
+        print(f"{name:<11}" + "".join(cells))
+    skipped = sorted({case for run in runs.values() for case in run["skipped"]})
+    if skipped:
+        print(f"\nSkipped without Postgres: {', '.join(skipped)}")
+
+    machine = {"python": platform.python_version(), "platform": platform.platform(),
+               "cpus": os.cpu_count(), "rows": args.rows, "requests": args.requests, "number": args.number}
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine, "results": current}, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to store one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != machine:
+        print(f"\nWarning: baseline was recorded on {baseline.get('machine')}")
+    regressions = compare(current, baseline["results"], args.threshold, args.min_us)
+    if regressions:
+        print(f"\nRegressions over {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo regressions over {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+OTLP spool exercise against a stub collector that can be paused
+
+Starts a local OTLP/gRPC trace receiver and pushes spans at a steady rate
+through a BatchSpanProcessor, as the app does, while the receiver is
+paused for part of the run. A paused receiver answers UNAVAILABLE, like a
+restarting collector. Reports how many spans were generated, received and
+lost, for the spooling exporter and for the stock OTLPSpanExporter.
+
+Usage:
+    python benchmarks/otlp_spool.py --rate 500 --duration 20 --pause 5:12
+    python benchmarks/otlp_spool.py --serve --port 4317
+
+--serve runs only the stub receiver, for pointing a real app at it
+(OTEL_EXPORTER_OTLP_ENDPOINT=localhost:4317 OTLP_SPOOL_DIR=/tmp/spool);
+send SIGUSR1 to toggle the pause.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+
+os.environ.setdefault("PYROSCOPE_ENABLED", "false")
+os.environ["TELEMETRY_POST_FORK"] = "true"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import grpc  # noqa: E402
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter  # noqa: E402
+from opentelemetry.proto.collector.trace.v1 import trace_service_pb2, trace_service_pb2_grpc  # noqa: E402
+from opentelemetry.sdk.trace import TracerProvider  # noqa: E402
+from opentelemetry.sdk.trace.export import BatchSpanProcessor  # noqa: E402
+from prometheus_client import REGISTRY  # noqa: E402
+
+from app import SpoolingSpanExporter, open_spool  # noqa: E402
+
+
+class StubCollector(trace_service_pb2_grpc.TraceServiceServicer):
+    """Counts received spans; answers UNAVAILABLE while paused."""
+
+    def __init__(self):
+        self.paused = False
+        self.spans = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def Export(self, request, context):
+        if self.paused:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "collector paused")
+        count = sum(len(ss.spans) for rs in request.resource_spans for ss in rs.scope_spans)
+        with self._lock:
+            self.spans += count
+            self.batches += 1
+        return trace_service_pb2.ExportTraceServiceResponse()
+
+
+def start_stub(port=0):
+    stub = StubCollector()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    trace_service_pb2_grpc.add_TraceServiceServicer_to_server(stub, server)
+    port = server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+    return stub, server, port
+
+
+def serve(port):
+    stub, server, port = start_stub(port)
+
+    def toggle(signum, frame):
+        stub.paused = not stub.paused
+        print(f"{'paused' if stub.paused else 'resumed'} at {stub.spans} spans", flush=True)
+
+    signal.signal(signal.SIGUSR1, toggle)
+    print(f"Stub OTLP receiver on 127.0.0.1:{port} (pid {os.getpid()}, SIGUSR1 toggles pause)", flush=True)
+    try:
+        while True:
+            time.sleep(5)
+            print(f"received {stub.spans} spans in {stub.batches} batches", flush=True)
+    except KeyboardInterrupt:
+        server.stop(0)
+
+
+def run(mode, args):
+    stub, server, port = start_stub()
+    endpoint = f"127.0.0.1:{port}"
+    if mode == "spool":
+        spool_dir = tempfile.mkdtemp(prefix="otlp-spool-")
+        exporter = SpoolingSpanExporter(endpoint, open_spool(spool_dir, args.spool_bytes), timeout=args.timeout)
+    else:
+        exporter = OTLPSpanExporter(endpoint=endpoint, insecure=True, timeout=args.timeout)
+    provider = TracerProvider()
+    provider.add_span_processor(BatchSpanProcessor(exporter, schedule_delay_millis=500))
+    tracer = provider.get_tracer(__name__)
+
+    pause_start, pause_end = (float(t) for t in args.pause.split(":"))
+    generated, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < args.duration:
+        stub.paused = pause_start <= elapsed < pause_end
+        due = int(elapsed * args.rate)
+        while generated < due:
+            with tracer.start_as_current_span("work") as span:
+                span.set_attribute("seq", generated)
+            generated += 1
+        time.sleep(0.005)
+    stub.paused = False
+
+    provider.force_flush()
+    deadline = time.monotonic() + args.drain
+    while stub.spans < generated and time.monotonic() < deadline:
+        time.sleep(0.2)
+    drained = time.perf_counter() - start - args.duration
+    provider.shutdown()
+    server.stop(0)
+    return generated, stub.spans, drained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help="only run the stub receiver")
+    parser.add_argument("--port", type=int, default=4317)
+    parser.add_argument("--rate", type=int, default=500, help="spans per second")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--pause", default="5:12", help="receiver pause window, start:end seconds")
+    parser.add_argument("--drain", type=float, default=60, help="max seconds to wait for replay")
+    parser.add_argument("--timeout", type=float, default=2)
+    parser.add_argument("--spool-bytes", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--modes", default="otlp,spool")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    print(f"{'exporter':<8}  {'generated':>9}  {'received':>9}  {'lost':>6}  {'drain s':>7}")
+    for mode in args.modes.split(","):
+        generated, received, drained = run(mode, args)
+        print(f"{mode:<8}  {generated:>9}  {received:>9}  {generated - received:>6}  {drained:>7.1f}")
+
+    sample = REGISTRY.get_sample_value
+    print()
+    print(f"spilled bytes:      {sample('app_otlp_spool_spilled_bytes_total') or 0:.0f}")
+    for reason in ("spool_full", "too_large", "rejected"):
+        print(f"dropped ({reason}): {sample('app_otlp_spans_dropped_total', {'reason': reason}) or 0:.0f}")
+    for path in ("direct", "replay"):
+        for result in ("success", "retryable"):
+            count = sample("app_otlp_export_seconds_count", {"path": path, "result": result})
+            if count:
+                total = sample("app_otlp_export_seconds_sum", {"path": path, "result": result})
+                print(f"{path}/{result}: {count:.0f} exports, mean {total / count * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
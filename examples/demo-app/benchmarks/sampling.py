@@ -0,0 +1,116 @@
+"""
+Trace sampling overhead benchmark
+
+Runs the same request mix through the Flask test client under each
+sampling setting and reports CPU time per request (all threads, including
+the batch exporter), spans exported and the overhead over tracing disabled.
+Spans are OTLP-encoded but not sent, so serialization cost is included
+without needing a collector.
+
+Each setting runs in its own subprocess, because the tracer provider can
+only be set once per process.
+
+Usage:
+    python benchmarks/sampling.py --requests 2000 --paths /items/1,/users/1
+
+The default paths need the demo app's Postgres and Redis (POSTGRES_HOST /
+REDIS_HOST); use --paths / to measure the bare Flask + tracing overhead.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SETTINGS = {
+    "off": {"OTEL_SDK_DISABLED": "true"},
+    "always_on": {"TRACE_SAMPLE_RATIO": "1.0"},
+    "ratio_0.1": {"TRACE_SAMPLE_RATIO": "0.1", "TRACE_KEEP_ERRORS": "false", "TRACE_SLOW_THRESHOLD": "0"},
+    "ratio_0.01": {"TRACE_SAMPLE_RATIO": "0.01", "TRACE_KEEP_ERRORS": "false", "TRACE_SLOW_THRESHOLD": "0"},
+    "ratio_0.01+keep": {"TRACE_SAMPLE_RATIO": "0.01", "TRACE_KEEP_ERRORS": "true", "TRACE_SLOW_THRESHOLD": "1.0"},
+    "rate_50/s": {"TRACE_SAMPLE_RATIO": "1.0", "TRACE_RATE_LIMIT": "50", "TRACE_KEEP_ERRORS": "false",
+                  "TRACE_SLOW_THRESHOLD": "0"},
+}
+
+
+def run_worker(args):
+    """Measure one setting in this process and print the result as JSON."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    import logging
+
+    from opentelemetry import trace
+    from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    import app
+
+    logging.disable(logging.WARNING)
+
+    class EncodeOnlyExporter(SpanExporter):
+        spans = 0
+
+        def export(self, spans):
+            encode_spans(spans).SerializeToString()
+            self.spans += len(spans)
+            return SpanExportResult.SUCCESS
+
+    exporter = EncodeOnlyExporter()
+    app.init_telemetry(exporter)
+    client = app.app.test_client()
+    paths = args.paths.split(",")
+
+    for i in range(max(50, args.requests // 10)):
+        client.get(paths[i % len(paths)])
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "force_flush"):
+        provider.force_flush()
+    exporter.spans = 0
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    for i in range(args.requests):
+        client.get(paths[i % len(paths)])
+    if hasattr(provider, "force_flush"):
+        provider.force_flush()
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+
+    print(json.dumps({
+        "cpu_us": cpu / args.requests * 1e6,
+        "wall_us": wall / args.requests * 1e6,
+        "spans": exporter.spans,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--paths", default="/items/1,/users/1", help="comma-separated request paths")
+    parser.add_argument("--settings", default=",".join(SETTINGS), help="comma-separated settings to run")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    print(f"{'setting':<16}  {'cpu us/req':>10}  {'wall us/req':>11}  {'spans':>7}  {'overhead':>9}")
+    baseline = None
+    for name in args.settings.split(","):
+        env = dict(os.environ, PYROSCOPE_ENABLED="false", TELEMETRY_POST_FORK="true", **SETTINGS[name])
+        out = subprocess.run(
+            [sys.executable, __file__, "--worker", "--requests", str(args.requests), "--paths", args.paths],
+            env=env, capture_output=True, text=True,
+        )
+        if out.returncode != 0:
+            print(f"{name:<16}  failed: {out.stderr.strip().splitlines()[-1:]}")
+            continue
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if name == "off":
+            baseline = result["cpu_us"]
+        overhead = f"{result['cpu_us'] - baseline:+8.1f}" if baseline is not None else "-"
+        print(f"{name:<16}  {result['cpu_us']:>10.1f}  {result['wall_us']:>11.1f}  {result['spans']:>7}  {overhead:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Gunicorn configuration for the OIB demo app (production serving mode)
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload) and forked into workers.
+Tracing and profiling start in each worker after fork, and Prometheus
+metrics are written per worker to PROMETHEUS_MULTIPROC_DIR and aggregated
+on /metrics. Send SIGHUP to the master for a graceful reload.
+"""
+
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+preload_app = True
+
+# Recycle workers periodically to bound memory growth; the jitter keeps
+# workers from all restarting at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "500"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Connections waiting to be accepted while every thread is busy
+backlog = int(os.getenv("GUNICORN_BACKLOG", "2048"))
+
+accesslog = None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Must be set before the app (and prometheus_client) is imported
+os.environ["TELEMETRY_POST_FORK"] = "true"
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-multiproc")
+
+# Start from an empty metrics directory, but only once per master: a SIGHUP
+# reload re-reads this file while the old workers are still running
+if not os.environ.get("_DEMO_APP_METRICS_DIR_READY"):
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    os.environ["_DEMO_APP_METRICS_DIR_READY"] = "1"
+
+
+def post_fork(server, worker):
+    import app
+
+    app.init_telemetry()
+    try:
+        app.db_pool.warm()
+    except Exception as e:
+        server.log.warning(f"Failed to warm database pool in worker {worker.pid}: {e}")
+    app.health_checker.start()
+    app.profile_window.start()
+    if app.CATALOG_INDEX_ENABLED:
+        app.catalog.start()
+
+
+def worker_exit(server, worker):
+    import app
+
+    # Drain buffered view counts before the worker goes away
+    app.view_counter.close()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+    try:
+        os.remove(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], f"exemplars_{worker.pid}.json"))
+    except FileNotFoundError:
+        pass
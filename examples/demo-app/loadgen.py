@@ -0,0 +1,737 @@
+"""
+Load generator and dataset seeder for the demo app
+
+    python loadgen.py seed --users 100000 --items 1000000 --orders 5000000
+    python loadgen.py run --url http://localhost:5000 --rate 50 --ramp-to 500 --duration 120 \\
+        --report report.json --push http://localhost:9090/api/v1/write
+
+``seed`` bulk-loads users, items and orders (with their order items) with
+COPY, in chunks of ``--chunk`` rows per transaction. Orders are spread over
+the last ``--days`` days, their items are skewed towards a popular head of
+the catalog, and totals are priced from the items' actual prices, so the
+rollup triggers and /stats stay consistent. It connects with the same
+POSTGRES_* variables as the app. Items added while the app runs reach its
+catalog index as change notifications, which it turns into a full reload
+per chunk. When done it bumps the app's cache generations in Redis
+(REDIS_HOST), so cached pages don't outlive the load.
+
+``run`` drives the endpoint mix (``--mix``) open loop: requests are sent at
+the target arrival rate (constant, or ramping linearly to ``--ramp-to``)
+whether or not earlier ones have completed, over at most ``--connections``
+keep-alive connections. Latency is measured from when each request was
+due to be sent, so time spent waiting behind a slow server or for a free
+connection is counted (no coordinated omission); service time, measured
+from when it was actually sent, is reported alongside. Latencies go into
+HDR-style log-linear histograms (3 significant digits) per endpoint. The
+summary is printed and written as JSON with ``--report``, and with
+``--push`` the k6 series the Request Latency dashboard charts (plus
+``loadgen_*`` percentiles per endpoint) are sent to Prometheus by remote
+write while the run progresses. Only the standard library is needed,
+except for psycopg2 to seed or to look up id ranges (and redis to
+invalidate the app's caches after seeding).
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import struct
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# ==================== Histograms ====================
+
+class LatencyHistogram:
+    """Log-linear histogram of non-negative integer values (microseconds).
+
+    Like HdrHistogram, values below ``2 * 10**digits`` are counted exactly
+    and larger ones in buckets whose width is at most 1/10**digits of their
+    value, so percentiles keep ``digits`` significant digits at any
+    magnitude with a small, sparse set of counters.
+    """
+
+    def __init__(self, digits=3):
+        self.sub_bits = math.ceil(math.log2(2 * 10 ** digits))
+        self.sub_count = 1 << self.sub_bits
+        self.half = self.sub_count >> 1
+        self.counts = Counter()
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def _index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half
+
+    def _value(self, index):
+        """Highest value counted in bucket ``index``."""
+        if index < self.sub_count:
+            return index
+        shift, offset = divmod(index - self.sub_count, self.half)
+        shift += 1
+        return ((offset + self.half + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(0, int(value))
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def summary(self, scale=1000):
+        """Percentiles in milliseconds (for values recorded in microseconds)."""
+        result = {f"p{p:g}": round(self.percentile(p) / scale, 3) for p in (50, 90, 99, 99.9)}
+        result["max"] = round(self.max / scale, 3)
+        result["mean"] = round(self.sum / self.total / scale, 3) if self.total else 0
+        return result
+
+
+# ==================== Prometheus remote write ====================
+# WriteRequest protobuf, hand-encoded to avoid a protobuf dependency:
+#   WriteRequest { repeated TimeSeries timeseries = 1; }
+#   TimeSeries   { repeated Label labels = 1; repeated Sample samples = 2; }
+#   Label        { string name = 1; string value = 2; }
+#   Sample       { double value = 1; int64 timestamp = 2; }
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        bits = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _field(number, payload):
+    """Length-delimited field."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(series, timestamp_ms):
+    """Encode ``[(labels dict incl. __name__, value), ...]`` as one WriteRequest."""
+    out = bytearray()
+    for labels, value in series:
+        ts = b"".join(
+            _field(1, _field(1, name.encode()) + _field(2, str(labels[name]).encode()))
+            for name in sorted(labels)
+        )
+        ts += _field(2, b"\x09" + struct.pack("<d", value) + b"\x10" + _varint(timestamp_ms))
+        out += _field(1, ts)
+    return bytes(out)
+
+
+def snappy_block(data):
+    """Wrap ``data`` in the snappy block format as one uncompressed literal.
+
+    Remote write requires snappy framing; metric batches are small, so
+    skipping the compression itself costs little and needs no library.
+    """
+    if not data:
+        return b"\x00"
+    n = len(data) - 1
+    if n < 60:
+        tag = bytes([n << 2])
+    else:
+        size = (n.bit_length() + 7) // 8
+        tag = bytes([(59 + size) << 2]) + n.to_bytes(size, "little")
+    return _varint(len(data)) + tag + data
+
+
+def remote_write(url, series, timeout=5):
+    body = snappy_block(encode_write_request(series, int(time.time() * 1000)))
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/x-protobuf",
+        "Content-Encoding": "snappy",
+        "X-Prometheus-Remote-Write-Version": "0.1.0",
+        "User-Agent": "oib-loadgen",
+    })
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+# ==================== Load generation ====================
+
+# name -> (default weight, method, path template)
+ENDPOINTS = {
+    "item": (30, "GET", "/items/{item}"),
+    "items": (10, "GET", "/items?limit=50"),
+    "user": (10, "GET", "/users/{user}"),
+    "users": (5, "GET", "/users?limit=50"),
+    "orders": (8, "GET", "/orders?limit=20"),
+    "create_order": (15, "POST", "/orders"),
+    "stats": (5, "GET", "/stats"),
+    "stats_top": (3, "GET", "/stats/items?limit=10"),
+    "readyz": (5, "GET", "/readyz"),
+    "index": (2, "GET", "/"),
+    "slow": (4, "GET", "/slow"),
+    "error": (3, "GET", "/error"),
+}
+
+
+def parse_mix(text):
+    """``"item=30,create_order=10"`` -> weights (unlisted endpoints get 0)."""
+    if not text:
+        return {name: weight for name, (weight, _, _) in ENDPOINTS.items()}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (one of {', '.join(ENDPOINTS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class ConnectionPool:
+    """Up to ``size`` HTTP/1.1 keep-alive connections to one host."""
+
+    def __init__(self, host, port, size, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+
+    async def request(self, method, path, body=None):
+        """Send one request; returns ``(status, body bytes, sent_at)``."""
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            while True:
+                reused = conn is not None
+                try:
+                    if conn is None:
+                        conn = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                    sent_at = time.perf_counter()
+                    status, size, keep_alive = await asyncio.wait_for(self._exchange(conn, method, path, body),
+                                                                      self.timeout)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    if conn is not None:
+                        conn[1].close()
+                    conn = None
+                    # The server closed an idle connection before reading this
+                    # request; retry it on a new one, as browsers do
+                    partial = getattr(e, "partial", b"")
+                    if not reused or partial or method != "GET":
+                        raise
+                except BaseException:
+                    if conn is not None:
+                        conn[1].close()
+                    raise
+            if keep_alive:
+                self._idle.append(conn)
+            else:
+                conn[1].close()
+            return status, size, sent_at
+
+    async def _exchange(self, conn, method, path, body):
+        reader, writer = conn
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        writer.write(head.encode() + b"\r\n" + (body or b""))
+        lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            size = int(headers["content-length"])
+            await reader.readexactly(size)
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            size = 0
+            while True:
+                chunk = int((await reader.readline()).split(b";")[0], 16)
+                await reader.readexactly(chunk + 2)
+                size += chunk
+                if chunk == 0:
+                    break
+        else:
+            size = len(await reader.read())
+            return status, size, False
+        return status, size, headers.get("connection", "").lower() != "close"
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()       # from when the request was due
+        self.service = LatencyHistogram()       # from when it was sent
+        self.interval = LatencyHistogram()      # latency since the last progress report
+        self.statuses = Counter()
+        self.interval_failed = 0
+        self.bytes = 0
+
+    def record(self, status, latency_us, service_us, size):
+        self.statuses[status] += 1
+        if status == "error" or status >= 400:
+            self.interval_failed += 1
+        if latency_us is not None:
+            self.latency.record(latency_us)
+            self.interval.record(latency_us)
+        if service_us is not None:
+            self.service.record(service_us)
+        self.bytes += size
+
+    @property
+    def failed(self):
+        return sum(count for status, count in self.statuses.items() if status == "error" or status >= 400)
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        url = urllib.parse.urlsplit(args.url)
+        self.base_path = url.path.rstrip("/")
+        self.pool = ConnectionPool(url.hostname, url.port or 80, args.connections, args.timeout)
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.names = list(args.mix)
+        self.weights = list(args.mix.values())
+        self.stats = {name: EndpointStats() for name in self.names}
+        self.in_flight = 0
+        self.scheduled = 0
+        self.skipped = 0
+        self._interval_sent = 0
+
+    def rate_at(self, elapsed):
+        args = self.args
+        if args.ramp_to is None:
+            return args.rate
+        return args.rate + (args.ramp_to - args.rate) * min(1.0, elapsed / args.duration)
+
+    def next_request(self):
+        name = self.rng.choices(self.names, self.weights)[0]
+        _, method, template = ENDPOINTS[name]
+        path = self.base_path + template.format(
+            user=self.rng.choice(self.args.user_ids), item=self.rng.choice(self.args.item_ids)
+        )
+        body = None
+        if name == "create_order":
+            items = [self.rng.choice(self.args.item_ids) for _ in range(self.rng.randint(1, 3))]
+            body = json.dumps({"user_id": self.rng.choice(self.args.user_ids), "item_ids": items}).encode()
+        return name, method, path, body
+
+    async def fire(self, name, method, path, body, due):
+        self.in_flight += 1
+        try:
+            status, size, sent_at = await self.pool.request(method, path, body)
+            done = time.perf_counter()
+            self.stats[name].record(status, (done - due) * 1e6, (done - sent_at) * 1e6, size)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            self.stats[name].record("error", None, None, 0)
+        finally:
+            self.in_flight -= 1
+
+    async def schedule(self, start):
+        """Issue requests at their due times until the run's duration is up."""
+        tasks = set()
+        due = start
+        end = start + self.args.duration
+        while due < end:
+            now = time.perf_counter()
+            if due > now:
+                await asyncio.sleep(due - now)
+            # Catch up on everything already due, each with its own due time
+            now = time.perf_counter()
+            while due <= now and due < end:
+                if self.in_flight >= self.args.max_in_flight:
+                    self.skipped += 1
+                else:
+                    task = asyncio.ensure_future(self.fire(*self.next_request(), due))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                self.scheduled += 1
+                self._interval_sent += 1
+                rate = self.rate_at(due - start)
+                gap = self.rng.expovariate(rate) if self.args.arrivals == "poisson" else 1 / rate
+                due += gap if rate > 0 else 0.1
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.args.timeout + 1)
+
+    def series(self, elapsed):
+        """Current values of the pushed metrics."""
+        job = {"testid": self.args.test_id, "job": "oib-loadgen"}
+        out = [({"__name__": "k6_vus", **job}, self.in_flight),
+               ({"__name__": "loadgen_target_rate", **job}, self.rate_at(elapsed))]
+        for name, stats in self.stats.items():
+            labels = dict(job, name=name)
+            for status, count in stats.statuses.items():
+                out.append(({"__name__": "k6_http_reqs_total", **labels, "status": str(status)}, count))
+            if stats.interval.total:
+                out.append(({"__name__": "k6_http_req_duration_p99", **labels},
+                            stats.interval.percentile(99) / 1e6))
+                out.append(({"__name__": "k6_http_req_failed_rate", **labels},
+                            stats.interval_failed / stats.interval.total))
+            for p in (50, 99, 99.9):
+                out.append(({"__name__": "loadgen_latency_seconds", **labels, "quantile": f"{p / 100:g}"},
+                            stats.latency.percentile(p) / 1e6))
+        return out
+
+    async def report_progress(self, start):
+        last = start
+        while True:
+            await asyncio.sleep(self.args.interval)
+            now = time.perf_counter()
+            interval = LatencyHistogram()
+            for stats in self.stats.values():
+                interval.merge(stats.interval)
+            failed = sum(stats.interval_failed for stats in self.stats.values())
+            print(f"{now - start:>6.0f}s  target {self.rate_at(now - start):>7.1f}/s  "
+                  f"sent {self._interval_sent / (now - last):>7.1f}/s  in flight {self.in_flight:>5}  "
+                  f"p50 {interval.percentile(50) / 1000:>8.1f}ms  p99 {interval.percentile(99) / 1000:>8.1f}ms  "
+                  f"failed {failed}", flush=True)
+            if self.args.push:
+                await self.push(now - start)
+            for stats in self.stats.values():
+                stats.interval = LatencyHistogram()
+                stats.interval_failed = 0
+            self._interval_sent = 0
+            last = now
+
+    async def push(self, elapsed):
+        try:
+            await asyncio.to_thread(remote_write, self.args.push, self.series(elapsed))
+        except (OSError, urllib.error.URLError) as e:
+            print(f"  push to {self.args.push} failed: {e}", file=sys.stderr)
+
+    async def run(self):
+        start = time.perf_counter()
+        progress = asyncio.ensure_future(self.report_progress(start))
+        try:
+            await self.schedule(start)
+        finally:
+            progress.cancel()
+        elapsed = time.perf_counter() - start
+        if self.args.push:
+            await self.push(elapsed)
+        return elapsed
+
+    def report(self, elapsed):
+        endpoints, latency, service, statuses = {}, LatencyHistogram(), LatencyHistogram(), Counter()
+        for name, stats in self.stats.items():
+            latency.merge(stats.latency)
+            service.merge(stats.service)
+            statuses.update(stats.statuses)
+            endpoints[name] = {
+                "requests": sum(stats.statuses.values()),
+                "failed": stats.failed,
+                "statuses": {str(status): count for status, count in sorted(stats.statuses.items(), key=str)},
+                "bytes": stats.bytes,
+                "latency_ms": stats.latency.summary(),
+                "service_time_ms": stats.service.summary(),
+            }
+        completed = sum(statuses.values())
+        return {
+            "url": self.args.url,
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "arrivals": self.args.arrivals,
+            "rate": self.args.rate,
+            "ramp_to": self.args.ramp_to,
+            "duration_seconds": round(elapsed, 3),
+            "connections": self.args.connections,
+            "scheduled": self.scheduled,
+            "skipped": self.skipped,
+            "completed": completed,
+            "throughput": round(completed / elapsed, 2),
+            "failed": sum(stats.failed for stats in self.stats.values()),
+            "latency_ms": latency.summary(),
+            "service_time_ms": service.summary(),
+            "endpoints": endpoints,
+        }
+
+
+def print_report(report):
+    print()
+    print(f"{'endpoint':<14}  {'requests':>8}  {'failed':>6}  {'p50 ms':>8}  {'p99 ms':>8}  {'p99.9 ms':>8}  "
+          f"{'max ms':>8}  {'svc p99':>8}")
+    rows = sorted(report["endpoints"].items()) + [("total", report)]
+    for name, row in rows:
+        lat, svc = row["latency_ms"], row["service_time_ms"]
+        requests = row.get("requests", row.get("completed"))
+        print(f"{name:<14}  {requests:>8}  {row['failed']:>6}  {lat['p50']:>8.1f}  {lat['p99']:>8.1f}  "
+              f"{lat['p99.9']:>8.1f}  {lat['max']:>8.1f}  {svc['p99']:>8.1f}")
+    print(f"\n{report['completed']} requests in {report['duration_seconds']}s ({report['throughput']}/s), "
+          f"{report['skipped']} skipped at the in-flight limit")
+
+
+def connect_db():
+    if psycopg2 is None:
+        raise RuntimeError("psycopg2 is required (pip install psycopg2-binary)")
+    return psycopg2.connect(
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        user=os.getenv("POSTGRES_USER", "oib"),
+        password=os.getenv("POSTGRES_PASSWORD", "oib_secret"),
+        dbname=os.getenv("POSTGRES_DB", "oib_demo"),
+    )
+
+
+def discover_ids(args):
+    """Pick users and items from ``1..--users``/``--items``, or else from the ids in Postgres."""
+    args.user_ids, args.item_ids = range(1, (args.users or 3) + 1), range(1, (args.items or 5) + 1)
+    if args.users and args.items:
+        return
+    try:
+        conn = connect_db()
+    except Exception as e:
+        print(f"Could not look up ids ({e}); using 1..{len(args.user_ids)} and 1..{len(args.item_ids)}",
+              file=sys.stderr)
+        return
+    with conn, conn.cursor() as cur:
+        if not args.users:
+            cur.execute("SELECT id FROM users")
+            args.user_ids = array("q", (row[0] for row in cur)) or args.user_ids
+        if not args.items:
+            cur.execute("SELECT id FROM items")
+            args.item_ids = array("q", (row[0] for row in cur)) or args.item_ids
+    conn.close()
+
+
+def run(args):
+    discover_ids(args)
+    ramp = f" ramping to {args.ramp_to}/s" if args.ramp_to is not None else ""
+    print(f"Open-loop {args.arrivals} arrivals at {args.rate}/s{ramp} for {args.duration}s against {args.url} "
+          f"({len(args.user_ids)} users, {len(args.item_ids)} items)")
+    generator = LoadGenerator(args)
+    elapsed = asyncio.run(generator.run())
+    report = generator.report(elapsed)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+# ==================== Seeding ====================
+
+ADJECTIVES = ["Useful", "Fancy", "Mysterious", "Essential", "Compact", "Deluxe", "Rugged", "Vintage", "Smart", "Tiny"]
+NOUNS = ["Widget", "Gadget", "Gizmo", "Thingamajig", "Doohickey", "Sprocket", "Contraption", "Device", "Module", "Kit"]
+STATUSES = ["pending", "paid", "shipped"]
+
+
+def _reserve_ids(cur, table, count):
+    """Reserve ``count`` ids from the table's sequence, since COPY cannot return them."""
+    cur.execute(f"SELECT nextval(pg_get_serial_sequence('{table}', 'id')) FROM generate_series(1, %s)", (count,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _copy(cur, table, columns, buf):
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def _timestamp(rng, now, days):
+    return (now - timedelta(seconds=rng.random() * days * 86400)).isoformat(sep=" ", timespec="seconds")
+
+
+def _progress(table, done, total, started):
+    rate = done / max(time.perf_counter() - started, 1e-9)
+    print(f"\r  {table:<7} {done:>10,}/{total:,}  ({rate:,.0f} rows/s)", end="", flush=True)
+
+
+def seed_users(conn, rng, args, now):
+    started = time.perf_counter()
+    for offset in range(0, args.users, args.chunk):
+        with conn.cursor() as cur:
+            ids = _reserve_ids(cur, "users", min(args.chunk, args.users - offset))
+            buf = io.StringIO()
+            for user_id in ids:
+                buf.write(f"seed{user_id}\tseed{user_id}@example.com\t{_timestamp(rng, now, args.days)}\n")
+            _copy(cur, "users", ("username", "email", "created_at"), buf)
+        conn.commit()
+        _progress("users", offset + len(ids), args.users, started)
+    if args.users:
+        print()
+
+
+def seed_items(conn, rng, args, now, user_ids):
+    started = time.perf_counter()
+    for offset in range(0, args.items, args.chunk):
+        with conn.cursor() as cur:
+            ids = _reserve_ids(cur, "items", min(args.chunk, args.items - offset))
+            buf = io.StringIO()
+            for item_id in ids:
+                price = min(max(rng.lognormvariate(3.3, 0.9), 0.5), 5000)
+                buf.write(f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {item_id}\tSeeded item {item_id}\t"
+                          f"{price:.2f}\t{rng.choice(user_ids)}\t{_timestamp(rng, now, args.days)}\n")
+            _copy(cur, "items", ("name", "description", "price", "user_id", "created_at"), buf)
+        conn.commit()
+        _progress("items", offset + len(ids), args.items, started)
+    if args.items:
+        print()
+
+
+def seed_orders(conn, rng, args, now, user_ids, item_ids, item_cents):
+    """COPY orders with their items, both in the same transaction per chunk.
+
+    A chunk holds whole orders, so the statement-level rollup triggers
+    count each order once.
+    """
+    started = time.perf_counter()
+    max_lines = max(1, 2 * args.items_per_order - 1)
+    catalog = len(item_ids)
+    for offset in range(0, args.orders, args.chunk):
+        with conn.cursor() as cur:
+            ids = _reserve_ids(cur, "orders", min(args.chunk, args.orders - offset))
+            orders_buf, lines_buf = io.StringIO(), io.StringIO()
+            for order_id in ids:
+                total = 0
+                lines = {}
+                for _ in range(rng.randint(1, max_lines)):
+                    # rng.random() ** skew puts most picks near the start of the catalog
+                    index = min(int(catalog * rng.random() ** args.skew), catalog - 1)
+                    lines[index] = lines.get(index, 0) + rng.randint(1, 3)
+                for index, quantity in lines.items():
+                    total += item_cents[index] * quantity
+                    lines_buf.write(f"{order_id}\t{item_ids[index]}\t{quantity}\n")
+                orders_buf.write(f"{order_id}\t{rng.choice(user_ids)}\t{total // 100}.{total % 100:02d}\t"
+                                 f"{rng.choices(STATUSES, (2, 3, 5))[0]}\t{_timestamp(rng, now, args.days)}\n")
+            _copy(cur, "orders", ("id", "user_id", "total", "status", "created_at"), orders_buf)
+            _copy(cur, "order_items", ("order_id", "item_id", "quantity"), lines_buf)
+        conn.commit()
+        _progress("orders", offset + len(ids), args.orders, started)
+    if args.orders:
+        print()
+
+
+def bump_cache_generations(prefixes=("users", "items")):
+    """Invalidate the app's cached pages, as its own writes do."""
+    if redis is None:
+        print("redis is not installed: cached pages stay valid until the next write")
+        return
+    try:
+        client = redis.Redis(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")),
+                             socket_timeout=2)
+        pipe = client.pipeline(transaction=False)
+        for prefix in prefixes:
+            pipe.incr(f"cache_gen:{prefix}")
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Could not bump cache generations ({e}): cached pages stay valid until the next write")
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    now = datetime.now()
+    conn = connect_db()
+    started = time.perf_counter()
+    print(f"Seeding {args.users:,} users, {args.items:,} items and {args.orders:,} orders "
+          f"in chunks of {args.chunk:,}")
+    try:
+        seed_users(conn, rng, args, now)
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM users")
+            user_ids = array("q", (row[0] for row in cur))
+        if not user_ids:
+            sys.exit("no users to own items and place orders")
+
+        seed_items(conn, rng, args, now, user_ids)
+        if args.orders:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id, (price * 100)::bigint FROM items WHERE price IS NOT NULL ORDER BY id")
+                item_ids, item_cents = array("q"), array("q")
+                for item_id, cents in cur:
+                    item_ids.append(item_id)
+                    item_cents.append(cents)
+            if not item_ids:
+                sys.exit("no priced items to order")
+            # Popularity follows a shuffled order, not item age
+            order = list(range(len(item_ids)))
+            rng.shuffle(order)
+            item_ids = array("q", (item_ids[i] for i in order))
+            item_cents = array("q", (item_cents[i] for i in order))
+            seed_orders(conn, rng, args, now, user_ids, item_ids, item_cents)
+
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE users, items, orders, order_items")
+    finally:
+        conn.close()
+    bump_cache_generations()
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seeder = commands.add_parser("seed", help="bulk-load users, items and orders with COPY")
+    seeder.add_argument("--users", type=int, default=10000)
+    seeder.add_argument("--items", type=int, default=100000)
+    seeder.add_argument("--orders", type=int, default=1000000)
+    seeder.add_argument("--items-per-order", type=int, default=3, help="average distinct items per order")
+    seeder.add_argument("--skew", type=float, default=2.0, help="item popularity skew (1 = uniform)")
+    seeder.add_argument("--days", type=float, default=30, help="spread created_at over this many days")
+    seeder.add_argument("--chunk", type=int, default=50000, help="rows per COPY transaction")
+    seeder.add_argument("--seed", type=int, default=None, help="random seed for a reproducible dataset")
+
+    runner = commands.add_parser("run", help="drive the endpoint mix at an open-loop arrival rate")
+    runner.add_argument("--url", default="http://localhost:5000")
+    runner.add_argument("--rate", type=float, default=20, help="requests per second (at the start)")
+    runner.add_argument("--ramp-to", type=float, default=None, help="ramp linearly to this rate")
+    runner.add_argument("--duration", type=float, default=60, help="seconds")
+    runner.add_argument("--arrivals", choices=["uniform", "poisson"], default="poisson")
+    runner.add_argument("--mix", type=parse_mix, default=parse_mix(""),
+                        help=f"endpoint weights, e.g. item=30,create_order=10 (endpoints: {', '.join(ENDPOINTS)})")
+    runner.add_argument("--users", type=int, default=0, help="request user ids 1..N (default: the ids in Postgres)")
+    runner.add_argument("--items", type=int, default=0, help="request item ids 1..N (default: the ids in Postgres)")
+    runner.add_argument("--connections", type=int, default=256, help="maximum keep-alive connections")
+    runner.add_argument("--max-in-flight", type=int, default=10000,
+                        help="requests due beyond this many outstanding are skipped and counted")
+    runner.add_argument("--timeout", type=float, default=30, help="per-request timeout")
+    runner.add_argument("--interval", type=float, default=5, help="seconds between progress lines and pushes")
+    runner.add_argument("--report", help="write the JSON report to this file")
+    runner.add_argument("--push", help="Prometheus remote write URL, e.g. http://localhost:9090/api/v1/write")
+    runner.add_argument("--test-id", default="oib-loadgen", help="testid label on pushed series")
+    runner.add_argument("--seed", type=int, default=None, help="random seed for a reproducible request sequence")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Smoke test: the sync (gunicorn) and asyncio (uvicorn) modes serve the same API
+
+Starts the demo app in each serving mode, sends each request to one and
+then the other (so both see the same data) and compares what comes back:
+the status, the JSON shape of the body (keys and value types, not values,
+since view counts move) and the caching headers. List endpoints are requested again with the ETag
+they returned, which must get a 304. Exits non-zero on any difference, or
+if a request fails in both modes.
+
+Usage:
+    python parity.py
+
+Needs the demo app's Postgres and Redis (POSTGRES_HOST / REDIS_HOST), and
+gunicorn and uvicorn on PATH. Creates a few orders.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (method, path, JSON body); list endpoints are also revalidated with their ETag
+CASES = [
+    ("GET", "/", None),
+    ("GET", "/livez", None),
+    ("GET", "/health", None),
+    ("GET", "/readyz", None),
+    ("GET", "/users?limit=5", None),
+    ("GET", "/users?stream=1", None),
+    ("GET", "/users/1", None),
+    ("GET", "/users/999999999", None),
+    ("GET", "/items?limit=5", None),
+    ("GET", "/items?stream=1", None),
+    ("GET", "/items/1", None),
+    ("GET", "/items/999999999", None),
+    ("GET", "/orders?limit=5", None),
+    ("POST", "/orders", {"user_id": 1, "items": [{"item_id": 1, "quantity": 2}, {"item_id": 2}]}),
+    ("POST", "/orders", {"user_id": 1, "items": [{"item_id": 1, "quantity": 0}]}),
+    ("POST", "/orders", {"user_id": 1, "item_ids": [999999999]}),
+    ("POST", "/orders", {"user_id": 1, "items": "nope"}),
+    ("POST", "/orders", [1, 2]),
+    ("GET", "/stats", None),
+    ("GET", "/stats/users?limit=3", None),
+    ("GET", "/stats/items?sort=quantity&limit=3", None),
+    ("GET", "/stats/timeline?span=day", None),
+]
+CONDITIONAL = {"/users", "/items", "/orders"}
+HEADERS = ("Cache-Control", "Retry-After")
+
+
+def server_command(mode, port):
+    if mode == "sync":
+        return ["gunicorn", "-c", "gunicorn.conf.py", "app:app"], {"GUNICORN_WORKERS": "1"}
+    return ["uvicorn", "asgi_app:application", "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--no-access-log"], {}
+
+
+def start_server(mode, port):
+    command, extra_env = server_command(mode, port)
+    metrics_dir = tempfile.mkdtemp(prefix="parity-")
+    env = dict(os.environ, PORT=str(port), PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+               PYROSCOPE_ENABLED="false", OTEL_SDK_DISABLED="true", LOG_LEVEL="WARNING", **extra_env)
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/readyz", timeout=1) as response:
+                if response.status == 200:
+                    return server, metrics_dir
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    raise RuntimeError(f"{mode} server did not come up")
+
+
+def shape(value):
+    """Keys and value types of a JSON document, with list items merged."""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        shapes = []
+        for item in map(shape, value):
+            if item not in shapes:
+                shapes.append(item)
+        return shapes
+    if isinstance(value, bool) or value is None:
+        return repr(value)
+    return "number" if isinstance(value, (int, float)) else type(value).__name__
+
+
+def send(port, method, path, body=None, headers=None):
+    headers = dict(headers or {})
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            try:
+                return response.status, response.headers, response.read()
+            except http.client.IncompleteRead as e:
+                # A stream that failed after its headers went out
+                return "incomplete", response.headers, e.partial
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def observe(port, method, path, body):
+    """What a request returned, in a form both modes must agree on."""
+    status, headers, payload = send(port, method, path, body)
+    try:
+        document = shape(json.loads(payload)) if payload else None
+    except ValueError:
+        document = "not json"
+    result = {"status": status, "body": document, "etag": "ETag" in headers}
+    result.update((name, headers.get(name)) for name in HEADERS)
+    if method == "GET" and path.partition("?")[0] in CONDITIONAL and "ETag" in headers:
+        result["revalidated"] = send(port, method, path, headers={"If-None-Match": headers["ETag"]})[0]
+    return result
+
+
+def failed(status):
+    return not isinstance(status, int) or status >= 500
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=5099, help="sync mode port; async mode uses the next one")
+    args = parser.parse_args()
+
+    for tool in ("gunicorn", "uvicorn"):
+        if shutil.which(tool) is None:
+            sys.exit(f"{tool} not found on PATH")
+
+    servers = []
+    try:
+        for offset, mode in enumerate(("sync", "async")):
+            servers.append(start_server(mode, args.port + offset))
+        results = [(observe(args.port, method, path, body), observe(args.port + 1, method, path, body))
+                   for method, path, body in CASES]
+    finally:
+        for server, metrics_dir in servers:
+            server.terminate()
+            server.wait(30)
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    failures = 0
+    for (method, path, _), (expected, actual) in zip(CASES, results):
+        problems = [f"{key}: sync {expected.get(key)!r} != async {actual.get(key)!r}"
+                    for key in sorted(expected.keys() | actual.keys()) if expected.get(key) != actual.get(key)]
+        if all(failed(result["status"]) for result in (expected, actual)):
+            problems.append(f"status {expected['status']} in both modes")
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok':<4}  {method:<4} {path}")
+        for problem in problems:
+            print(f"        {problem}")
+    print(f"\n{len(CASES) - failures}/{len(CASES)} requests served alike")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
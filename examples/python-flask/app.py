@@ -10,29 +10,80 @@
 #               opentelemetry-exporter-otlp opentelemetry-instrumentation-flask \
 #               structlog requests
 
+import atexit
 import logging
+import os
 import random
+import threading
 import time
 
-from flask import Flask, jsonify
+from flask import Flask, g, jsonify, request
 import structlog
 
 # ==================== Metrics Setup ====================
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.exposition import choose_encoder
+
+# Latency buckets in seconds, e.g. REQUEST_LATENCY_BUCKETS=0.01,0.1,1
+REQUEST_LATENCY_BUCKETS = tuple(
+    float(b) for b in os.environ.get("REQUEST_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")
+)
 
 REQUEST_COUNT = Counter('app_requests_total', 'Total requests', ['method', 'endpoint', 'status'])
-REQUEST_LATENCY = Histogram('app_request_latency_seconds', 'Request latency', ['endpoint'])
+REQUEST_LATENCY = Histogram(
+    'app_request_latency_seconds', 'Request latency', ['method', 'endpoint'], buckets=REQUEST_LATENCY_BUCKETS
+)
 
 # ==================== Tracing Setup ====================
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.sampling import Decision, ParentBased, Sampler, SamplingResult, TraceIdRatioBased
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
 from opentelemetry.sdk.resources import Resource
 
+# Sampling: keep TRACE_SAMPLE_RATIO of new traces, at most TRACE_RATE_LIMIT
+# new traces per second (0 = unlimited); child spans follow their parent
+TRACE_SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_RATE_LIMIT = float(os.environ.get("TRACE_RATE_LIMIT", "0"))
+TRACE_SAMPLER_DECISIONS = Counter('app_trace_sampler_decisions_total', 'Head sampling decisions for new traces', ['decision'])
+
+class RateLimitedRatioSampler(Sampler):
+    """Trace id ratio sampling with a token-bucket traces/second budget"""
+
+    def __init__(self, ratio, rate_limit):
+        self.ratio = TraceIdRatioBased(ratio)
+        self.rate_limit = rate_limit
+        self.tokens = max(rate_limit, 1.0)
+        self.refilled = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take_token(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(self.rate_limit, 1.0), self.tokens + (now - self.refilled) * self.rate_limit)
+            self.refilled = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        if not self.ratio.should_sample(parent_context, trace_id, name).decision.is_sampled():
+            decision = "dropped_ratio"
+        elif self.rate_limit > 0 and not self.take_token():
+            decision = "dropped_rate_limit"
+        else:
+            TRACE_SAMPLER_DECISIONS.labels(decision="sampled").inc()
+            return SamplingResult(Decision.RECORD_AND_SAMPLE, attributes, trace_state)
+        TRACE_SAMPLER_DECISIONS.labels(decision=decision).inc()
+        return SamplingResult(Decision.DROP, trace_state=trace_state)
+
+    def get_description(self):
+        return f"RateLimitedRatioSampler{{{self.ratio.get_description()}, rate_limit={self.rate_limit}}}"
+
 # Configure tracer
-import os
 otel_endpoint = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "localhost:4317")
 # Strip http:// or https:// for gRPC exporter (it only wants host:port)
 if otel_endpoint.startswith("http://"):
@@ -40,7 +91,9 @@ if otel_endpoint.startswith("http://"):
 elif otel_endpoint.startswith("https://"):
     otel_endpoint = otel_endpoint[8:]
 resource = Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME", "example-flask-app")})
-provider = TracerProvider(resource=resource)
+provider = TracerProvider(
+    resource=resource, sampler=ParentBased(root=RateLimitedRatioSampler(TRACE_SAMPLE_RATIO, TRACE_RATE_LIMIT))
+)
 processor = BatchSpanProcessor(OTLPSpanExporter(
     endpoint=otel_endpoint,
     insecure=True
@@ -50,16 +103,39 @@ trace.set_tracer_provider(provider)
 tracer = trace.get_tracer(__name__)
 
 # ==================== Logging Setup ====================
+from loki_sink import LokiSink
+
+logging.basicConfig(format="%(message)s", level=os.environ.get("LOG_LEVEL", "INFO").upper())
+
+# Logs are rendered to stdout, and also shipped straight to Loki in
+# compressed batches when LOKI_URL is set (LOKI_STDOUT=false: Loki only)
+LOKI_URL = os.environ.get("LOKI_URL", "")
+log_processors = [
+    structlog.stdlib.filter_by_level,
+    structlog.stdlib.add_logger_name,
+    structlog.stdlib.add_log_level,
+    structlog.processors.TimeStamper(fmt="iso"),
+    structlog.processors.StackInfoRenderer(),
+    structlog.processors.format_exc_info,
+]
+if LOKI_URL:
+    loki_sink = LokiSink(
+        LOKI_URL,
+        labels={"app": "example-flask", "service_name": os.environ.get("OTEL_SERVICE_NAME", "example-flask-app")},
+        compression=os.environ.get("LOKI_COMPRESSION", "gzip"),
+        batch_bytes=int(os.environ.get("LOKI_BATCH_BYTES", str(512 * 1024))),
+        batch_wait=float(os.environ.get("LOKI_BATCH_WAIT", "1")),
+        max_buffer=int(os.environ.get("LOKI_MAX_BUFFER", "50000")),
+        block_timeout=float(os.environ.get("LOKI_BLOCK_TIMEOUT", "0.05")),
+        forward=os.environ.get("LOKI_STDOUT", "true").lower() == "true",
+    )
+    log_processors.append(loki_sink)
+    # Flush what is still buffered on shutdown
+    atexit.register(loki_sink.close)
+log_processors.append(structlog.processors.JSONRenderer())
+
 structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.JSONRenderer()
-    ],
+    processors=log_processors,
     wrapper_class=structlog.stdlib.BoundLogger,
     context_class=dict,
     logger_factory=structlog.stdlib.LoggerFactory(),
@@ -72,38 +148,57 @@ logger = structlog.get_logger()
 app = Flask(__name__)
 FlaskInstrumentor().instrument_app(app)
 
+# ==================== Request Metrics ====================
+def trace_exemplar():
+    """Exemplar labels linking a metric sample to the active, sampled trace."""
+    ctx = trace.get_current_span().get_span_context()
+    if not ctx.is_valid or not ctx.trace_flags.sampled:
+        return None
+    return {"trace_id": format(ctx.trace_id, "032x")}
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Label by URL rule, not raw path, to keep cardinality bounded
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_COUNT.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+    if "request_start" in g:
+        REQUEST_LATENCY.labels(method=request.method, endpoint=endpoint).observe(
+            time.perf_counter() - g.request_start, exemplar=trace_exemplar()
+        )
+    return response
+
 @app.route('/')
 def home():
-    with REQUEST_LATENCY.labels(endpoint='/').time():
-        logger.info("home_accessed", endpoint="/")
-        REQUEST_COUNT.labels(method='GET', endpoint='/', status='200').inc()
-        return jsonify({"message": "Hello from OIB Example App!", "status": "healthy"})
+    logger.info("home_accessed", endpoint="/")
+    return jsonify({"message": "Hello from OIB Example App!", "status": "healthy"})
 
 @app.route('/api/data')
 def get_data():
-    with REQUEST_LATENCY.labels(endpoint='/api/data').time():
-        # Create a custom span
-        with tracer.start_as_current_span("process_data") as span:
-            # Simulate some work
-            delay = random.uniform(0.1, 0.5)
-            time.sleep(delay)
-            
-            span.set_attribute("delay_seconds", delay)
-            logger.info("data_processed", endpoint="/api/data", delay=delay)
-            
-        REQUEST_COUNT.labels(method='GET', endpoint='/api/data', status='200').inc()
-        return jsonify({"data": [1, 2, 3, 4, 5], "processed_in": delay})
+    # Create a custom span
+    with tracer.start_as_current_span("process_data") as span:
+        # Simulate some work
+        delay = random.uniform(0.1, 0.5)
+        time.sleep(delay)
+        
+        span.set_attribute("delay_seconds", delay)
+        logger.info("data_processed", endpoint="/api/data", delay=delay)
+        
+    return jsonify({"data": [1, 2, 3, 4, 5], "processed_in": delay})
 
 @app.route('/api/error')
 def trigger_error():
     logger.error("error_triggered", endpoint="/api/error", error="Intentional error")
-    REQUEST_COUNT.labels(method='GET', endpoint='/api/error', status='500').inc()
     return jsonify({"error": "Something went wrong!"}), 500
 
 @app.route('/metrics')
 def metrics():
-    """Prometheus metrics endpoint"""
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    """Prometheus metrics endpoint (OpenMetrics with trace exemplars when requested)"""
+    encoder, content_type = choose_encoder(request.headers.get("Accept"))
+    return encoder(REGISTRY), 200, {'Content-Type': content_type}
 
 @app.route('/health')
 def health():
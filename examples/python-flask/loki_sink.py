@@ -0,0 +1,356 @@
+# Batched, compressed log shipping to the Loki push API for structlog
+#
+# LokiSink is a structlog processor: put it right before the renderer and
+# every event is also queued for Loki. A background thread groups queued
+# events into streams by label set and pushes them as one request when the
+# batch reaches LOKI_BATCH_BYTES or its oldest event is LOKI_BATCH_WAIT
+# seconds old, either as gzip-compressed JSON or (with python-snappy
+# installed) as snappy-compressed protobuf, like Promtail and Alloy do.
+#
+# When Loki is slow or down, failed pushes are retried with exponential
+# backoff while new events pile up in a bounded buffer. A full buffer first
+# blocks the logging thread for up to LOKI_BLOCK_TIMEOUT seconds
+# (backpressure); if Loki still hasn't caught up, the oldest events are
+# shed without blocking until the buffer has drained to half.
+#
+# Try it against a local stand-in for Loki that can be made slow or flaky:
+#   python loki_sink.py serve --port 3100 --delay 0.5 --fail-rate 0.2
+#   python loki_sink.py bench --rate 5000 --duration 10 --delay 0.2
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import structlog
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+LOKI_BATCH_RECORDS = Histogram(
+    'app_loki_batch_records', 'Log records per Loki push', buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000)
+)
+LOKI_BATCH_BYTES = Histogram(
+    'app_loki_batch_bytes', 'Compressed Loki push body size',
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+)
+LOKI_PUSH_LATENCY = Histogram(
+    'app_loki_push_seconds', 'Loki push request latency', ['result'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+LOKI_RETRIES = Counter('app_loki_push_retries_total', 'Loki pushes retried after a failure')
+LOKI_DROPPED = Counter('app_loki_records_dropped_total', 'Log records not delivered to Loki', ['reason'])
+LOKI_BUFFERED = Gauge('app_loki_buffered_records', 'Log records waiting to be pushed to Loki')
+
+
+# ==================== Protobuf encoding ====================
+# Loki's PushRequest, hand-encoded to avoid a protobuf dependency:
+#   PushRequest { repeated Stream streams = 1; }
+#   Stream      { string labels = 1; repeated Entry entries = 2; }
+#   Entry       { Timestamp timestamp = 1; string line = 2; }
+#   Timestamp   { int64 seconds = 1; int32 nanos = 2; }
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _bytes_field(number, data):
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def _encode_push_request(streams):
+    body = bytearray()
+    for labels, entries in streams.items():
+        stream = bytearray(_bytes_field(1, _label_string(labels).encode()))
+        for ts, line in entries:
+            seconds, nanos = divmod(ts, 1_000_000_000)
+            timestamp = _varint(1 << 3) + _varint(seconds) + _varint(2 << 3) + _varint(nanos)
+            stream += _bytes_field(2, _bytes_field(1, timestamp) + _bytes_field(2, line.encode()))
+        body += _bytes_field(1, bytes(stream))
+    return bytes(body)
+
+
+def _label_string(labels):
+    # Label values are quoted like Go strings; JSON string escaping is a subset
+    return "{" + ", ".join(f'{k}={json.dumps(v)}' for k, v in labels) + "}"
+
+
+# ==================== Sink ====================
+
+class LokiSink:
+    """structlog processor that ships events to Loki in compressed batches.
+
+    ``labels`` are static stream labels; ``label_keys`` names event keys
+    promoted to labels (keep these low-cardinality, e.g. ``level``). Events
+    are passed on to the renderer as well; with ``forward=False`` they are
+    consumed here instead, so a log collector scraping stdout doesn't ship
+    them twice.
+    """
+
+    def __init__(self, url, labels=None, label_keys=("level",), compression="gzip",
+                 batch_bytes=512 * 1024, batch_wait=1.0, max_buffer=50_000, block_timeout=0.05,
+                 timeout=5.0, max_retries=5, max_backoff=10.0, forward=True):
+        if compression == "snappy" and snappy is None:
+            compression = "gzip"
+        self.url = url.rstrip("/") + "/loki/api/v1/push"
+        self.labels = dict(labels or {})
+        self.label_keys = tuple(label_keys)
+        self.compression = compression
+        self.batch_bytes = batch_bytes
+        self.batch_wait = batch_wait
+        self.max_buffer = max_buffer
+        self.block_timeout = block_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.forward = forward
+        self._buffer = deque()      # (labels, ts_ns, line)
+        self._buffered_bytes = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._shedding = False
+        self._session = requests.Session()
+        self._thread = threading.Thread(target=self._run, name="loki-sink", daemon=True)
+        self._thread.start()
+
+    def __call__(self, logger, method_name, event_dict):
+        labels = dict(self.labels)
+        for key in self.label_keys:
+            if key in event_dict:
+                labels[key] = str(event_dict[key])
+        line = json.dumps(event_dict, default=str)
+        self._put(tuple(sorted(labels.items())), time.time_ns(), line)
+        if self.forward:
+            return event_dict
+        raise structlog.DropEvent
+
+    def _put(self, labels, ts, line):
+        with self._cond:
+            if len(self._buffer) >= self.max_buffer:
+                # Backpressure first; if that doesn't free space, shed the
+                # oldest records without waiting until the buffer drains
+                if not self._shedding:
+                    self._cond.wait_for(lambda: len(self._buffer) < self.max_buffer, self.block_timeout)
+                    self._shedding = len(self._buffer) >= self.max_buffer
+                while len(self._buffer) >= self.max_buffer:
+                    _, _, dropped = self._buffer.popleft()
+                    self._buffered_bytes -= len(dropped)
+                    LOKI_DROPPED.labels(reason="buffer_full").inc()
+            self._buffer.append((labels, ts, line))
+            self._buffered_bytes += len(line)
+            if len(self._buffer) == 1 or self._batch_ready():
+                self._cond.notify_all()
+        LOKI_BUFFERED.set(len(self._buffer))
+
+    def _batch_ready(self):
+        return self._buffered_bytes >= self.batch_bytes or len(self._buffer) >= self.max_buffer
+
+    def _take_batch(self):
+        """Wait for a full or old-enough batch and remove it from the buffer."""
+        with self._cond:
+            while not self._buffer and not self._closed:
+                self._cond.wait()
+            deadline = time.monotonic() + self.batch_wait
+            while not self._batch_ready() and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, size = [], 0
+            while self._buffer and size < self.batch_bytes:
+                record = self._buffer.popleft()
+                size += len(record[2])
+                batch.append(record)
+            self._buffered_bytes -= size
+            if len(self._buffer) < self.max_buffer // 2:
+                self._shedding = False
+            self._cond.notify_all()
+        LOKI_BUFFERED.set(len(self._buffer))
+        return batch
+
+    def _encode(self, batch):
+        streams = {}
+        for labels, ts, line in batch:
+            streams.setdefault(labels, []).append((ts, line))
+        if self.compression == "snappy":
+            return snappy.compress(_encode_push_request(streams)), {"Content-Type": "application/x-protobuf"}
+        payload = {"streams": [
+            {"stream": dict(labels), "values": [[str(ts), line] for ts, line in entries]}
+            for labels, entries in streams.items()
+        ]}
+        return gzip.compress(json.dumps(payload).encode(), compresslevel=5), {
+            "Content-Type": "application/json", "Content-Encoding": "gzip"
+        }
+
+    def _push(self, body, headers):
+        """Push one batch, retrying with backoff; returns True once delivered."""
+        backoff = 0.25
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                LOKI_RETRIES.inc()
+                time.sleep(backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, self.max_backoff)
+            start = time.perf_counter()
+            try:
+                response = self._session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+                status = response.status_code
+            except requests.RequestException:
+                status = None
+            result = "success" if status and status < 300 else "error"
+            LOKI_PUSH_LATENCY.labels(result=result).observe(time.perf_counter() - start)
+            if result == "success":
+                return True
+            if status and 400 <= status < 500 and status != 429:
+                return False    # rejected (bad labels, too old, ...): retrying won't help
+        return False
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            body, headers = self._encode(batch)
+            LOKI_BATCH_RECORDS.observe(len(batch))
+            LOKI_BATCH_BYTES.observe(len(body))
+            if not self._push(body, headers):
+                LOKI_DROPPED.labels(reason="push_failed").inc(len(batch))
+
+    def close(self, timeout=5.0):
+        """Flush what is buffered and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+
+# ==================== Local Loki stand-in ====================
+
+class StandInLoki(BaseHTTPRequestHandler):
+    """Accepts Loki pushes, counting entries; optionally slow or flaky."""
+
+    delay = 0.0
+    fail_rate = 0.0
+    entries = 0
+    streams = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.headers.get("Content-Type") == "application/x-protobuf":
+            if snappy is None:
+                self.send_response(415)
+                self.end_headers()
+                return
+            entries, streams = self._count_protobuf(snappy.uncompress(body))
+        else:
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            payload = json.loads(body)
+            entries = sum(len(s["values"]) for s in payload["streams"])
+            streams = len(payload["streams"])
+        with self.lock:
+            StandInLoki.entries += entries
+            StandInLoki.streams += streams
+        self.send_response(204)
+        self.end_headers()
+
+    @staticmethod
+    def _count_protobuf(data):
+        """Count streams and entries in a PushRequest without a protobuf library."""
+        def fields(buf):
+            pos = 0
+            while pos < len(buf):
+                key, pos = _read_varint(buf, pos)
+                length, pos = _read_varint(buf, pos)
+                yield key >> 3, buf[pos:pos + length]
+                pos += length
+        streams = [stream for number, stream in fields(data) if number == 1]
+        return sum(1 for s in streams for number, _ in fields(s) if number == 2), len(streams)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def start_standin(port=0, delay=0.0, fail_rate=0.0):
+    StandInLoki.delay, StandInLoki.fail_rate = delay, fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandInLoki)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Loki stand-in and LokiSink benchmark")
+    parser.add_argument("mode", choices=["serve", "bench"])
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--delay", type=float, default=0.0, help="stand-in response delay (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of pushes answered 503")
+    parser.add_argument("--rate", type=int, default=5000, help="bench: log records per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--compression", default="gzip", choices=["gzip", "snappy"])
+    parser.add_argument("--max-buffer", type=int, default=50_000)
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        server = start_standin(args.port, args.delay, args.fail_rate)
+        print(f"Loki stand-in on http://127.0.0.1:{server.server_port}", flush=True)
+        while True:
+            time.sleep(5)
+            print(f"received {StandInLoki.entries} entries in {StandInLoki.streams} streams", flush=True)
+
+    server = start_standin(0, args.delay, args.fail_rate)
+    sink = LokiSink(f"http://127.0.0.1:{server.server_port}", labels={"app": "bench"},
+                    compression=args.compression, max_buffer=args.max_buffer)
+    sent, start = 0, time.perf_counter()
+    blocked = 0.0
+    while (elapsed := time.perf_counter() - start) < args.duration:
+        while sent < int(elapsed * args.rate):
+            t = time.perf_counter()
+            try:
+                sink(None, "info", {"event": "bench", "level": random.choice(["info", "warning"]), "seq": sent})
+            except structlog.DropEvent:
+                pass
+            blocked += time.perf_counter() - t
+            sent += 1
+        time.sleep(0.001)
+    sink.close(timeout=30)
+    sample = REGISTRY.get_sample_value
+    dropped = {r: sample("app_loki_records_dropped_total", {"reason": r}) or 0 for r in ("buffer_full", "push_failed")}
+    batches = sample("app_loki_batch_records_count") or 0
+    print(f"sent {sent}, received {StandInLoki.entries}, dropped {dropped}, "
+          f"retries {sample('app_loki_push_retries_total'):.0f}")
+    print(f"{batches:.0f} batches, {sample('app_loki_batch_records_sum') / max(batches, 1):.0f} records and "
+          f"{sample('app_loki_batch_bytes_sum') / max(batches, 1) / 1024:.1f} KiB each; "
+          f"logging thread {blocked / sent * 1e6:.1f} us/record")
+
+
+if __name__ == "__main__":
+    main()
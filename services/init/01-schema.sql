@@ -27,9 +27,145 @@ CREATE TABLE IF NOT EXISTS order_items (
     id SERIAL PRIMARY KEY,
     order_id INTEGER REFERENCES orders(id),
     item_id INTEGER REFERENCES items(id),
-    quantity INTEGER DEFAULT 1
+    quantity INTEGER DEFAULT 1 CHECK (quantity > 0)
 );
 
+-- Item view counts, upserted in batches by the demo app's write-behind counter
+CREATE TABLE IF NOT EXISTS item_views (
+    item_id INTEGER PRIMARY KEY REFERENCES items(id),
+    views BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Notify listeners (the demo app's catalog index) of catalog changes:
+-- payload {"table": "items"|"users", "id": <row id>}
+CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+DECLARE
+    row_id INTEGER;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_id := OLD.id;
+    ELSE
+        row_id := NEW.id;
+    END IF;
+    PERFORM pg_notify('catalog_changes', json_build_object('table', TG_TABLE_NAME, 'id', row_id)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS items_notify_catalog_change ON items;
+CREATE TRIGGER items_notify_catalog_change
+    AFTER INSERT OR UPDATE OR DELETE ON items
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change();
+
+DROP TRIGGER IF EXISTS users_notify_catalog_change ON users;
+CREATE TRIGGER users_notify_catalog_change
+    AFTER UPDATE OF username OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change();
+
+-- Order statistics rollups, maintained at write time by statement-level
+-- triggers, so a multi-row INSERT or a COPY updates each rollup row once.
+-- Item revenue uses the item's price when the order was placed. Only
+-- inserts are rolled up: the app never updates or deletes orders.
+-- Orders are locked against inserts until the triggers exist and the
+-- rollups are backfilled, so none is counted twice or missed.
+BEGIN;
+LOCK TABLE orders, order_items IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS order_stats_by_user (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    orders BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(16, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS order_stats_by_item (
+    item_id INTEGER PRIMARY KEY REFERENCES items(id),
+    orders BIGINT NOT NULL DEFAULT 0,
+    quantity BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(16, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS order_stats_by_hour (
+    bucket TIMESTAMP PRIMARY KEY,
+    orders BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(16, 2) NOT NULL DEFAULT 0
+);
+
+-- Rows are upserted in key order so concurrent orders lock them in the same order
+CREATE OR REPLACE FUNCTION rollup_new_orders() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO order_stats_by_user (user_id, orders, revenue)
+    SELECT user_id, COUNT(*), COALESCE(SUM(total), 0)
+    FROM new_orders
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET orders = order_stats_by_user.orders + EXCLUDED.orders,
+        revenue = order_stats_by_user.revenue + EXCLUDED.revenue;
+
+    INSERT INTO order_stats_by_hour (bucket, orders, revenue)
+    SELECT date_trunc('hour', created_at), COUNT(*), COALESCE(SUM(total), 0)
+    FROM new_orders
+    GROUP BY 1
+    ORDER BY 1
+    ON CONFLICT (bucket) DO UPDATE
+    SET orders = order_stats_by_hour.orders + EXCLUDED.orders,
+        revenue = order_stats_by_hour.revenue + EXCLUDED.revenue;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_new_order_items() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO order_stats_by_item (item_id, orders, quantity, revenue)
+    SELECT n.item_id, COUNT(DISTINCT n.order_id), SUM(n.quantity), COALESCE(SUM(n.quantity * i.price), 0)
+    FROM new_order_items n
+    JOIN items i ON i.id = n.item_id
+    GROUP BY n.item_id
+    ORDER BY n.item_id
+    ON CONFLICT (item_id) DO UPDATE
+    SET orders = order_stats_by_item.orders + EXCLUDED.orders,
+        quantity = order_stats_by_item.quantity + EXCLUDED.quantity,
+        revenue = order_stats_by_item.revenue + EXCLUDED.revenue;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orders_rollup ON orders;
+CREATE TRIGGER orders_rollup
+    AFTER INSERT ON orders
+    REFERENCING NEW TABLE AS new_orders
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_new_orders();
+
+DROP TRIGGER IF EXISTS order_items_rollup ON order_items;
+CREATE TRIGGER order_items_rollup
+    AFTER INSERT ON order_items
+    REFERENCING NEW TABLE AS new_order_items
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_new_order_items();
+
+-- Backfill empty rollups from orders placed before they existed (item
+-- revenue at today's prices, which is all an existing database knows)
+INSERT INTO order_stats_by_user (user_id, orders, revenue)
+SELECT user_id, COUNT(*), COALESCE(SUM(total), 0)
+FROM orders
+WHERE user_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM order_stats_by_user)
+GROUP BY user_id;
+
+INSERT INTO order_stats_by_hour (bucket, orders, revenue)
+SELECT date_trunc('hour', created_at), COUNT(*), COALESCE(SUM(total), 0)
+FROM orders
+WHERE NOT EXISTS (SELECT 1 FROM order_stats_by_hour)
+GROUP BY 1;
+
+INSERT INTO order_stats_by_item (item_id, orders, quantity, revenue)
+SELECT oi.item_id, COUNT(DISTINCT oi.order_id), SUM(oi.quantity), COALESCE(SUM(oi.quantity * i.price), 0)
+FROM order_items oi
+JOIN items i ON i.id = oi.item_id
+WHERE NOT EXISTS (SELECT 1 FROM order_stats_by_item)
+GROUP BY oi.item_id;
+COMMIT;
+
 -- Insert sample data
 INSERT INTO users (username, email) VALUES 
     ('alice', 'alice@example.com'),
@@ -49,3 +185,10 @@ ON CONFLICT DO NOTHING;
 CREATE INDEX IF NOT EXISTS idx_items_user_id ON items(user_id);
 CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
 CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_item_id ON order_items(item_id);
+
+-- Top-N reads of the rollups
+CREATE INDEX IF NOT EXISTS idx_order_stats_by_user_revenue ON order_stats_by_user(revenue DESC);
+CREATE INDEX IF NOT EXISTS idx_order_stats_by_user_orders ON order_stats_by_user(orders DESC);
+CREATE INDEX IF NOT EXISTS idx_order_stats_by_item_revenue ON order_stats_by_item(revenue DESC);
+CREATE INDEX IF NOT EXISTS idx_order_stats_by_item_quantity ON order_stats_by_item(quantity DESC);